@@ -0,0 +1,106 @@
+"""Benchmark of the HRP recursive bisection (HRP._get_weights).
+
+Compares the array-based bisection with the previous implementation, which
+handled the clusters as lists of labels and sliced the covariance DataFrame
+at every split.
+
+    $ python -m benchmarks.hrp_bisection
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from hack_itau_quant.optimization import HRP
+
+
+def label_bisection(cov_matrix, seriation_columns):
+    # Implementação anterior de HRP._get_weights, mantida como referência
+    weights = pd.Series(1., index=seriation_columns)
+    parities = [seriation_columns]
+
+    while len(parities) > 0:
+        parities = [cluster[start:end]
+                    for cluster in parities
+                    for start, end in ((0, len(cluster) // 2), (len(cluster) // 2, len(cluster)))
+                    if len(cluster) > 1]
+
+        for subcluster in range(0, len(parities), 2):
+
+            left_cluster = parities[subcluster]
+            right_cluster = parities[subcluster + 1]
+
+            left_cov_matrix = cov_matrix[left_cluster].loc[left_cluster]
+            inversa_diagonal = 1 / np.diag(left_cov_matrix.values)
+            weights_left_cluster = inversa_diagonal / np.sum(inversa_diagonal)
+            vol_left_cluster = np.dot(weights_left_cluster, np.dot(
+                left_cov_matrix, weights_left_cluster))
+
+            right_cov_matrix = cov_matrix[right_cluster].loc[right_cluster]
+            inversa_diagonal = 1 / np.diag(right_cov_matrix.values)
+            weights_right_cluster = inversa_diagonal / np.sum(inversa_diagonal)
+            vol_right_cluster = np.dot(weights_right_cluster, np.dot(
+                right_cov_matrix, weights_right_cluster))
+
+            alocation_factor = 1 - vol_left_cluster / (vol_left_cluster + vol_right_cluster)
+
+            weights[left_cluster] *= alocation_factor
+            weights[right_cluster] *= 1 - alocation_factor
+
+    return weights[cov_matrix.columns.to_list()].to_numpy()
+
+
+def random_cov_matrix(n_assets, seed=0):
+
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(size=(n_assets, 5))
+    cov_matrix = (factors @ factors.T + np.diag(rng.uniform(1, 2, n_assets))) * 1e-4
+
+    columns = [f'asset_{i}' for i in range(n_assets)]
+
+    return pd.DataFrame(cov_matrix, index=columns, columns=columns)
+
+
+def timeit(function, repeat):
+
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-legacy-size', type=int, default=5000,
+                        help='skip the previous implementation above this number of assets')
+    args = parser.parse_args()
+
+    print(f"{'N':>6} {'array (s)':>12} {'labels (s)':>12} {'speedup':>9} {'max |diff|':>11}")
+
+    for n_assets in args.sizes:
+
+        cov_matrix = random_cov_matrix(n_assets)
+        hrp = HRP(cov_matrix)
+        seriation = np.random.default_rng(1).permutation(n_assets)
+
+        array_time, weights = timeit(lambda: hrp._get_weights(seriation), args.repeat)
+
+        if n_assets > args.max_legacy_size:
+            print(f"{n_assets:>6} {array_time:>12.5f} {'-':>12} {'-':>9} {'-':>11}")
+            continue
+
+        columns = cov_matrix.columns[seriation].to_list()
+        label_time, label_weights = timeit(lambda: label_bisection(cov_matrix, columns), 1)
+
+        print(f"{n_assets:>6} {array_time:>12.5f} {label_time:>12.5f} "
+              f"{label_time / array_time:>8.1f}x {np.abs(weights - label_weights).max():>11.2e}")
+
+
+if __name__ == '__main__':
+    main()
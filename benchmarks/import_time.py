@@ -0,0 +1,89 @@
+"""Benchmark of the import time of the package.
+
+Each module is imported in a fresh interpreter, with nothing loaded beforehand
+(cold) and with only NumPy loaded, the one dependency every module imports.
+The budget applies to the time beyond NumPy: SciPy and pandas are part of it,
+so a module that imports them at the top level shows their whole cost.
+
+Fails (exit code 1) when a module takes longer than its budget, imports an
+optional dependency (plotting libraries, scikit-learn, the Bloomberg API) or
+imports a dependency it should only load when used (SciPy and pandas for the
+optimizers), so it can be used as a regression check:
+
+    $ python -m benchmarks.import_time
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+# Módulo importado, tempo máximo (ms) além do NumPy e dependências carregadas só no uso
+BUDGETS = {
+    'hack_itau_quant': (5, ('numpy', 'scipy', 'pandas')),
+    'hack_itau_quant.optimization.markowitz': (30, ('scipy', 'pandas')),
+    'hack_itau_quant.optimization.quadratic_programming': (30, ('scipy', 'pandas')),
+    # HRP e o backtest usam SciPy e pandas em toda chamada
+    'hack_itau_quant.optimization.hrp': (1000, ()),
+    'hack_itau_quant.backtesting': (1000, ()),
+}
+
+OPTIONAL_DEPENDENCIES = ('matplotlib', 'plotly', 'seaborn', 'sklearn', 'xbbg', 'turingquant')
+
+CHILD = """
+import json, sys, time
+for module in {preload!r}:
+    __import__(module)
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'modules': sorted({{name.split('.')[0] for name in sys.modules}})}}))
+"""
+
+
+def measure(module, preload, repeat):
+    """Best import time of a module over fresh interpreters
+    Returns:
+        - (tuple) time in ms, top level packages loaded after the import
+    """
+    best, modules = np.inf, []
+    for _ in range(repeat):
+        code = CHILD.format(preload=preload, module=module)
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+
+        best = min(best, 1000 * result['elapsed'])
+        modules = result['modules']
+
+    return best, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<52} {'+numpy (ms)':>12} {'cold (ms)':>10} {'budget':>7}  unexpected deps")
+
+    failed = False
+    for module, (budget, deferred) in BUDGETS.items():
+
+        # O próprio NumPy é medido no processo sem pré-carga
+        elapsed, _ = measure(module, ('numpy',) if 'numpy' not in deferred else (), args.repeat)
+        cold, modules = measure(module, (), args.repeat)
+
+        unexpected = sorted(set(modules) & (set(OPTIONAL_DEPENDENCIES) | set(deferred)))
+
+        ok = elapsed <= budget and not unexpected
+        failed |= not ok
+
+        print(f"{module:<52} {elapsed:>12.1f} {cold:>10.1f} {budget:>7}  "
+              f"{', '.join(unexpected) or '-'}{'' if ok else '  FAIL'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
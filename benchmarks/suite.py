@@ -0,0 +1,218 @@
+"""Benchmark suite of the optimizers and of the backtester.
+
+Every case runs on a seeded factor model universe (benchmarks.synthetic) of
+N assets and T periods, T = max(min_periods, periods_per_asset * N) so the
+sample covariance is well conditioned. The wall time is the best of a few
+repeats; the peak memory is measured by tracemalloc on a separate run, as
+tracing slows the code down. The results are saved as JSON, together with
+the commit and the versions they were measured with, and two result files
+can be compared to spot regressions:
+
+    $ python -m benchmarks.suite --output before.json
+    $ python -m benchmarks.suite --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy
+
+from hack_itau_quant.backtesting import Backtesting
+from hack_itau_quant.denoising import Denoising
+from hack_itau_quant.efficient_frontier import EfficientFrontier
+from hack_itau_quant.markowitz_monte_carlo import MarkowitzMonteCarlo
+from hack_itau_quant.optimization import HRP, Markowitz
+from hack_itau_quant.optimization.quadratic_programming import QuadraticProgrammig
+
+from .synthetic import factor_model_returns, prices_from_returns
+
+
+class Universe:
+    """Returns of a synthetic universe and the estimates shared by the cases"""
+
+    def __init__(self, n_assets, n_periods, seed):
+
+        self.returns = factor_model_returns(n_assets, n_periods, seed=seed)
+        self.expected_returns = self.returns.mean()
+        self.cov_matrix = self.returns.cov()
+
+    @property
+    def n_assets(self):
+        return self.returns.shape[1]
+
+
+def markowitz(universe):
+
+    mu, cov = universe.expected_returns.to_numpy(), universe.cov_matrix.to_numpy()
+
+    return lambda: Markowitz(mu, cov).get_efficient_curve(100)
+
+
+def quadratic_programming(universe):
+
+    # Carteira de mínima variância: min x'Bx sujeito a sum(x) = 1
+    cov = universe.cov_matrix.to_numpy()
+    A, c = np.ones((1, universe.n_assets)), np.ones((1, 1))
+
+    return lambda: QuadraticProgrammig(2 * cov, A, c).solve()
+
+
+def hrp(universe):
+
+    return lambda: HRP(universe.cov_matrix).optimize()
+
+
+def denoising(universe):
+
+    return lambda: Denoising(universe.returns, n_facts=5, alpha=.5).denoised_covariance()
+
+
+def markowitz_monte_carlo(universe):
+
+    mu, cov = universe.expected_returns.to_numpy(), universe.cov_matrix.to_numpy()
+
+    return lambda: MarkowitzMonteCarlo(mu, cov, n_portfolios=10000, seed=0,
+                                       chunk_size=1000).get_max_sharpe()
+
+
+def max_loss(universe):
+
+    frontier = EfficientFrontier(universe.expected_returns, universe.cov_matrix)
+
+    # Um perfil por horizonte de 1 a 252 dias
+    return lambda: frontier.max_loss(-.06, np.arange(1, 253))
+
+
+def backtesting(universe):
+
+    prices = prices_from_returns(universe.returns)
+    rebalance_frequency = len(universe.returns) // 5
+
+    return lambda: Backtesting(prices, rebalance_frequency=rebalance_frequency,
+                               initial_investment=1, investment_on_rebalance=0,
+                               strategies=['equal_weight', 'min_variance', 'hrp']).run()
+
+
+# Caso e maior número de ativos em que roda por padrão
+CASES = {
+    'markowitz': (markowitz, 5000),
+    'quadratic_programming': (quadratic_programming, 5000),
+    'hrp': (hrp, 5000),
+    'denoising': (denoising, 5000),
+    'markowitz_monte_carlo': (markowitz_monte_carlo, 5000),
+    'max_loss': (max_loss, 5000),
+    'backtesting': (backtesting, 1000),
+}
+
+
+def measure(function, repeat):
+    """Best wall time over the repeats and peak traced memory of one more run
+    Returns:
+        - (tuple) seconds, peak memory in MB
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak / 2 ** 20
+
+
+def get_metadata(args):
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+    }
+
+
+def compare(results, baseline_file):
+    """Print the ratios of the times and peaks to those of a previous run"""
+    with open(baseline_file) as file:
+        baseline = {(row['case'], row['n_assets']): row for row in json.load(file)['results']}
+
+    print(f"\nvs {baseline_file}")
+    print(f"{'case':<24} {'N':>6} {'time ratio':>11} {'memory ratio':>13}")
+
+    for row in results:
+        before = baseline.get((row['case'], row['n_assets']))
+        if before is None:
+            continue
+
+        print(f"{row['case']:<24} {row['n_assets']:>6} {row['seconds'] / before['seconds']:>10.2f}x "
+              f"{row['peak_memory_mb'] / max(before['peak_memory_mb'], 1e-9):>12.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 50, 500, 5000])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--min-periods', type=int, default=1000)
+    parser.add_argument('--periods-per-asset', type=float, default=2)
+    parser.add_argument('--max-assets', type=int, default=None,
+                        help='run every case up to this number of assets, overriding their defaults')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run')
+    args = parser.parse_args()
+
+    print(f"{'case':<24} {'N':>6} {'T':>7} {'time (s)':>10} {'peak (MB)':>10}")
+
+    results = []
+    for n_assets in args.sizes:
+
+        n_periods = max(args.min_periods, int(args.periods_per_asset * n_assets))
+        universe = Universe(n_assets, n_periods, args.seed)
+
+        for case in args.cases:
+
+            setup, max_assets = CASES[case]
+            if n_assets > (args.max_assets or max_assets):
+                continue
+
+            seconds, peak = measure(setup(universe), args.repeat)
+
+            results.append({'case': case, 'n_assets': n_assets, 'n_periods': n_periods,
+                            'seconds': seconds, 'peak_memory_mb': peak})
+
+            print(f"{case:<24} {n_assets:>6} {n_periods:>7} {seconds:>10.4f} {peak:>10.1f}")
+            sys.stdout.flush()
+
+    with open(args.output, 'w') as file:
+        json.dump({'metadata': get_metadata(args), 'results': results}, file, indent=2)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
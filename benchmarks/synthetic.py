@@ -0,0 +1,57 @@
+"""Seeded synthetic universes for the benchmarks.
+
+Returns follow a factor model, r = B f + e, with a market factor that every
+asset loads on plus a few sector-like factors, so the covariance matrix has
+the spiked spectrum of real returns (a few large eigenvalues over a
+Marcenko-Pastur bulk) and HRP finds clusters in it.
+"""
+import numpy as np
+import pandas as pd
+
+
+def factor_model_returns(n_assets, n_periods, n_factors=5, seed=0,
+                         factor_volatility=.01, idiosyncratic_volatility=.015, drift=3e-4):
+    """Daily returns of a factor model
+    Args:
+        - n_assets (int): number of assets
+        - n_periods (int): number of periods
+        - n_factors (int): number of factors, the first one is the market
+        - seed (int): seed of the random generator
+        - factor_volatility (float): daily volatility of the factors
+        - idiosyncratic_volatility (float): mean daily volatility of the residuals
+        - drift (float): mean daily return of the assets
+    Returns:
+        - (pd.DataFrame) returns (periods x assets) indexed by business days
+    """
+    rng = np.random.default_rng(seed)
+
+    # Mercado com cargas positivas, demais fatores concentrados em "setores"
+    loadings = np.zeros((n_assets, n_factors))
+    loadings[:, 0] = rng.uniform(.5, 1.5, n_assets)
+    if n_factors > 1:
+        sectors = rng.integers(1, n_factors, n_assets)
+        loadings[np.arange(n_assets), sectors] = rng.uniform(.5, 1.5, n_assets)
+
+    factors = rng.normal(0, factor_volatility, (n_periods, n_factors))
+    residual_volatilities = idiosyncratic_volatility * rng.uniform(.5, 1.5, n_assets)
+    residuals = rng.normal(0, 1, (n_periods, n_assets)) * residual_volatilities
+
+    returns = drift + factors @ loadings.T + residuals
+
+    return pd.DataFrame(returns, index=pd.bdate_range('2000-01-03', periods=n_periods),
+                        columns=[f'asset_{i}' for i in range(n_assets)])
+
+
+def prices_from_returns(returns, initial_price=100.):
+    """Close prices whose pct_change()[1:] are the returns
+    Args:
+        - returns (pd.DataFrame): returns (periods x assets)
+        - initial_price (float): price of every asset before the first return
+    Returns:
+        - (pd.DataFrame) prices (periods + 1 x assets)
+    """
+    growth = np.vstack((np.ones(returns.shape[1]), np.cumprod(1 + returns.to_numpy(), axis=0)))
+    index = returns.index[:1] - pd.offsets.BDay(1)
+
+    return pd.DataFrame(initial_price * growth, index=index.append(returns.index),
+                        columns=returns.columns)
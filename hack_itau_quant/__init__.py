@@ -1,4 +1,12 @@
-from .optimization import HRP
-from .efficient_frontier import EfficientFrontier
-from .bloomberg_data import BloombergData
-from .denoising import Denoising
+from ._lazy import attach
+
+# Importados no primeiro acesso: quem só usa os otimizadores não precisa de
+# plotly, scikit-learn ou do terminal da Bloomberg
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'HRP': '.optimization',
+    'EfficientFrontier': '.efficient_frontier',
+    'BloombergData': '.bloomberg_data',
+    'Denoising': '.denoising',
+}, submodules=('analytics', 'backtesting', 'bloomberg_data', 'covariance', 'data_sources',
+               'denoising', 'efficient_frontier', 'hrp', 'markowitz_monte_carlo', 'optimization',
+               'profiling', 'strategies', 'sweep'))
@@ -0,0 +1,33 @@
+import importlib
+
+
+def attach(package: str, attributes: dict, submodules: tuple = ()):
+    """Module level __getattr__ and __dir__ of a package whose public classes are
+    only imported when first used, so importing the package does not import the
+    optional dependencies (plotly, scikit-learn, xbbg, ...) of every submodule
+    Args:
+        - package (str): __name__ of the package
+        - attributes (dict): public name -> relative name of the submodule defining it
+        - submodules (tuple): names of the submodules also loaded on attribute access
+    Returns:
+        - (tuple) __getattr__, __dir__ and __all__ of the package
+    """
+    def __getattr__(name):
+
+        if name in attributes:
+            value = getattr(importlib.import_module(attributes[name], package), name)
+        elif name in submodules:
+            value = importlib.import_module('.' + name, package)
+        else:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+        # Guarda no módulo: os próximos acessos não passam mais por __getattr__
+        setattr(importlib.import_module(package), name, value)
+
+        return value
+
+    def __dir__():
+        return sorted(set(vars(importlib.import_module(package))) | set(attributes) |
+                      set(submodules))
+
+    return __getattr__, __dir__, list(attributes)
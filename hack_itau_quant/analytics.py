@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+
+
+class PerformanceAnalytics:
+    """Performance statistics of the portfolios of several strategies, e.g. the
+    output of Backtesting. Every statistic is a running NumPy reduction over the
+    columns, so the returns can be given at once or in chunks of consecutive
+    periods (incremental mode), updating the statistics as new days are
+    appended:
+
+        - mean and variance of the returns, merged chunk by chunk (Chan et al.)
+        - log growth and its running peak, which give the drawdowns
+        - the last rolling_window - 1 returns, so the rolling statistics of a
+          chunk are differences of cumulative sums
+
+    With a transaction cost, the statistics are also computed on the returns
+    net of the cost of the turnover at each rebalance.
+    """
+
+    def __init__(self, periods_per_year: int = 252, risk_free: float = 0.,
+                 rolling_window: int = 63, transaction_cost: float = 0.):
+        """
+        Args:
+            - periods_per_year (int): number of periods used to annualize the statistics
+            - risk_free (float): annual risk free rate used by the Sharpe ratios
+            - rolling_window (int): number of periods of the rolling statistics
+            - transaction_cost (float): cost paid per unit of turnover, e.g. 1e-3 for 10 bps
+        """
+        self._periods_per_year = periods_per_year
+        self._risk_free = risk_free
+        self._rolling_window = rolling_window
+        self._transaction_cost = transaction_cost
+
+        self._columns = None
+        self._n_obs = 0
+
+    @staticmethod
+    def from_backtest(backtesting, values, **parameters):
+        """Statistics of the output of Backtesting.run
+        Args:
+            - backtesting (Backtesting): backtest that produced the values
+            - values (pd.DataFrame): portfolio values given by backtesting.run
+            - parameters: parameters of PerformanceAnalytics
+        Returns:
+            - (PerformanceAnalytics) statistics of the strategies
+        """
+        analytics = PerformanceAnalytics(**parameters)
+        analytics.update(backtesting.get_returns(values), backtesting.turnover)
+
+        return analytics
+
+    @property
+    def n_obs(self):
+        return self._n_obs
+
+    def update(self, returns: pd.DataFrame, turnover: pd.DataFrame = None):
+        """Append the returns of the following periods
+        Args:
+            - returns (pd.DataFrame): return of each strategy at each period, net of
+              investments (Backtesting.get_returns)
+            - turnover (pd.DataFrame or None): turnover of each strategy at the rebalance
+              dates, indexed by the first period held (Backtesting.turnover)
+        Returns:
+            - (PerformanceAnalytics) self, updated
+        """
+        if self._columns is None:
+            self._initialize(returns.columns)
+        elif not returns.columns.equals(self._columns):
+            raise ValueError("returns must have the same columns as the previous chunks")
+
+        gross = returns.to_numpy(dtype=float)
+
+        traded = np.zeros_like(gross)
+        if turnover is not None:
+            traded = turnover.reindex(index=returns.index, columns=returns.columns,
+                                      fill_value=0).to_numpy(dtype=float)
+
+        # Retornos brutos e líquidos são reduzidos juntos, lado a lado
+        values = gross
+        if self._transaction_cost:
+            values = np.hstack((gross, (1 + gross) * (1 - self._transaction_cost * traded) - 1))
+
+        self._update_moments(values)
+        self._update_drawdowns(values)
+        self._update_rolling(values)
+
+        self._turnover += traded.sum(axis=0)
+        self._index.append(returns.index)
+        self._n_obs += len(values)
+
+        return self
+
+    def summary(self) -> pd.DataFrame:
+        """Statistics of every strategy over the periods appended so far
+        Returns:
+            - (pd.DataFrame) one row per strategy. Columns prefixed by net_ are
+              computed on the returns net of transaction costs
+        """
+        n_strategies = len(self._columns)
+
+        annual_return = self._mean * self._periods_per_year
+        annual_volatility = np.sqrt(self._m2 / max(self._n_obs - 1, 1) * self._periods_per_year)
+        sharpe = (annual_return - self._risk_free) / annual_volatility
+
+        statistics = {
+            'total_return': np.expm1(self._log_growth),
+            'annual_return': annual_return,
+            'annual_volatility': annual_volatility,
+            'sharpe': sharpe,
+            'max_drawdown': self._max_drawdown,
+        }
+
+        df = pd.DataFrame({name: value[:n_strategies] for name, value in statistics.items()},
+                          index=self._columns)
+
+        df['annual_turnover'] = self._turnover / max(self._n_obs, 1) * self._periods_per_year
+
+        for name, value in statistics.items():
+            df['net_' + name] = value[self._get_net_columns()]
+
+        return df
+
+    def drawdown(self, net: bool = False) -> pd.DataFrame:
+        """Drawdown of each strategy at each period, relative to its running peak
+        Args:
+            - net (bool): use the returns net of transaction costs
+        """
+        return self._get_series(self._drawdowns, net)
+
+    def rolling_volatility(self, net: bool = False) -> pd.DataFrame:
+        """Annualized volatility of each strategy over the last rolling_window periods
+        Args:
+            - net (bool): use the returns net of transaction costs
+        """
+        return self._get_series(self._rolling_volatilities, net)
+
+    def rolling_sharpe(self, net: bool = False) -> pd.DataFrame:
+        """Sharpe ratio of each strategy over the last rolling_window periods
+        Args:
+            - net (bool): use the returns net of transaction costs
+        """
+        return self._get_series(self._rolling_sharpes, net)
+
+    def _get_net_columns(self):
+
+        # Sem custos de transação os retornos líquidos são os brutos
+        n_strategies = len(self._columns)
+        if self._transaction_cost:
+            return slice(n_strategies, 2 * n_strategies)
+
+        return slice(0, n_strategies)
+
+    def _initialize(self, columns):
+
+        n_columns = 2 * len(columns) if self._transaction_cost else len(columns)
+
+        self._columns = columns
+        self._index = []
+
+        self._mean = np.zeros(n_columns)
+        self._m2 = np.zeros(n_columns)
+
+        self._log_growth = np.zeros(n_columns)
+        self._peak = np.zeros(n_columns)
+        self._max_drawdown = np.zeros(n_columns)
+        self._drawdowns = []
+
+        self._tail = np.empty((0, n_columns))
+        self._rolling_volatilities = []
+        self._rolling_sharpes = []
+
+        self._turnover = np.zeros(len(columns))
+
+    def _update_moments(self, values):
+
+        n_chunk = len(values)
+        if n_chunk == 0:
+            return
+
+        n_total = self._n_obs + n_chunk
+        chunk_mean = values.mean(axis=0)
+        delta = chunk_mean - self._mean
+
+        self._m2 += ((values - chunk_mean) ** 2).sum(axis=0) + \
+            delta ** 2 * self._n_obs * n_chunk / n_total
+        self._mean += delta * n_chunk / n_total
+
+    def _update_drawdowns(self, values):
+
+        log_growth = self._log_growth + np.cumsum(np.log1p(values), axis=0)
+
+        # O pico parte do valor antes do primeiro período (crescimento 1)
+        peak = np.maximum.accumulate(np.vstack((self._peak, log_growth)), axis=0)[1:]
+        drawdowns = np.expm1(log_growth - peak)
+
+        if len(values) > 0:
+            self._log_growth = log_growth[-1]
+            self._peak = peak[-1]
+            self._max_drawdown = np.minimum(self._max_drawdown, drawdowns.min(axis=0))
+
+        self._drawdowns.append(drawdowns)
+
+    def _update_rolling(self, values):
+
+        window = self._rolling_window
+        history = np.vstack((self._tail, values))
+        n_rows, n_columns = history.shape
+
+        # Deslocar pela média não muda a variância e evita cancelamento nas somas acumuladas
+        centered = history - self._mean
+
+        sums = np.zeros((n_rows + 1, n_columns))
+        squares = np.zeros((n_rows + 1, n_columns))
+        np.cumsum(centered, axis=0, out=sums[1:])
+        np.cumsum(np.square(centered, out=centered), axis=0, out=squares[1:])
+
+        rolling_mean = np.full((len(values), n_columns), np.nan)
+        rolling_variance = np.full_like(rolling_mean, np.nan)
+
+        # Só os períodos do bloco com uma janela completa, os anteriores ficam NaN
+        first = max(window - len(self._tail) - 1, 0)
+        ends = slice(len(self._tail) + 1 + first, n_rows + 1)
+        starts = slice(ends.start - window, n_rows + 1 - window)
+
+        if first < len(values):
+            window_sums = sums[ends] - sums[starts]
+            window_squares = squares[ends] - squares[starts]
+
+            rolling_mean[first:] = window_sums / window + self._mean
+            rolling_variance[first:] = np.maximum(window_squares - window_sums ** 2 / window, 0) \
+                / max(window - 1, 1)
+
+        rolling_volatility = np.sqrt(rolling_variance * self._periods_per_year)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rolling_sharpe = (rolling_mean * self._periods_per_year - self._risk_free) / \
+                rolling_volatility
+
+        self._rolling_volatilities.append(rolling_volatility)
+        self._rolling_sharpes.append(rolling_sharpe)
+
+        self._tail = history[max(len(history) - window + 1, 0):]
+
+    def _get_series(self, chunks, net):
+
+        if self._columns is None:
+            return pd.DataFrame()
+
+        values = np.vstack(chunks)
+        values = values[:, self._get_net_columns() if net else slice(0, len(self._columns))]
+
+        return pd.DataFrame(values, index=self._index[0].append(self._index[1:]),
+                            columns=self._columns)
@@ -1,19 +1,42 @@
-# Biblioteca do Turing USP implementada por nós!
-from turingquant.optimizers import Markowitz
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import copy
+import os
+
 import pandas as pd
 import numpy as np
-from .hrp import HRP
+from . import profiling
+from .covariance import StreamingCovariance
+from .strategies import RebalanceInputs, get_strategy
 
 
 class Backtesting:
 
-    def __init__(self, prices, rebalance_frequency, initial_investment, investment_on_rebalance):
+    DEFAULT_STRATEGIES = ['equal_weight', 'markowitz', 'hrp']
+
+    def __init__(self, prices, rebalance_frequency, initial_investment, investment_on_rebalance,
+                 window=None, halflife=None, strategies=None, denoising=None):
+        """
+        Args:
+            - prices (pd.DataFrame): close prices of the assets
+            - rebalance_frequency (int): number of periods between rebalances
+            - initial_investment (float): value invested at the first rebalance
+            - investment_on_rebalance (float): value added at each rebalance
+            - window (int or None): estimation window length, None for an expanding window
+            - halflife (float or None): halflife of exponentially weighted estimates
+            - strategies (list or None): Strategy instances or registered keys,
+              defaults to equal weight, Markowitz and HRP
+            - denoising (RollingDenoising or None): denoiser applied to the covariance
+              matrix of every rebalance date, with the effective sample size of the
+              estimate (of the exponential weights when halflife is given)
+        """
 
         self._prices = prices
 
         returns = prices.pct_change()[1:]
 
         self._returns = returns
+        self._returns_array = returns.to_numpy()
         self._n_assets = returns.shape[1]
         self._n_periods = returns.shape[0]
 
@@ -21,122 +44,280 @@ class Backtesting:
         self._initial_investment = initial_investment
         self._investment_on_rebalance = investment_on_rebalance
 
-    def run(self):
-        cumulative_equal_weights = list()
-        cumulative_markowitz = list()
-        cumulative_hrp = list()
-
-        initial_value = self._initial_investment
-
-        for t in range(self._rebalance_frequency + 2, self._n_periods, self._rebalance_frequency):
-
-            cov_matrix = self._returns[:t].cov()
-            returns = self._returns[:t]
-            prices = self._prices[:t]
-
-            cumulative_equal_weights.append(
-                self._get_daily_returns(weights=Backtesting.get_equal_weights(self._n_assets),
-                                        date_index=t, initial_value=initial_value,
-                                        freq=self._rebalance_frequency)
-            )
-            cumulative_markowitz.append(
-                self._get_daily_returns(weights=Backtesting.get_markowitz_weights(prices),
-                                        date_index=t, initial_value=initial_value,
-                                        freq=self._rebalance_frequency)
-            )
-
-            cumulative_hrp.append(
-                self._get_daily_returns(weights=Backtesting.get_hrp_weights(cov_matrix),
-                                        date_index=t, initial_value=initial_value,
-                                        freq=self._rebalance_frequency)
-            )
-
-            initial_value_equal_weight = cumulative_equal_weights[-1][-1] + \
-                self._investment_on_rebalance
-            initial_value_markowitz = cumulative_markowitz[-1][-1] + \
-                self._investment_on_rebalance
-            initial_value_hrp = cumulative_hrp[-1][-1] + \
-                self._investment_on_rebalance
-
-        prices_left = self._n_periods % self._rebalance_frequency
-        has_prices_left = prices_left <= self._rebalance_frequency
-        if has_prices_left:
-
-            t = self._n_periods - prices_left
-
-            cumulative_equal_weights.append(
-                self._get_daily_returns(weights=Backtesting.get_equal_weights(self._n_assets),
-                                        date_index=t, initial_value=initial_value,
-                                        freq=self._rebalance_frequency)
-            )
-            cumulative_markowitz.append(
-                self._get_daily_returns(weights=Backtesting.get_markowitz_weights(prices),
-                                        date_index=t, initial_value=initial_value,
-                                        freq=self._rebalance_frequency)
-            )
-
-            cumulative_hrp.append(
-                self._get_daily_returns(weights=Backtesting.get_hrp_weights(cov_matrix),
-                                        date_index=t, initial_value=initial_value,
-                                        freq=self._rebalance_frequency)
-            )
-
-        cumulative_equal_weights = Backtesting.to_numpy_array(cumulative_equal_weights)
-        cumulative_markowitz = Backtesting.to_numpy_array(cumulative_markowitz)
-        cumulative_hrp = Backtesting.to_numpy_array(cumulative_hrp)
-
-        df = pd.DataFrame()
-
-        df['Equal Weight'] = cumulative_equal_weights
-        df['Markowitz'] = cumulative_markowitz
-        df['HRP'] = cumulative_hrp
-
-        df.index = self._prices.index[-df.shape[0]:]
+        self._window = window
+        self._halflife = halflife
+        self._denoising = denoising
+
+        if strategies is None:
+            strategies = Backtesting.DEFAULT_STRATEGIES
+
+        self._strategies = [get_strategy(strategy) for strategy in strategies]
+
+        self.turnover = None
+
+        names = [strategy.name for strategy in self._strategies]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Strategy names must be unique, got {names}")
+
+    def run(self, n_jobs=1, backend='process'):
+        """Run the backtest. At each rebalance date the strategies are estimated
+        with the returns available up to that date and held until the next one.
+
+        The weights of different rebalance dates don't depend on each other, so
+        with n_jobs > 1 they are computed on a pool of workers, at most 2 * n_jobs
+        dates at a time, and the portfolio values are chained in date order as the
+        results arrive. Strategies that draw from
+        numpy's global random state are not reproducible across workers.
+        Args:
+            - n_jobs (int): number of workers, -1 to use every core
+            - backend (str): 'process' or 'thread' pool
+        Returns:
+            - (pd.DataFrame) value of each strategy's portfolio at each period. The
+              turnover of each rebalance is kept in ``turnover``. Inside a
+              profiling.Profiler the time of each stage is recorded per rebalance date.
+              Every per rebalance output (turnover, profiler steps, RebalanceInputs.date)
+              is labelled by the first period held with the new weights
+        """
+        # Estado de uma execução anterior não pode vazar para a próxima
+        for strategy in self._strategies:
+            strategy.reset()
+
+        rebalance_dates = self._get_rebalance_dates()
+        inputs = self._get_rebalance_inputs(rebalance_dates)
+
+        weights = self._get_weights(inputs, n_jobs, backend)
+
+        return self._chain_values(rebalance_dates, weights)
+
+    def get_returns(self, values):
+        """Returns of each strategy, net of the investments made on rebalance
+        Args:
+            - values (pd.DataFrame): portfolio values given by run
+        Returns:
+            - (pd.DataFrame) return of each strategy at each period
+        """
+        rebalance_dates = self._get_rebalance_dates()
+
+        values_array = values.to_numpy()
+
+        invested = np.empty_like(values_array)
+        invested[0] = self._initial_investment
+        invested[1:] = values_array[:-1]
+        invested[np.subtract(rebalance_dates[1:], rebalance_dates[0])] += self._investment_on_rebalance
+
+        return pd.DataFrame(values_array / invested - 1, index=values.index, columns=values.columns)
+
+    def _replace(self, **parameters):
+        """Copy of the backtest with other parameters, sharing the prices and returns
+        Args:
+            - parameters: new values of the constructor's parameters, except prices and strategies
+        Returns:
+            - (Backtesting) copy of the backtest
+        """
+        backtesting = copy.copy(self)
+
+        for name, value in parameters.items():
+            setattr(backtesting, '_' + name, value)
+
+        return backtesting
+
+    def _get_weights(self, inputs, n_jobs=1, backend='process'):
+        """Calculate the weights of every strategy at each rebalance date
+        Args:
+            - inputs (iterable): RebalanceInputs of each rebalance date
+            - n_jobs (int): number of workers, -1 to use every core
+            - backend (str): 'process' or 'thread' pool
+        Returns:
+            - (iterable) weights (strategies x assets) of each date, in the order of inputs
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+
+        if n_jobs == 1:
+            return (_compute_weights(self._strategies, date_inputs) for date_inputs in inputs)
+
+        executors = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+        if backend not in executors:
+            raise ValueError(f"backend must be one of {list(executors)}")
+
+        # Estratégias com estado ficam no processo principal, na ordem das datas
+        pooled = [strategy for strategy in self._strategies if not strategy.sequential]
+        sequential = [strategy for strategy in self._strategies if strategy.sequential]
+
+        return self._map_weights(executors[backend], n_jobs, inputs, pooled, sequential)
+
+    def _map_weights(self, executor_class, n_jobs, inputs, pooled, sequential):
+        """Weights of the pooled strategies computed by a pool of workers, with at
+        most 2 * n_jobs dates in flight, merged with the weights of the sequential
+        strategies, computed in the main process
+        Args:
+            - executor_class (type): ProcessPoolExecutor or ThreadPoolExecutor
+            - n_jobs (int): number of workers
+            - inputs (iterable): RebalanceInputs of each rebalance date
+            - pooled (list): strategies computed by the workers
+            - sequential (list): strategies computed in date order in the main process
+        Returns:
+            - (generator) weights (strategies x assets) of each date, in the order of inputs
+        """
+        # Os preços e retornos da janela só são enviados se alguma estratégia os lê
+        uses_history = any(strategy.uses_history for strategy in pooled)
+
+        with executor_class(max_workers=n_jobs) as executor:
+            pending = deque()
+
+            for date_inputs in inputs:
+                pooled_inputs = date_inputs if uses_history else date_inputs.without_history()
+
+                pending.append((executor.submit(_compute_weights, pooled, pooled_inputs),
+                                _compute_weights(sequential, date_inputs)))
+
+                # As entradas de cada data ficam na memória até seu resultado ser consumido
+                if len(pending) >= 2 * n_jobs:
+                    future, sequential_weights = pending.popleft()
+                    yield self._merge_weights(pooled, future.result(), sequential, sequential_weights)
+
+            for future, sequential_weights in pending:
+                yield self._merge_weights(pooled, future.result(), sequential, sequential_weights)
+
+    def _merge_weights(self, pooled, pooled_weights, sequential, sequential_weights):
+        """Weights of a date computed separately for the pooled and the sequential
+        strategies, in the order of the strategies of the backtest
+        Returns:
+            - (np.array) weights (strategies x assets)
+        """
+        weights_by_strategy = dict(zip(pooled, pooled_weights))
+        weights_by_strategy.update(zip(sequential, sequential_weights))
+
+        return np.vstack([weights_by_strategy[strategy] for strategy in self._strategies])
+
+    def _chain_values(self, rebalance_dates, weights):
+        """Chain the portfolio values through the rebalance windows. The turnover
+        of each rebalance, sum(|new weights - weights drifted since the previous
+        rebalance|), is kept in ``turnover``
+        Args:
+            - rebalance_dates (list): increasing indexes of the returns
+            - weights (iterable): weights (strategies x assets) of each rebalance date
+        Returns:
+            - (pd.DataFrame) value of each strategy's portfolio at each period
+        """
+        first_date = rebalance_dates[0]
+        columns = [strategy.name for strategy in self._strategies]
+
+        values = np.empty((len(self._strategies), self._n_periods - first_date))
+        turnover = np.empty((len(rebalance_dates), len(self._strategies)))
+
+        initial_values = np.full(len(self._strategies), float(self._initial_investment))
+        drifted_weights = np.zeros((len(self._strategies), self._n_assets))
+
+        weights = iter(weights)
+
+        for i, t in enumerate(rebalance_dates):
+
+            # Com n_jobs=1 os pesos são calculados sob demanda, dentro da etapa da data
+            with profiling.step(self._returns.index[t]):
+
+                date_weights = next(weights)
+                end = min(t + self._rebalance_frequency, self._n_periods)
+
+                with profiling.timer('backtesting.simulate_paths'):
+                    window_values = Backtesting.simulate_paths(self._returns_array[t:end],
+                                                               date_weights, initial_values)
+            values[:, t - first_date:end - first_date] = window_values
+
+            turnover[i] = np.abs(date_weights - drifted_weights).sum(axis=1)
+
+            # Pesos ao fim da janela, após a variação dos preços
+            drifted_weights = date_weights * np.prod(1 + self._returns_array[t:end], axis=0)
+            drifted_weights /= drifted_weights.sum(axis=1, keepdims=True)
+
+            initial_values = window_values[:, -1] + self._investment_on_rebalance
+
+        self.turnover = pd.DataFrame(turnover, index=self._returns.index[rebalance_dates],
+                                     columns=columns)
+
+        df = pd.DataFrame(values.T, index=self._returns.index[first_date:], columns=columns)
 
         return df
 
-    def _get_daily_returns(self, weights, date_index, initial_value, freq):
+    def _get_rebalance_dates(self):
 
-        initial_values = np.multiply(initial_value, weights)
+        rebalance_dates = list(range(self._rebalance_frequency, self._n_periods,
+                                     self._rebalance_frequency))
 
-        cumulative_returns = self._returns.copy()
+        if len(rebalance_dates) == 0:
+            raise ValueError("rebalance_frequency must be smaller than the number of periods")
 
-        for value, stock in zip(initial_values, range(len(self._returns.columns))):
-            cumulative_returns.iloc[:, stock] = value * (
-                1 + self._returns.iloc[date_index - freq: date_index, stock]).cumprod()
+        return rebalance_dates
 
-        returns = np.sum(
-            cumulative_returns.iloc[date_index - freq: date_index], axis=1)
+    def _get_rebalance_inputs(self, rebalance_dates):
+        """Advance the covariance estimator through the rebalance dates. The denoiser,
+        if any, is reset first, so the estimates don't depend on previous passes
+        Args:
+            - rebalance_dates (list): increasing indexes of the returns
+        Returns:
+            - (generator) RebalanceInputs estimated with the returns before each date
+        """
+        estimator = StreamingCovariance(self._n_assets, window=self._window, halflife=self._halflife)
+        columns = self._returns.columns
+        last_t = 0
 
-        return list(returns)
+        if self._denoising is not None:
+            self._denoising.reset()
 
-    @staticmethod
-    def get_markowitz_weights(prices):
+        for t in rebalance_dates:
 
-        markowitz = Markowitz(prices)
-        weights = markowitz.best_portfolio('volatility')
+            date = self._returns.index[t]
 
-        return weights
+            with profiling.timer('backtesting.covariance', step=date):
+                estimator.update(self._returns_array[last_t:t])
+                last_t = t
 
-    @staticmethod
-    def get_equal_weights(n_assets):
+                cov_matrix = estimator.covariance()
 
-        return np.ones(n_assets) / n_assets
+            if self._denoising is not None:
+                with profiling.timer('backtesting.denoising', step=date):
+                    cov_matrix = self._denoising.denoise(cov_matrix, estimator.effective_n_obs)
 
-    @staticmethod
-    def get_hrp_weights(cov_matrix):
-        hrp = HRP(cov_matrix)
-        weights = hrp.optimize()
+            start = self._get_window_start(t)
 
-        return weights
+            yield RebalanceInputs(date=date,
+                                  prices=self._prices[start:t + 1],
+                                  returns=self._returns[start:t],
+                                  cov_matrix=pd.DataFrame(cov_matrix, index=columns, columns=columns),
+                                  expected_returns=pd.Series(estimator.mean(), index=columns))
+
+    def _get_window_start(self, t):
+
+        if self._window is None:
+            return 0
+
+        return max(t - self._window, 0)
 
     @staticmethod
-    def to_numpy_array(lists):
+    def simulate_paths(returns, weights, initial_values):
+        """Simulate the value of several buy-and-hold portfolios over a window
+        Args:
+            - returns (np.array): returns of the window (periods x assets)
+            - weights (np.array): weights of each portfolio (portfolios x assets)
+            - initial_values (np.array): value invested in each portfolio
+        Returns:
+            - (np.array) value of each portfolio at the end of each period (portfolios x periods)
+        """
+        growth = np.cumprod(1 + returns, axis=0)
+
+        holdings = np.asarray(weights) * np.reshape(initial_values, (-1, 1))
+
+        return np.einsum('sa,pa->sp', holdings, growth)
+
 
-        final_list = []
+def _compute_weights(strategies, inputs):
+    # Função no nível do módulo para poder ser enviada aos processos
+    if not strategies:
+        return np.empty((0, inputs.n_assets))
 
-        for l in lists:
-            for item in l:
-                final_list.append(item)
+    weights = []
+    for strategy in strategies:
+        with profiling.timer('strategy.' + strategy.name, step=inputs.date):
+            weights.append(strategy.get_weights(inputs))
 
-        return np.array(final_list)
+    return np.vstack(weights)
@@ -1,14 +1,31 @@
+import os
+
 import pandas as pd
-from xbbg import blp, pipeline, const
+from .data_sources import BloombergBackend, CachedDataSource
 
 class BloombergData:
 
-    def get_hack_data():
-
-        df_IBOV = blp.bdh('BOVV11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
-        df_SP   = blp.bdh('SPXI11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
-        df_IMAB = blp.bdh('IMAB11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
-        df_IRFM = blp.bdh('IRFM11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
+    # Séries já baixadas ficam guardadas em Parquet e não são pedidas de novo ao terminal
+    DEFAULT_STORE = os.path.join(os.path.expanduser('~'), '.hack_itau_quant', 'prices')
+
+    @staticmethod
+    def get_hack_data(source=None):
+        """Daily returns of the four funds of the hackathon, with the IMA-B and
+        IRF-M indexes before the listing of their ETFs
+        Args:
+            - source (CachedDataSource or None): source of the prices, defaults to the
+              Bloomberg terminal cached in DEFAULT_STORE. Use a FakeTerminalBackend to
+              run offline
+        Returns:
+            - (pd.DataFrame) daily returns
+        """
+        if source is None:
+            source = CachedDataSource(BloombergBackend(), BloombergData.DEFAULT_STORE)
+
+        df_IBOV = source.bdh('BOVV11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
+        df_SP   = source.bdh('SPXI11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
+        df_IMAB = source.bdh('IMAB11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
+        df_IRFM = source.bdh('IRFM11 BZ Equity', 'PX_LAST', '2017-12-29', '2021-04-30')
 
         df_IBOV.index = pd.to_datetime(df_IBOV.index)
         df_SP.index = pd.to_datetime(df_SP.index)
@@ -20,13 +37,13 @@ class BloombergData:
         df_IMAB = df_IMAB.pct_change().dropna()
         df_IRFM = df_IRFM.pct_change().dropna()
 
-        df_IMAB_indice = blp.bdh('BZRFIMAB index', 'PX_LAST', '2017-12-30', '2019-05-20')
+        df_IMAB_indice = source.bdh('BZRFIMAB index', 'PX_LAST', '2017-12-30', '2019-05-20')
         df_IMAB_indice.index = pd.to_datetime(df_IMAB_indice.index)
         df_IMAB_indice = df_IMAB_indice.rename(columns ={'BZRFIMAB index' : 'IMAB11 BZ Equity'})
         df_IMAB_indice = df_IMAB_indice.pct_change().dropna()
         df_IMAB = pd.concat([df_IMAB_indice/1000, df_IMAB])
 
-        df_IRFM_indice = blp.bdh('BZRFIRFM Index', 'PX_LAST', '2017-12-30', '2019-09-23')
+        df_IRFM_indice = source.bdh('BZRFIRFM Index', 'PX_LAST', '2017-12-30', '2019-09-23')
         df_IRFM_indice.index = pd.to_datetime(df_IRFM_indice.index)
         df_IRFM_indice = df_IRFM_indice.rename(columns ={'BZRFIRFM Index' : 'IRFM11 BZ Equity'})
         df_IRFM_indice = df_IRFM_indice.pct_change().dropna()
@@ -34,4 +51,4 @@ class BloombergData:
 
         df = pd.concat([df_IBOV, df_SP, df_IMAB, df_IRFM], axis = 1).dropna()
 
-        return df
\ No newline at end of file
+        return df
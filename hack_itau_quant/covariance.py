@@ -0,0 +1,310 @@
+import numpy as np
+
+
+class StreamingCovariance:
+    """Streaming estimator of the mean vector and covariance matrix of a
+    returns series. New observations are merged into the current estimate
+    with Welford/Chan rank updates, so advancing the estimator by a block of
+    k rows costs O(k * N^2) instead of recomputing the whole history.
+
+    Three modes are available:
+        - expanding (default): every observation seen so far
+        - rolling: only the last ``window`` observations
+        - exponentially weighted: recursive weights given by ``halflife``
+    """
+
+    def __init__(self, n_assets, window=None, halflife=None, ddof=1):
+        """
+        Args:
+            - n_assets (int): number of assets (columns) of the returns
+            - window (int or None): size of the rolling window, None for an expanding window
+            - halflife (float or None): halflife, in periods, of the exponential weights
+            - ddof (int): delta degrees of freedom of the covariance (1 matches pd.DataFrame.cov).
+              The exponentially weighted covariance is not bias corrected (it matches
+              ewm(adjust=False).cov(bias=True)), so only the default is accepted with halflife
+        """
+        if window is not None and halflife is not None:
+            raise ValueError("window and halflife can't be used together")
+
+        if halflife is not None and ddof != 1:
+            raise ValueError("ddof can't be changed with halflife")
+
+        if window is not None and window <= ddof:
+            raise ValueError("window must be greater than ddof")
+
+        self._n_assets = n_assets
+        self._window = window
+        self._ddof = ddof
+
+        self._alpha = None
+        if halflife is not None:
+            self._alpha = 1 - np.exp(-np.log(2) / halflife)
+
+        self._buffer = np.empty((0, n_assets))
+
+        self.reset()
+
+    @property
+    def n_obs(self):
+        """Number of observations in the current estimate"""
+        return self._n_obs
+
+    @property
+    def effective_n_obs(self):
+        """Effective sample size (Kish) of the weights of the observations,
+        1 / sum(w^2), which is n_obs unless the weights are exponential
+        """
+        if self._alpha is None or self._n_obs == 0:
+            return self._n_obs
+
+        # Peso (1 - alpha)^(n - 1) da primeira observação, alpha (1 - alpha)^j das demais
+        first_weight = (1 - self._alpha) ** (2 * (self._n_obs - 1))
+        sum_squares = first_weight + self._alpha / (2 - self._alpha) * (1 - first_weight)
+
+        return 1 / sum_squares
+
+    def reset(self):
+        """Discard every observation seen so far
+        """
+        self._n_obs = 0
+        self._mean = np.zeros(self._n_assets)
+        self._m2 = np.zeros((self._n_assets, self._n_assets))
+        self._buffer = self._buffer[:0]
+
+    def update(self, returns):
+        """Advance the estimator with new observations
+        Args:
+            - returns (np.array or pd.DataFrame): new rows (periods x assets), without NaNs
+        Returns:
+            - (StreamingCovariance) the estimator itself
+        """
+        returns = np.asarray(returns, dtype=float).reshape(-1, self._n_assets)
+
+        if returns.shape[0] == 0:
+            return self
+
+        if self._alpha is not None:
+            self._update_exponential(returns)
+        elif self._window is None:
+            self._add(returns)
+        else:
+            self._update_rolling(returns)
+
+        return self
+
+    def mean(self):
+        """Current estimate of the expected returns
+        Returns:
+            - (np.array) mean of each asset
+        """
+        return self._mean.copy()
+
+    def covariance(self):
+        """Current estimate of the covariance matrix
+        Returns:
+            - (np.array) covariance matrix (assets x assets)
+        """
+        if self._alpha is not None:
+            return self._m2.copy()
+
+        if self._n_obs <= self._ddof:
+            return np.full((self._n_assets, self._n_assets), np.nan)
+
+        return self._m2 / (self._n_obs - self._ddof)
+
+    def _add(self, returns):
+        n_block = returns.shape[0]
+        mean_block = returns.mean(axis=0)
+        deviations = returns - mean_block
+
+        n_total = self._n_obs + n_block
+        delta = mean_block - self._mean
+
+        self._m2 += np.dot(deviations.T, deviations)
+        self._m2 += np.outer(delta, delta) * (self._n_obs * n_block / n_total)
+        self._mean += delta * (n_block / n_total)
+        self._n_obs = n_total
+
+    def _remove(self, returns):
+        n_block = returns.shape[0]
+        mean_block = returns.mean(axis=0)
+        deviations = returns - mean_block
+
+        n_left = self._n_obs - n_block
+        mean_left = (self._n_obs * self._mean - n_block * mean_block) / n_left
+        delta = mean_block - mean_left
+
+        self._m2 -= np.dot(deviations.T, deviations)
+        self._m2 -= np.outer(delta, delta) * (n_left * n_block / self._n_obs)
+        self._mean = mean_left
+        self._n_obs = n_left
+
+    def _update_rolling(self, returns):
+
+        if returns.shape[0] >= self._window:
+            self.reset()
+            self._buffer = returns[-self._window:].copy()
+            self._add(self._buffer)
+            return
+
+        buffer = np.concatenate((self._buffer, returns), axis=0)
+        n_leaving = buffer.shape[0] - self._window
+
+        self._add(returns)
+        if n_leaving > 0:
+            self._remove(buffer[:n_leaving])
+
+        self._buffer = buffer[max(n_leaving, 0):]
+
+    def _update_exponential(self, returns):
+
+        for row in returns:
+
+            if self._n_obs == 0:
+                self._mean = row.copy()
+            else:
+                delta = row - self._mean
+                self._mean += self._alpha * delta
+                self._m2 += self._alpha * np.outer(delta, delta)
+                self._m2 *= 1 - self._alpha
+
+            self._n_obs += 1
+
+
+class LowRankCovariance:
+    """Covariance matrix given implicitly as a diagonal plus a low rank term
+
+        cov = diag(diagonal) + factors * diag(factor_variances) * factors'
+
+    Products and linear systems cost O(N * k) and O(N * k^2) through the
+    Woodbury identity, instead of storing and factorizing the N x N matrix.
+    Markowitz and HRP accept it in place of a dense covariance matrix.
+    """
+
+    def __init__(self, diagonal, factors, factor_variances, columns=None):
+        """
+        Args:
+            - diagonal (np.array): diagonal term (N), non negative
+            - factors (np.array): loadings of the low rank term (N x k)
+            - factor_variances (np.array): variances of the factors (k), non negative
+            - columns (list or None): names of the assets
+        """
+        self.diagonal = np.asarray(diagonal, dtype=float).reshape(-1)
+        self.factors = np.asarray(factors, dtype=float).reshape(len(self.diagonal), -1)
+        self.factor_variances = np.asarray(factor_variances, dtype=float).reshape(-1)
+
+        # pandas e SciPy são importados no uso: Markowitz importa este módulo
+        self._columns = columns
+
+        self._capacitance = None
+        self._dense_factorization = None
+
+    @property
+    def shape(self):
+        return (len(self.diagonal), len(self.diagonal))
+
+    @property
+    def columns(self):
+        """Names of the assets (pd.Index), their positions when not given"""
+        import pandas as pd
+
+        return pd.Index(range(len(self.diagonal)) if self._columns is None else self._columns)
+
+    def variances(self):
+        """Diagonal of the covariance matrix
+        Returns:
+            - (np.array) variance of each asset
+        """
+        return self.diagonal + np.square(self.factors) @ self.factor_variances
+
+    def dot(self, x):
+        """Product cov * x
+        Args:
+            - x (np.array): vector (N) or matrix (N x m)
+        Returns:
+            - (np.array) product with the shape of x
+        """
+        x = np.asarray(x, dtype=float)
+        loadings = self.factors.T @ x
+
+        if x.ndim == 1:
+            return self.diagonal * x + self.factors @ (self.factor_variances * loadings)
+
+        return self.diagonal[:, None] * x + self.factors @ (self.factor_variances[:, None] * loadings)
+
+    def __matmul__(self, x):
+        return self.dot(x)
+
+    def rescale(self, std):
+        """Covariance of the assets scaled by std, diag(std) * cov * diag(std)
+        Args:
+            - std (np.array): scale of each asset, e.g. volatilities to turn a
+              correlation into a covariance
+        Returns:
+            - (LowRankCovariance) rescaled covariance
+        """
+        std = np.asarray(std, dtype=float).reshape(-1)
+
+        return LowRankCovariance(self.diagonal * std ** 2, self.factors * std[:, None],
+                                 self.factor_variances, self._columns)
+
+    def to_numpy(self):
+        """Dense N x N covariance matrix
+        """
+        dense = (self.factors * self.factor_variances) @ self.factors.T
+        dense[np.diag_indices_from(dense)] += self.diagonal
+
+        return dense
+
+    def __array__(self, dtype=None):
+        dense = self.to_numpy()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def to_frame(self):
+        """Dense covariance matrix labelled by the columns
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.to_numpy(), index=self.columns, columns=self.columns)
+
+    def solve(self, rhs):
+        """Solve cov * x = rhs with the Woodbury identity
+            cov^-1 = D^-1 - D^-1 F (S^-1 + F' D^-1 F)^-1 F' D^-1
+        falling back to a dense factorization when the diagonal has zeros
+        Args:
+            - rhs (np.array): right-hand side (N) or (N x m)
+        Returns:
+            - (np.array) solution with the shape of rhs
+        """
+        from scipy.linalg import cho_factor, cho_solve
+
+        rhs = np.asarray(rhs, dtype=float)
+
+        if np.any(self.diagonal <= 0):
+            if self._dense_factorization is None:
+                self._dense_factorization = cho_factor(self.to_numpy(), lower=True)
+            return cho_solve(self._dense_factorization, rhs)
+
+        if self._capacitance is None:
+            self._factor_capacitance()
+
+        factors, capacitance = self._capacitance
+
+        scaled_rhs = rhs / (self.diagonal if rhs.ndim == 1 else self.diagonal[:, None])
+        correction = factors @ cho_solve(capacitance, factors.T @ scaled_rhs)
+
+        return scaled_rhs - (correction / self.diagonal if rhs.ndim == 1
+                             else correction / self.diagonal[:, None])
+
+    def _factor_capacitance(self):
+
+        from scipy.linalg import cho_factor
+
+        # Fatores com variância nula não contribuem e deixariam S^-1 infinito
+        used = self.factor_variances > 0
+        factors = self.factors[:, used]
+
+        capacitance = np.diag(1 / self.factor_variances[used]) + \
+            (factors / self.diagonal[:, None]).T @ factors
+
+        self._capacitance = (factors, cho_factor(capacitance, lower=True))
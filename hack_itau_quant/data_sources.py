@@ -0,0 +1,309 @@
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+class PriceStore:
+    """Store of daily series keyed by (ticker, field). Each series is a Parquet
+    file that also records, in its metadata, the date ranges already fetched,
+    so ranges without data (holidays, dates before the listing) are not asked
+    for again. Files are read as memory-mapped Arrow tables, kept open between
+    reads. With path=None the store only lives in memory.
+
+    Recent dates may still get data: a fetched range is only marked up to its
+    last value, until it is publication_lag business days old. From then on it
+    is marked whole, so its trailing weekends and holidays are not fetched again.
+    """
+
+    def __init__(self, path: str = None, publication_lag: int = 5, today: str = None):
+        """
+        Args:
+            - path (str or None): directory of the Parquet files, None for a memory store
+            - publication_lag (int): business days after which a date without data won't get any
+            - today (str or None): current date, None for the date of each write
+        """
+        self._path = path
+        self._publication_lag = publication_lag
+        self._tables = dict()
+
+        self.today = None if today is None else _to_timestamp(today)
+
+    def read(self, ticker: str, field: str, start, end) -> pd.Series:
+        """Stored values of a series between two dates
+        Args:
+            - ticker (str): ticker of the asset
+            - field (str): field of the series, e.g. PX_LAST
+            - start (str or pd.Timestamp): first date, inclusive
+            - end (str or pd.Timestamp): last date, inclusive
+        Returns:
+            - (pd.Series) values indexed by date
+        """
+        table, _ = self._load(ticker, field)
+
+        if table is None:
+            return pd.Series(dtype=float, name=ticker)
+
+        # Datas ordenadas: o intervalo é uma fatia da tabela, sem cópia
+        dates = table.column('date').to_numpy()
+        first = np.searchsorted(dates, _to_timestamp(start).to_datetime64(), side='left')
+        last = np.searchsorted(dates, _to_timestamp(end).to_datetime64(), side='right')
+
+        frame = table.slice(first, last - first).to_pandas()
+
+        return pd.Series(frame['value'].to_numpy(), index=pd.DatetimeIndex(frame['date']),
+                         name=ticker)
+
+    def missing(self, ticker: str, field: str, start, end) -> list:
+        """Date ranges between start and end not fetched yet
+        Returns:
+            - (list) tuples (start, end) of pd.Timestamp, inclusive
+        """
+        _, coverage = self._load(ticker, field)
+
+        return _subtract_ranges((_to_timestamp(start), _to_timestamp(end)), coverage)
+
+    def write(self, ticker: str, field: str, series: pd.Series, start, end):
+        """Merge fetched values into a series and mark [start, end] as fetched. Dates
+        less than publication_lag business days old after the last value returned
+        may still get data, so they are not marked and are fetched again
+        Args:
+            - ticker (str): ticker of the asset
+            - field (str): field of the series
+            - series (pd.Series): values indexed by date, may be empty
+            - start (str or pd.Timestamp): first date of the fetched range
+            - end (str or pd.Timestamp): last date of the fetched range
+        """
+        import pyarrow as pa
+
+        table, coverage = self._load(ticker, field)
+
+        series = pd.Series(series, dtype=float)
+        series.index = pd.to_datetime(series.index)
+
+        today = _to_timestamp('today') if self.today is None else self.today
+        published = today - pd.offsets.BDay(self._publication_lag)
+
+        start, requested_end = _to_timestamp(start), _to_timestamp(end)
+        end = min(requested_end, published)
+        if len(series) > 0:
+            end = max(end, min(requested_end, _to_timestamp(series.index.max())))
+
+        if table is not None:
+            stored = table.to_pandas()
+            stored = pd.Series(stored['value'].to_numpy(), index=pd.DatetimeIndex(stored['date']))
+            series = series.combine_first(stored)
+
+        series = series[~series.index.duplicated(keep='first')].sort_index()
+        if start <= end:
+            coverage = _merge_ranges(coverage + [(start, end)])
+
+        table = pa.table({'date': pa.array(series.index.values, type=pa.timestamp('ns')),
+                          'value': pa.array(series.to_numpy(), type=pa.float64())})
+        table = table.replace_schema_metadata({'coverage': json.dumps(
+            [(start.isoformat(), end.isoformat()) for start, end in coverage])})
+
+        if self._path is not None:
+            table = self._write_file(ticker, field, table)
+
+        self._tables[(ticker, field)] = (table, coverage)
+
+    def _load(self, ticker, field):
+
+        key = (ticker, field)
+        if key in self._tables:
+            return self._tables[key]
+
+        file = self._get_file(ticker, field)
+        if file is None or not os.path.exists(file):
+            return None, []
+
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(file, memory_map=True)
+        coverage = [(pd.Timestamp(start), pd.Timestamp(end))
+                    for start, end in json.loads(table.schema.metadata[b'coverage'])]
+
+        self._tables[key] = (table, coverage)
+
+        return self._tables[key]
+
+    def _write_file(self, ticker, field, table):
+
+        import pyarrow.parquet as pq
+
+        file = self._get_file(ticker, field)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+
+        # Escreve em um arquivo temporário para não deixar a série corrompida
+        temporary_file = file + '.tmp'
+        pq.write_table(table, temporary_file)
+        os.replace(temporary_file, file)
+
+        return pq.read_table(file, memory_map=True)
+
+    def _get_file(self, ticker, field):
+
+        if self._path is None:
+            return None
+
+        return os.path.join(self._path, _safe_name(field), _safe_name(ticker) + '.parquet')
+
+
+class CachedDataSource:
+    """Data source in front of a backend (Bloomberg terminal or fake terminal)
+    that only asks the backend for the date ranges missing from its PriceStore.
+    """
+
+    def __init__(self, backend, store: PriceStore = None):
+        """
+        Args:
+            - backend (BloombergBackend or FakeTerminalBackend): source of the missing data
+            - store (PriceStore or str or None): store or directory of the Parquet files,
+              None for a memory store
+        """
+        if not isinstance(store, PriceStore):
+            store = PriceStore(store)
+
+        self._backend = backend
+        self._store = store
+
+    def bdh(self, tickers, flds, start_date, end_date) -> pd.DataFrame:
+        """Historical data, with the same output as xbbg.blp.bdh
+        Args:
+            - tickers (str or list): tickers of the assets
+            - flds (str or list): fields, e.g. PX_LAST
+            - start_date (str or pd.Timestamp): first date, inclusive
+            - end_date (str or pd.Timestamp): last date, inclusive
+        Returns:
+            - (pd.DataFrame) values indexed by date, with (ticker, field) columns
+        """
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        flds = [flds] if isinstance(flds, str) else list(flds)
+
+        columns = []
+        for ticker in tickers:
+            for field in flds:
+
+                for start, end in self._store.missing(ticker, field, start_date, end_date):
+                    series = self._backend.fetch(ticker, field, start, end)
+                    self._store.write(ticker, field, series, start, end)
+
+                columns.append(self._store.read(ticker, field, start_date, end_date))
+
+        df = pd.concat(columns, axis=1) if columns else pd.DataFrame()
+        df.columns = pd.MultiIndex.from_product([tickers, flds])
+
+        return df
+
+
+class BloombergBackend:
+    """Bloomberg terminal through xbbg, imported only when data is fetched
+    """
+
+    def fetch(self, ticker: str, field: str, start, end) -> pd.Series:
+        """Values of a series between two dates
+        Returns:
+            - (pd.Series) values indexed by date
+        """
+        from xbbg import blp
+
+        df = blp.bdh(ticker, field, _to_timestamp(start).strftime('%Y-%m-%d'),
+                     _to_timestamp(end).strftime('%Y-%m-%d'))
+
+        if df.empty:
+            return pd.Series(dtype=float, name=ticker)
+
+        series = df.iloc[:, 0].rename(ticker)
+        series.index = pd.to_datetime(series.index)
+
+        return series
+
+
+class FakeTerminalBackend:
+    """Offline replacement of the Bloomberg terminal. Every (ticker, field) is a
+    geometric random walk on business days, seeded by its name, so the same date
+    always gets the same value whatever range is asked. As on the terminal, only
+    dates before ``today`` have data; moving it forward publishes new values.
+    """
+
+    def __init__(self, origin: str = '2000-01-03', drift: float = 3e-4, volatility: float = 1e-2,
+                 seed: int = 0, today: str = None):
+        """
+        Args:
+            - origin (str): first date of every series
+            - drift (float): mean daily log return
+            - volatility (float): standard deviation of the daily log returns
+            - seed (int): seed combined with the name of each series
+            - today (str or None): first date without data, None for the current date
+        """
+        self._origin = pd.Timestamp(origin)
+        self._drift = drift
+        self._volatility = volatility
+        self._seed = seed
+
+        self.today = _to_timestamp('today' if today is None else today)
+
+        self.requests = []
+
+    def fetch(self, ticker: str, field: str, start, end) -> pd.Series:
+        """Values of a series between two dates
+        Returns:
+            - (pd.Series) values indexed by date
+        """
+        start, end = _to_timestamp(start), _to_timestamp(end)
+        self.requests.append((ticker, field, start, end))
+
+        dates = pd.bdate_range(self._origin, max(end, self._origin))
+
+        rng = np.random.default_rng([self._seed, zlib.crc32(f'{ticker}|{field}'.encode())])
+        log_returns = rng.normal(self._drift, self._volatility, len(dates))
+        log_returns[0] = 0
+
+        series = pd.Series(100 * np.exp(np.cumsum(log_returns)), index=dates, name=ticker)
+
+        return series[start:min(end, self.today - pd.Timedelta(days=1))]
+
+
+def _to_timestamp(date):
+    return pd.Timestamp(date).normalize()
+
+
+def _safe_name(name):
+    # Tickers têm espaços e barras, que não servem em nomes de arquivo
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+def _merge_ranges(ranges):
+    """Union of inclusive date ranges, joining ranges on consecutive days"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + pd.Timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def _subtract_ranges(interval, ranges):
+    """Parts of an inclusive date range not covered by sorted, disjoint ranges"""
+    start, end = interval
+    missing = []
+
+    for covered_start, covered_end in ranges:
+        if covered_end < start:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start - pd.Timedelta(days=1)))
+        start = max(start, covered_end + pd.Timedelta(days=1))
+
+    if start <= end:
+        missing.append((start, end))
+
+    return missing
@@ -1 +1,6 @@
-from .denoising import Denoising
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'Denoising': '.denoising',
+    'RollingDenoising': '.rolling',
+}, submodules=('denoising', 'rolling'))
@@ -1,72 +1,216 @@
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import KernelDensity
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.optimize import minimize
+from scipy.linalg import svd, svdvals
+from scipy.optimize import minimize_scalar
+from scipy.sparse.linalg import LinearOperator, eigsh
+from .. import profiling
+from ..covariance import LowRankCovariance
 
 class Denoising:
     
-    def __init__(self, returns: pd.DataFrame, n_facts: int, alpha: float, b_width: float = .01):
-        
+    def __init__(self, returns: pd.DataFrame, n_facts: int, alpha: float, b_width: float = .01,
+                 low_rank: bool = False, dtype=np.float64):
+        """
+        Args:
+            - returns (pd.DataFrame): returns of the assets (periods x assets)
+            - n_facts (int): number of factors
+            - alpha (float): weight of the noise correlations kept by the shrinkage
+            - b_width (float): bandwidth of the KDE of the eigenvalues
+            - low_rank (bool): don't build the N x N correlation matrix. The eigenvalues
+              and the signal eigenvectors are computed from the T x N standardized returns,
+              and the denoised matrices are returned as LowRankCovariance. The exception is
+              the shrinkage with alpha != 0 when n_facts + T >= N: its factors would be
+              larger than the dense matrix, which is returned instead
+            - dtype (np.dtype): precision of the correlation matrix and of its
+              eigendecomposition. np.float32 halves the memory, see error_bound
+        """
         self._returns = returns
         self._n_facts = n_facts
         self._alpha = alpha
         self._b_width = b_width
         self._n_points = returns.shape[0]
+        self._low_rank = low_rank
+        self._dtype = np.dtype(dtype)
         
         self._q = returns.shape[0] / float(returns.shape[1])
-        
-        self.cov_matrix = np.corrcoef(returns, rowvar = 0)
-        
-        self.e_val, self.e_vec = self._get_pca()
+
+        self._corr_matrix = None
+        self._signal = None
+        self._last_n_facts = None
+
+        with profiling.timer('denoising.eigendecomposition'):
+            if low_rank:
+                self._standardized = Denoising._standardize(returns).astype(self._dtype, copy=False)
+                self._e_val = self._get_eigenvalues()
+                self.e_vec = None
+            else:
+                self._e_val, self.e_vec = self._get_pca()
+
+    @property
+    def corr_matrix(self):
+        """Sample correlation matrix of the returns, computed on demand in low rank mode"""
+        if self._corr_matrix is None:
+            self._corr_matrix = np.corrcoef(self._returns, rowvar = 0, dtype=self._dtype)
+        return self._corr_matrix
+
+    @property
+    def cov_matrix(self):
+        """Alias of corr_matrix, kept for compatibility: it is a correlation matrix"""
+        return self.corr_matrix
+
+    @property
+    def e_val(self):
+        """Eigenvalues sorted desc, as a diagonal matrix"""
+        return np.diagflat(self._e_val)
         
     def remove_noise_with_mean(self):
         
-        max_eval, variance = self._find_max_eval()
+        with profiling.timer('denoising.marcenko_pastur_fit'):
+            max_eval, variance = self._find_max_eval()
         
-        n_facts = self.e_val.shape[0] - np.diag(self.e_val)[::-1].searchsorted(max_eval)
+        n_facts = self._e_val.shape[0] - self._e_val[::-1].searchsorted(max_eval)
+        self._last_n_facts = n_facts
         
-        corr_matrix = self._filter_mean(n_facts)
+        with profiling.timer('denoising.filter'):
+            corr_matrix = self._filter_mean(n_facts)
         
         return corr_matrix
     
     def remove_noise_with_shrinkage(self):
         
-        max_eval, variance = self._find_max_eval()
+        with profiling.timer('denoising.marcenko_pastur_fit'):
+            max_eval, variance = self._find_max_eval()
         
-        n_facts = self.e_val.shape[0] - np.diag(self.e_val)[::-1].searchsorted(max_eval)
+        n_facts = self._e_val.shape[0] - self._e_val[::-1].searchsorted(max_eval)
+        self._last_n_facts = n_facts
         
-        corr_matrix = self._filter_shrinkage(n_facts)
+        with profiling.timer('denoising.filter'):
+            corr_matrix = self._filter_shrinkage(n_facts)
         
         return corr_matrix
-        
-        
-    def _filter_mean(self, n_facts):
-        """Substitui ruído pela média
+
+    def denoised_covariance(self, method: str = 'shrinkage'):
+        """Denoised covariance matrix: the denoised correlation matrix rescaled by
+        the sample volatilities of the returns
+        Args:
+            - method (str): 'shrinkage' or 'mean', the remove_noise_with_* method used
+        Returns:
+            - (pd.DataFrame, np.array or LowRankCovariance) covariance matrix, labelled by
+              the columns of the returns when they are a pd.DataFrame
         """
+        methods = {'shrinkage': self.remove_noise_with_shrinkage, 'mean': self.remove_noise_with_mean}
+        if method not in methods:
+            raise ValueError(f"method must be one of {list(methods)}")
+
+        corr_matrix = methods[method]()
+        std = np.asarray(self._returns, dtype=float).std(axis=0, ddof=1)
+
+        if isinstance(corr_matrix, LowRankCovariance):
+            return corr_matrix.rescale(std)
+
+        # Reescala no próprio array para manter a precisão escolhida sem cópias
+        std = std.astype(corr_matrix.dtype)
+        corr_matrix *= std
+        corr_matrix *= std[:, None]
 
-        e_val = np.diag(self.e_val).copy()
+        if isinstance(self._returns, pd.DataFrame):
+            return pd.DataFrame(corr_matrix, index=self._returns.columns, columns=self._returns.columns)
+
+        return corr_matrix
+
+    def error_bound(self):
+        """First-order bound of the absolute error, due to the floating point
+        precision, of the entries of the last denoised correlation matrix.
+
+        The residuals r_i = |C v_i - e_val_i v_i| of the signal eigenpairs are
+        measured in float64 against the exact correlation C. Each pair then adds
+        r_i + 2 * e_val_i * r_i / gap_i to the error (Weyl and Davis-Kahan), where
+        gap_i is the distance of e_val_i to the rest of the spectrum. The rounding
+        of the correlation itself adds n_periods * eps
+        Returns:
+            - (float) bound of the error of each entry
+        """
+        if self._last_n_facts is None:
+            raise ValueError("Call remove_noise_with_mean or remove_noise_with_shrinkage first")
 
-        e_val[n_facts:] = e_val[n_facts:].sum()/float(e_val.shape[0] - n_facts) 
-        e_val = np.diag(e_val)
+        n_facts = self._last_n_facts
+        rounding_error = self._n_points * np.finfo(self._dtype).eps
 
-        cov = np.dot(self.e_vec, e_val).dot(self.e_vec.T)
-        corr = Denoising.cov2corr(cov)
+        if n_facts == 0:
+            return rounding_error
 
-        return corr
+        e_val, e_vec = self._get_signal(n_facts)
+        e_val, e_vec = e_val.astype(float), e_vec.astype(float)
+
+        standardized = Denoising._standardize(self._returns)
+        residuals = np.linalg.norm(standardized.T @ (standardized @ e_vec) - e_vec * e_val, axis=0)
+
+        # Distância de cada autovalor de sinal ao vizinho mais próximo do espectro
+        spectrum = self._e_val.astype(float)
+        neighbours = np.concatenate(([np.inf], spectrum, [-np.inf]))
+        gaps = np.minimum(neighbours[:n_facts] - spectrum[:n_facts],
+                          spectrum[:n_facts] - neighbours[2:n_facts + 2]) - residuals
+
+        if np.any(gaps <= 0):
+            return np.inf
+
+        return np.sum(residuals + 2 * np.abs(e_val) * residuals / gaps) + rounding_error
+
+    def _filter_mean(self, n_facts):
+        """Substitui ruído pela média. Com os autovetores ortonormais,
+        V diag(e_val) V' = mean * I + V_k (e_val_k - mean) V_k'
+        """
+        e_val, e_vec = self._get_signal(n_facts)
+
+        n_noise = self._e_val.shape[0] - n_facts
+        mean = self._e_val[n_facts:].sum() / float(max(n_noise, 1))
+
+        if self._low_rank:
+            diagonal = mean + np.square(e_vec) @ (e_val - mean)
+            return LowRankCovariance(mean / diagonal, e_vec / np.sqrt(diagonal)[:, None],
+                                     e_val - mean, self._get_columns())
+
+        return Denoising._mean_filter(e_val, e_vec, mean)
     
     def _filter_shrinkage(self, n_facts):
+        """Keeps the signal, shrinks the noise correlations towards their diagonal:
+        corr_left + alpha * corr_right + (1 - alpha) * diag(corr_right), where
+        corr_right = corr - corr_left is never decomposed. In low rank mode
+        corr_right is Z'Z - corr_left, which adds the T columns of Z to the factors
+        """
+        e_val_left, e_vec_left = self._get_signal(n_facts)
+
+        n_points, n_assets = self._n_points, e_vec_left.shape[0]
+
+        if self._low_rank and (self._alpha == 0 or n_facts + n_points < n_assets):
+            diagonal = (1 - self._alpha) * np.maximum(1 - np.square(e_vec_left) @ e_val_left, 0)
+
+            factors, variances = e_vec_left, (1 - self._alpha) * e_val_left
+            if self._alpha != 0:
+                factors = np.hstack((factors, self._standardized.T))
+                variances = np.concatenate((variances, np.full(self._n_points, self._alpha)))
+
+            return LowRankCovariance(diagonal, factors, variances, self._get_columns())
+
+        return Denoising._shrinkage_filter(self.corr_matrix, e_val_left, e_vec_left, self._alpha)
+
+    @staticmethod
+    def _mean_filter(e_val, e_vec, mean):
+        # Correlação com os autovalores de ruído substituídos pela média
+        cov = (e_vec * (e_val - mean)) @ e_vec.T
+        cov[np.diag_indices_from(cov)] += mean
+
+        return Denoising.cov2corr(cov)
+
+    @staticmethod
+    def _shrinkage_filter(corr, e_val_left, e_vec_left, alpha):
+        # Sinal mantido, ruído encolhido em direção à sua diagonal
+        corr_left = (e_vec_left * e_val_left) @ e_vec_left.T
+        corr_right = corr - corr_left
+
+        corr_shrinkage = corr_left + alpha * corr_right
+        corr_shrinkage[np.diag_indices_from(corr_shrinkage)] += (1 - alpha) * np.diag(corr_right)
 
-        e_val_left  = self.e_val[:n_facts, :n_facts]
-        e_vec_left = self.e_vec[:, :n_facts] 
-        e_val_right, e_vec_right = self.e_val[n_facts:, n_facts:], self.e_vec[:, n_facts:]
-        
-        corr_left = np.dot(e_vec_left, e_val_left).dot(e_vec_left.T)
-        corr_right = np.dot(e_vec_right, e_val_right).dot(e_vec_right.T)
-        
-        corr_shrinkage = corr_left + self._alpha * corr_right + (1 - self._alpha) * np.diag(np.diag(corr_right))
-        
         return corr_shrinkage
 
     def _get_pca(self):
@@ -77,38 +221,143 @@ class Denoising:
         Args:
             - matrix (pd.DataFrame or np.array)
         Returns:
-            - (tuple) eigenvalues (matrix), eigenvectors (matrix)
+            - (tuple) eigenvalues (vector), eigenvectors (matrix)
         """
-        e_val, e_vec = np.linalg.eigh(self.cov_matrix)
+        e_val, e_vec = np.linalg.eigh(self.corr_matrix)
 
         indices = e_val.argsort()[::-1]
 
         e_val, e_vec = e_val[indices], e_vec[:,indices]
-        e_val = np.diagflat(e_val)
         
         return e_val, e_vec
 
+    def _get_eigenvalues(self):
+        """Eigenvalues of the correlation matrix Z'Z without its eigenvectors: the
+        squared singular values of the T x N matrix Z, padded with zeros when there
+        are fewer periods than assets
+        Returns:
+            - (np.array) eigenvalues sorted desc
+        """
+        n_points, n_assets = self._standardized.shape
+
+        e_val = np.square(svdvals(self._standardized))
+
+        return np.concatenate((e_val, np.zeros(max(n_assets - n_points, 0), dtype=e_val.dtype)))
+
+    def _get_signal(self, n_facts):
+        """Largest n_facts eigenvalues and their eigenvectors. In low rank mode
+        they are found by a Lanczos iteration on the operator Z'(Z x)
+        Returns:
+            - (tuple) eigenvalues (n_facts), eigenvectors (N x n_facts)
+        """
+        if not self._low_rank:
+            return self._e_val[:n_facts], self.e_vec[:, :n_facts]
+
+        if self._signal is not None and len(self._signal[0]) == n_facts:
+            return self._signal
+
+        standardized = self._standardized
+        n_assets = standardized.shape[1]
+
+        if n_facts == 0:
+            e_val, e_vec = np.zeros(0), np.zeros((n_assets, 0))
+        elif n_facts >= min(standardized.shape) - 1:
+            # Autovetores de Z'Z são os vetores singulares à direita de Z
+            _, singular_values, e_vec_t = svd(standardized, full_matrices=False)
+            e_val, e_vec = np.square(singular_values), e_vec_t.T
+        else:
+            operator = LinearOperator((n_assets, n_assets), dtype=float,
+                                      matvec=lambda x: standardized.T @ (standardized @ x))
+            e_val, e_vec = eigsh(operator, k=n_facts, which='LA', v0=np.ones(n_assets))
+
+        indices = e_val.argsort()[::-1][:n_facts]
+        self._signal = (e_val[indices], e_vec[:, indices])
+        self.e_vec = self._signal[1]
+
+        return self._signal
+
+    def _get_columns(self):
+
+        return self._returns.columns if isinstance(self._returns, pd.DataFrame) else None
+
+    @staticmethod
+    def _standardize(returns):
+        # Z tal que Z'Z é a matriz de correlação amostral
+        returns = np.asarray(returns, dtype=float)
+        centered = returns - returns.mean(axis=0)
+
+        return centered / (centered.std(axis=0) * np.sqrt(len(returns)))
+
 
     def _find_max_eval(self):
-        
-        out = minimize(lambda var: self._compare_theoretical_and_empirical(var),
-                       x0=np.array(0.5), bounds=((1E-5, 1-1E-5),))
 
-        if out['success']: var = out['x'][0]
-        else: var=1
+        # A KDE não depende de var: os autovalores são ordenados uma única vez
+        e_val = np.sort(self._e_val.astype(float))
+
+        var = Denoising._fit_variance(e_val, self._q, self._n_points, self._b_width)
             
         e_max = var*(1+(1./self._q)**.5)**2
         
         return e_max, var
     
-    def _compare_theoretical_and_empirical(self, var):
-                
-        theoretical_pdf = Denoising.marcenko_pastur_pdf(var[0], self._q, self._n_points) 
-        empirical_pdf = Denoising.fit_kde(np.diag(self.e_val), self._b_width, x = theoretical_pdf.index.values)
-        
-        mean_squared_errors = np.sum((empirical_pdf - theoretical_pdf)**2)
-        
-        return mean_squared_errors
+    def _compare_theoretical_and_empirical(self, var, e_val):
+        """Sum of squared errors between the Marcenko-Pastur pdf and the KDE of
+        the eigenvalues, both evaluated on the Marcenko-Pastur grid
+        Args:
+            - var (float): variance of the Marcenko-Pastur distribution
+            - e_val (np.array): eigenvalues sorted asc
+        Returns:
+            - (float) sum of squared errors
+        """
+        return Denoising._marcenko_pastur_error(var, e_val, self._q, self._n_points, self._b_width)
+
+    @staticmethod
+    def _fit_variance(e_val, q, n_points, b_width):
+        """Variance of the Marcenko-Pastur distribution that best fits the eigenvalues
+        (sorted asc), searched over the whole interval, 1 when the search fails
+        """
+        out = minimize_scalar(
+            lambda var: Denoising._marcenko_pastur_error(var, e_val, q, n_points, b_width),
+            bounds=(1E-5, 1-1E-5), method='bounded')
+
+        return out['x'] if out['success'] else 1
+
+    @staticmethod
+    def _marcenko_pastur_error(var, e_val, q, n_points, b_width):
+
+        e_min, e_max = Denoising._marcenko_pastur_bounds(var, q)
+        x = np.linspace(e_min, e_max, n_points)
+
+        theoretical_pdf = Denoising._marcenko_pastur_density(x, var, q)
+        empirical_pdf = Denoising.gaussian_kde(e_val, b_width, x)
+
+        return np.sum((empirical_pdf - theoretical_pdf)**2)
+
+    @staticmethod
+    def gaussian_kde(obs, b_width, x, cutoff=9.):
+        """Gaussian KDE of obs evaluated on x, the same density as fit_kde with a
+        gaussian kernel. Each point only sums the observations within cutoff
+        bandwidths, whose kernels are below exp(-cutoff**2 / 2) beyond it
+        Args:
+            - obs (np.array): observations sorted asc
+            - b_width (float): bandwidth of the kernel
+            - x (np.array): values on which the density is evaluated
+            - cutoff (float): number of bandwidths considered around each point
+        Returns:
+            - (np.array) estimated density at x
+        """
+        start = np.searchsorted(obs, x - cutoff * b_width)
+        end = np.searchsorted(obs, x + cutoff * b_width)
+
+        # Pares (ponto, observação vizinha) enfileirados, sem preencher as janelas
+        counts = end - start
+        points = np.repeat(np.arange(len(x)), counts)
+        indices = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - start, counts)
+
+        distances = (x[points] - obs[indices]) / b_width
+        density = np.bincount(points, weights=np.exp(-0.5 * distances**2), minlength=len(x))
+
+        return density / (len(obs) * b_width * np.sqrt(2 * np.pi))
 
     @staticmethod
     def fit_kde( obs, b_width = .25, kernel = "gaussian", x = None):
@@ -122,6 +371,9 @@ class Denoising:
             - (pd.Series) estimated density function
         """
         
+        # scikit-learn é opcional: só este método o utiliza
+        from sklearn.neighbors import KernelDensity
+
         if len(obs.shape)==1:
             obs = obs.reshape(-1,1)
             
@@ -150,14 +402,27 @@ class Denoising:
             - (pd.Series) generated random variables
         """
         # eMin and eMax are the minimum and maximum eigenvalues
-        eMin, eMax = var*(1-(1./q)**.5)**2, var*(1+(1./q)**.5)**2
+        eMin, eMax = Denoising._marcenko_pastur_bounds(var, q)
         # eVal is an array with length of pts between eMin and eMax
         eVal = np.linspace(eMin, eMax, pts)
         # calculates probability function for eVal
-        pdf = q/(2*np.pi*var*eVal)*((eMax-eVal)*(eVal-eMin))**.5
+        pdf = Denoising._marcenko_pastur_density(eVal, var, q)
         # converts to pd.Series
         pdf = pd.Series(pdf, index = eVal)
         return pdf 
+
+    @staticmethod
+    def _marcenko_pastur_bounds(var, q):
+
+        return var*(1-(1./q)**.5)**2, var*(1+(1./q)**.5)**2
+
+    @staticmethod
+    def _marcenko_pastur_density(e_val, var, q):
+
+        e_min, e_max = Denoising._marcenko_pastur_bounds(var, q)
+
+        # Arredondamento nas extremidades pode deixar o produto levemente negativo
+        return q/(2*np.pi*var*e_val)*np.maximum((e_max-e_val)*(e_val-e_min), 0)**.5
     
     @staticmethod
     def cov2corr(cov):
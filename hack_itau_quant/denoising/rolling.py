@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+from scipy.linalg import eigvalsh
+from scipy.sparse.linalg import eigsh
+from .. import profiling
+from ..covariance import StreamingCovariance
+from .denoising import Denoising
+
+
+class RollingDenoising:
+    """Denoising of a sequence of covariance matrices, e.g. of consecutive
+    rebalance dates, reusing the work of the previous matrix: the signal
+    eigenvectors are refined by subspace iteration from the previous ones,
+    instead of a full eigendecomposition. Only the eigenvalues (eigvalsh) of
+    the whole spectrum are computed: they are needed by the Marcenko-Pastur
+    fit and give the interval damped by a Chebyshev filter.
+
+    The Marcenko-Pastur fit has several local minima, so its variance is
+    always searched over the whole interval, as in Denoising: the denoised
+    matrices don't depend on the previous ones.
+
+    Passed to Backtesting as ``denoising``, it replaces the covariance matrix
+    of every rebalance date by its denoised version.
+    """
+
+    METHODS = ('shrinkage', 'mean')
+
+    def __init__(self, method: str = 'shrinkage', alpha: float = .5, b_width: float = .01,
+                 oversampling: int = 5, degree: int = 8,
+                 max_iter: int = 50, tol: float = 1e-10):
+        """
+        Args:
+            - method (str): 'shrinkage' or 'mean', as in Denoising.remove_noise_with_*
+            - alpha (float): weight of the noise correlations kept by the shrinkage
+            - b_width (float): bandwidth of the KDE of the eigenvalues
+            - oversampling (int): extra vectors of the subspace iteration, which speed up
+              its convergence
+            - degree (int): degree of the Chebyshev filter of each subspace iteration
+            - max_iter (int): maximum number of subspace iterations before falling back
+              to a Lanczos solver
+            - tol (float): relative residual of the signal eigenpairs
+        """
+        if method not in RollingDenoising.METHODS:
+            raise ValueError(f"method must be one of {list(RollingDenoising.METHODS)}")
+
+        self._method = method
+        self._alpha = alpha
+        self._b_width = b_width
+        self._oversampling = oversampling
+        self._degree = degree
+        self._max_iter = max_iter
+        self._tol = tol
+
+        self.reset()
+
+    def reset(self):
+        """Forget the previous matrix, so the next one is denoised from scratch
+        """
+        self._basis = None
+
+        self.iterations = 0
+        self.fallbacks = 0
+
+    def denoise(self, cov_matrix, n_obs):
+        """Denoise a covariance matrix keeping the variances of the assets
+        Args:
+            - cov_matrix (np.array or pd.DataFrame): sample covariance matrix
+            - n_obs (float): number of observations used to estimate it, or their effective
+              sample size when they are weighted
+        Returns:
+            - (np.array or pd.DataFrame) denoised covariance matrix, of the type of cov_matrix
+        """
+        values = np.asarray(cov_matrix, dtype=float)
+        std = np.sqrt(np.diag(values))
+
+        corr_matrix = self.denoise_correlation(values / np.outer(std, std), n_obs)
+        denoised = corr_matrix * np.outer(std, std)
+
+        if isinstance(cov_matrix, pd.DataFrame):
+            return pd.DataFrame(denoised, index=cov_matrix.index, columns=cov_matrix.columns)
+
+        return denoised
+
+    def denoise_correlation(self, corr_matrix, n_obs):
+        """Denoise a correlation matrix
+        Args:
+            - corr_matrix (np.array): sample correlation matrix
+            - n_obs (float): number of observations used to estimate it, or their effective
+              sample size when they are weighted
+        Returns:
+            - (np.array) denoised correlation matrix
+        """
+        corr_matrix = np.asarray(corr_matrix, dtype=float)
+        n_assets = corr_matrix.shape[0]
+        q = n_obs / float(n_assets)
+
+        with profiling.timer('denoising.eigenvalues'):
+            e_val = eigvalsh(corr_matrix)
+
+        with profiling.timer('denoising.marcenko_pastur_fit'):
+            # A grade da Marcenko-Pastur tem um ponto por observação
+            variance = Denoising._fit_variance(e_val, q, int(np.ceil(n_obs)), self._b_width)
+        max_eval = variance * (1 + (1. / q) ** .5) ** 2
+
+        n_facts = n_assets - e_val.searchsorted(max_eval)
+
+        with profiling.timer('denoising.signal'):
+            e_val_left, e_vec_left = self._get_signal(corr_matrix, n_facts, e_val)
+        profiling.count('denoising.subspace_iterations', self.iterations)
+
+        with profiling.timer('denoising.filter'):
+            if self._method == 'mean':
+                mean = e_val[:n_assets - n_facts].sum() / float(max(n_assets - n_facts, 1))
+                return Denoising._mean_filter(e_val_left, e_vec_left, mean)
+
+            return Denoising._shrinkage_filter(corr_matrix, e_val_left, e_vec_left, self._alpha)
+
+    def rolling(self, returns: pd.DataFrame, window: int, step: int = 1):
+        """Denoised covariance matrices of a rolling window over the returns
+        Args:
+            - returns (pd.DataFrame): returns of the assets (periods x assets)
+            - window (int): number of periods of each estimate
+            - step (int): number of periods between consecutive estimates
+        Returns:
+            - (generator) tuples of the last date of the window and its denoised
+              covariance matrix (pd.DataFrame)
+        """
+        estimator = StreamingCovariance(returns.shape[1], window=window)
+        values = returns.to_numpy()
+        columns = returns.columns
+
+        last_end = 0
+
+        for end in range(window, len(returns) + 1, step):
+
+            estimator.update(values[last_end:end])
+            last_end = end
+
+            cov_matrix = pd.DataFrame(estimator.covariance(), index=columns, columns=columns)
+
+            yield returns.index[end - 1], self.denoise(cov_matrix, estimator.n_obs)
+
+    def _get_signal(self, corr_matrix, n_facts, e_val):
+        """Largest n_facts eigenpairs by Chebyshev filtered subspace iteration from
+        the previous basis. The spectrum is known from eigvalsh, so the filter damps
+        exactly the interval of the eigenvalues left out of the subspace
+        Args:
+            - corr_matrix (np.array): correlation matrix
+            - n_facts (int): number of eigenpairs
+            - e_val (np.array): every eigenvalue of corr_matrix, sorted asc
+        Returns:
+            - (tuple) eigenvalues (n_facts) sorted desc, eigenvectors (N x n_facts)
+        """
+        n_assets = corr_matrix.shape[0]
+        self.iterations = 0
+
+        if n_facts == 0:
+            return np.zeros(0), np.zeros((n_assets, 0))
+
+        n_vectors = min(n_facts + self._oversampling, n_assets)
+
+        if n_vectors >= n_assets - 1:
+            e_val, e_vec = np.linalg.eigh(corr_matrix)
+            return e_val[::-1][:n_facts], e_vec[:, ::-1][:, :n_facts]
+
+        basis = self._get_initial_basis(n_assets, n_vectors)
+        lower, upper = e_val[0], e_val[n_assets - n_vectors - 1]
+
+        for iteration in range(1, self._max_iter + 1):
+
+            filtered = RollingDenoising._chebyshev_filter(corr_matrix, basis, self._degree,
+                                                          lower, upper)
+            basis, _ = np.linalg.qr(filtered)
+            product = corr_matrix @ basis
+
+            # Rayleigh-Ritz na base filtrada
+            ritz_val, rotation = np.linalg.eigh(basis.T @ product)
+            ritz_val, rotation = ritz_val[::-1], rotation[:, ::-1]
+
+            basis = basis @ rotation
+            product = product @ rotation
+
+            residual = np.linalg.norm(product[:, :n_facts] - basis[:, :n_facts] * ritz_val[:n_facts])
+            if residual <= self._tol * np.linalg.norm(ritz_val[:n_facts]):
+                break
+        else:
+            profiling.count('denoising.fallbacks')
+            self.fallbacks += 1
+            ritz_val, basis = eigsh(corr_matrix, k=n_vectors, which='LA', v0=basis[:, 0])
+            ritz_val, basis = ritz_val[::-1], basis[:, ::-1]
+
+        self.iterations = iteration
+        self._basis = basis
+
+        return ritz_val[:n_facts], basis[:, :n_facts]
+
+    def _get_initial_basis(self, n_assets, n_vectors):
+
+        rng = np.random.default_rng(n_vectors)
+
+        if self._basis is None or self._basis.shape[0] != n_assets:
+            return rng.normal(size=(n_assets, n_vectors))
+
+        basis = self._basis[:, :n_vectors]
+
+        # Mais fatores que na data anterior: completa a base com direções aleatórias
+        if basis.shape[1] < n_vectors:
+            basis = np.hstack((basis, rng.normal(size=(n_assets, n_vectors - basis.shape[1]))))
+
+        return basis
+
+    @staticmethod
+    def _chebyshev_filter(matrix, basis, degree, lower, upper):
+        """Chebyshev polynomial of the matrix applied to the basis, bounded by 1 on
+        the eigenvalues in [lower, upper] and growing fast above upper
+        """
+        center, half_width = (upper + lower) / 2, (upper - lower) / 2
+
+        previous = basis
+        current = (matrix @ basis - center * basis) / half_width
+
+        for _ in range(2, degree + 1):
+            previous, current = current, 2 * (matrix @ current - center * current) / half_width - previous
+
+        return current
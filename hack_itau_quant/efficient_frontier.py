@@ -1,10 +1,5 @@
 import numpy as np
 from .optimization import Markowitz
-import pandas as pd
-
-import plotly.offline as py
-import plotly.graph_objs as go
-from plotly.subplots import make_subplots
 
 
 class EfficientFrontier:
@@ -38,115 +33,243 @@ class EfficientFrontier:
         return self._solver.optimal_return(target_return)
 
     def max_loss(self, loss, period, z_alpha=-1.645):
-        """Generate portfolio that has a certain amount of loss tolerance for a given period
+        """Generate portfolio that has a certain amount of loss tolerance for a given period.
+        The lowest return on the efficient frontier that passes the test is found in
+        closed form from the frontier's hyperbola, with bisection as a fallback.
         Args:
-            - loss (float): negative number that represents the percentage accepted of loss
-            - period (int): amount of days of loss tolerance
+            - loss (float or np.array): negative number that represents the percentage accepted of loss
+            - period (int or np.array): amount of days of loss tolerance
+            - z_alpha (float): critical value of the test
         Return:
-            - (np.array) portfolio weights 
+            - (np.array) portfolio weights, None if no portfolio passes the test.
+              For arrays of loss and period, (n_profiles, n_assets) weights with
+              NaN rows for the profiles without a solution
         """
+        is_scalar = np.ndim(loss) == 0 and np.ndim(period) == 0
+
+        loss, period = np.broadcast_arrays(np.asarray(loss, dtype=float),
+                                           np.asarray(period, dtype=float))
+
+        returns = self._max_loss_returns(loss.reshape(-1), period.reshape(-1), z_alpha)
+
+        if is_scalar:
+            if np.isnan(returns[0]):
+                return None
+            return self.efficient_return(returns[0]).reshape(-1)
+
+        weights = self._solver.optimal_return(returns)
+
+        return weights.reshape(*loss.shape, -1)
 
+    def _max_loss_returns(self, loss, period, z_alpha, max_return=1, n_bisections=200):
+        """Lowest frontier return r in [start_return, max_return) such that
+        z = (loss - r * period) / (sigma(r) * period ** -0.25) <= z_alpha
+        Args:
+            - loss (np.array): accepted losses
+            - period (np.array): periods of each loss
+            - z_alpha (float): critical value of the test
+        Return:
+            - (np.array) target returns, NaN where no return passes the test
+        """
+        A, B, C, D = self._solver.get_magic_numbers()
         start_return = self._solver.get_start_return()
 
-        for r in np.arange(start_return, 1, 0.00005):
+        # sigma_p / sqrt(period) do teste, com sigma_p = sigma * period ** (1 / 4)
+        c = -z_alpha * period ** -0.25
+
+        def gap(r, loss=loss, period=period, c=c):
+            # z <= z_alpha se, e somente se, gap(r) >= 0
+            sigma = np.sqrt((C * np.square(r) - 2 * A * r + B) / D)
+            return r * period - c * sigma - loss
+
+        # (r * period - loss)^2 = c^2 * sigma(r)^2, quadrática em r
+        a2 = period ** 2 - c ** 2 * C / D
+        a1 = -2 * period * loss + 2 * c ** 2 * A / D
+        a0 = loss ** 2 - c ** 2 * B / D
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discriminant = np.sqrt(a1 ** 2 - 4 * a2 * a0)
+            roots = np.stack(((-a1 - discriminant) / (2 * a2),
+                              (-a1 + discriminant) / (2 * a2),
+                              -a0 / a1))
+            roots[:2, np.abs(a2) < 1e-12] = np.nan
+            roots[2, np.abs(a2) >= 1e-12] = np.nan
 
-            w = self.efficient_return(r).reshape(-1)
-            rp = np.dot(w.T, self._expected_returns) * period
-            sigma_p = np.sqrt(
-                np.dot(w.T, np.dot(self._cov_matrix.to_numpy() * np.sqrt(period), w)))
+            # Raízes espúrias da elevação ao quadrado têm (r * period - loss) com sinal oposto a c
+            roots[(roots < start_return) | ((roots * period - loss) * c < 0)] = np.nan
 
-            z = (loss - rp) / (sigma_p / np.sqrt(period))
+            tolerance = 1e-9 * (np.abs(roots * period) + np.abs(loss) + 1)
+            roots[~(np.abs(gap(roots)) <= tolerance)] = np.nan
+
+        returns = np.fmin.reduce(roots, axis=0)
+        returns[gap(np.full_like(loss, start_return)) >= 0] = start_return
+
+        # Bissecção só quando as raízes foram rejeitadas, e.g. por erro numérico
+        unsolved = np.isnan(returns)
+        if np.any(unsolved):
+            peak = np.fmin(self._max_gap_returns(period[unsolved], c[unsolved]), max_return)
+            returns[unsolved] = EfficientFrontier._bisect(
+                lambda r: gap(r, loss[unsolved], period[unsolved], c[unsolved]),
+                np.full(unsolved.sum(), start_return), peak, n_bisections)
+
+        returns[returns >= max_return] = np.nan
+
+        return returns
+
+    def _max_gap_returns(self, period, c):
+        """Return where the gap r * period - c * sigma(r) - loss of _max_loss_returns
+        peaks. With sigma^2 = C / D * (r - A / C)^2 + 1 / C the gap is concave, and
+        its derivative period - c * C / D * (r - A / C) / sigma(r) vanishes at
+            r = A / C + period / sqrt(C * C / D * (c^2 * C / D - period^2))
+        If c^2 * C / D <= period^2 the gap increases along the whole frontier
+        Args:
+            - period (np.array): periods of each loss
+            - c (np.array): coefficient of sigma in the gap of each profile
+        Return:
+            - (np.array) return of the peak of each profile's gap, inf when it has none
+        """
+        A, B, C, D = self._solver.get_magic_numbers()
+        slope = C / D
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            curvature = slope * (np.square(c) * slope - np.square(period))
+            peak = A / C + period / np.sqrt(C * curvature)
+
+        return np.where(curvature > 0, peak, np.inf)
+
+    @staticmethod
+    def _bisect(gap, lower, upper, n_bisections):
+        """Bisection of a gap increasing between lower and upper, e.g. the
+        increasing side of a concave gap, up to its peak
+        Args:
+            - gap (function): gap of each profile at the returns given
+            - lower (np.array): lower bound of each profile's return
+            - upper (np.array): upper bound of each profile's return
+            - n_bisections (int): number of bisections
+        Return:
+            - (np.array) lowest return with non negative gap, NaN if there is none
+        """
+        has_root = gap(upper) >= 0
 
-            is_alternative_hypotesis = z <= z_alpha
-            if is_alternative_hypotesis:
-                return w
+        for _ in range(n_bisections):
+            middle = (lower + upper) / 2
+            is_above = gap(middle) >= 0
+            upper = np.where(is_above, middle, upper)
+            lower = np.where(is_above, lower, middle)
 
-        return None
+        return np.where(has_root, upper, np.nan)
 
-    def plot_efficient_frontier(self, n_points=100):
+    def plot_efficient_frontier(self, n_points=100, show=True, path=None, max_points=2000,
+                                max_hover_assets=10):
         """Plot efficient frontier with specific number of points
         Args:
             - n_points (int): number of points in the graphic
+            - show (bool): open the figure, False for batch jobs without a browser
+            - path (str or None): file where the figure is saved, .html or an image
+              format of plotly such as .png (needs kaleido)
+            - max_points (int): maximum number of points drawn, the frontier is decimated above it
+            - max_hover_assets (int): maximum number of weights shown when hovering a point,
+              the largest ones when there are more assets
+        Returns:
+            - (go.Figure) figure
         """
 
-        returns, risks, weigths = self._solver.get_efficient_curve(n_points)
-        self._plot(returns, risks, weigths)
-
-    def _plot(self, returns, risks, weigths):
-
-        cols_name = self._cov_matrix.columns
-
-        df = pd.DataFrame(weigths, columns=cols_name)
-        df = (df * 100).round(2).astype(float)
-
-        df['Returns'] = returns
-        df['Volatilies'] = risks
-        df['Sharpe'] = (df['Returns']) / (df['Volatilies'])
-
-        max_sharpe = df[df.Sharpe == df.Sharpe.max()]
-        min_vol = df[df.Volatilies == df.Volatilies.min()]
-
-        Efficient_Frontier = go.Scatter(x = df['Volatilies'],
-                            y = df['Returns'],
-                            text= df['Sharpe'],
-                            customdata = np.stack(tuple(df[col] for col in cols_name), axis = -1),
-                            hovertemplate="Volatilities: %{x:,.2f}<br>"+
-                            "Returns: %{y:.5f}<br>"+
-                            "Sharpe: %{text:.5f}<br>"+
-                            "BOVV11 BZ Equity: %{customdata[0]}%<br>"+
-                            "SPXI11 BZ Equity: %{customdata[1]}%<br>"+
-                            "IMAB11 BZ Equity: %{customdata[2]}%<br>"+
-                            "IRFM11 BZ Equity: %{customdata[3]}%<br>",
-                            mode = ' markers + lines',
-                            showlegend = False)
-
-        Max_Sharpe = go.Scatter(x = max_sharpe.Volatilies,
-                            y = max_sharpe.Returns,
-                            text=df[df['Volatilies']  == float(max_sharpe.Volatilies)]['Sharpe'],
-                            customdata = np.stack((df[df['Volatilies']  == float(max_sharpe.Volatilies)]['BOVV11 BZ Equity'], 
-                                                df[df['Volatilies']  == float(max_sharpe.Volatilies)]['SPXI11 BZ Equity'], 
-                                                df[df['Volatilies']  == float(max_sharpe.Volatilies)]['IMAB11 BZ Equity'], 
-                                                df[df['Volatilies']  == float(max_sharpe.Volatilies)]['IRFM11 BZ Equity']), 
-                                                axis = -1),
-                            hovertemplate=
-                            "Volatilities: %{x:,.2f}<br>"+
-                            "Returns: %{y:.5f}<br>"+
-                            "Sharpe: %{text:.4f}<br>"+
-                            "BOVV11 BZ Equity: %{customdata[0]}%<br>"+
-                            "SPXI11 BZ Equity: %{customdata[1]}%<br>"+
-                            "IMAB11 BZ Equity: %{customdata[2]}%<br>"+
-                            "IRFM11 BZ Equity: %{customdata[3]}%<br>",
-                            mode = ' markers + lines',
-                            name = 'Maximum Sharpe')
-
-        Min_Vol = go.Scatter(x = min_vol.Volatilies,
-                            y = min_vol.Returns,
-                            text=df[df['Volatilies']  == float(min_vol.Volatilies)]['Sharpe'],
-                            customdata = np.stack((df[df['Volatilies']  == float(min_vol.Volatilies)]['BOVV11 BZ Equity'], 
-                                                df[df['Volatilies']  == float(min_vol.Volatilies)]['SPXI11 BZ Equity'], 
-                                                df[df['Volatilies']  == float(min_vol.Volatilies)]['IMAB11 BZ Equity'], 
-                                                df[df['Volatilies']  == float(min_vol.Volatilies)]['IRFM11 BZ Equity']), 
-                                                axis = -1),
-                            hovertemplate=
-                            "Volatilities: %{x:,.2f}<br>"+
-                            "Returns: %{y:.5f}<br>"+
-                            "Sharpe: %{text:.4f}<br>"+
-                            "BOVV11 BZ Equity: %{customdata[0]}%<br>"+
-                            "SPXI11 BZ Equity: %{customdata[1]}%<br>"+
-                            "IMAB11 BZ Equity: %{customdata[2]}%<br>"+
-                            "IRFM11 BZ Equity: %{customdata[3]}%<br>",
-                            mode = ' markers + lines',
-                            name = 'Minimal Volatility')
-        
+        returns, risks, weights = self._solver.get_efficient_curve(n_points)
+
+        return self._plot(returns, risks, weights, show=show, path=path, max_points=max_points,
+                          max_hover_assets=max_hover_assets)
+
+    def _plot(self, returns, risks, weights, show=True, path=None, max_points=2000,
+              max_hover_assets=10):
+
+        # plotly é opcional: só é importado ao gerar o gráfico
+        import plotly.graph_objs as go
+
+        names = np.array([str(column) for column in self._cov_matrix.columns])
+        sharpes = returns / risks
+
+        max_sharpe = int(np.nanargmax(sharpes))
+        min_vol = int(np.nanargmin(risks))
+
+        # Pontos desenhados: a fronteira dizimada, sempre com os dois portfólios destacados
+        drawn = EfficientFrontier._decimate(len(returns), max_points, (max_sharpe, min_vol))
+
+        customdata, hover_weights = EfficientFrontier._get_hover_weights(
+            names, np.round(np.asarray(weights)[drawn] * 100, 2), max_hover_assets)
+        hovertemplate = ("Volatilities: %{x:,.2f}<br>"
+                         "Returns: %{y:.5f}<br>"
+                         "Sharpe: %{text:.5f}<br>" + hover_weights)
+
+        def frontier_point(i, name):
+            return go.Scattergl(x=risks[[i]], y=returns[[i]], text=sharpes[[i]],
+                                customdata=customdata[np.searchsorted(drawn, [i])],
+                                hovertemplate=hovertemplate, mode='markers',
+                                marker={'size': 12}, name=name)
+
+        efficient_frontier = go.Scattergl(x=risks[drawn], y=returns[drawn], text=sharpes[drawn],
+                                          customdata=customdata, hovertemplate=hovertemplate,
+                                          mode='markers+lines', showlegend=False)
 
         layout = go.Layout(title='Efficient Frontier',
-                        title_x=0.5,
-                        title_y=0.9,
-                        yaxis={'title':'Returns','tickformat':'.5f'},
-                        xaxis={'title':'Volatities', 'tickformat':'.2f'},
-                        font=dict(size=18))
+                           title_x=0.5,
+                           title_y=0.9,
+                           yaxis={'title': 'Returns', 'tickformat': '.5f'},
+                           xaxis={'title': 'Volatities', 'tickformat': '.2f'},
+                           font=dict(size=18))
+
+        fig = go.Figure(data=[efficient_frontier, frontier_point(max_sharpe, 'Maximum Sharpe'),
+                              frontier_point(min_vol, 'Minimal Volatility')], layout=layout)
+
+        if path is not None:
+            if path.lower().endswith(('.html', '.htm')):
+                fig.write_html(path)
+            else:
+                fig.write_image(path)
+
+        if show:
+            fig.show()
+
+        return fig
+
+    @staticmethod
+    def _decimate(n_points, max_points, keep):
+        """Positions of at most max_points points evenly spaced along the frontier,
+        plus the positions in keep
+        """
+        if n_points <= max_points:
+            return np.arange(n_points)
+
+        positions = np.linspace(0, n_points - 1, max_points).round().astype(int)
+
+        return np.union1d(positions, keep)
+
+    @staticmethod
+    def _get_hover_weights(names, weights, max_assets):
+        """Weights shown when hovering each point: every asset for small universes,
+        the max_assets largest weights (in absolute value) of each point otherwise
+        Returns:
+            - (tuple) customdata of the points and the weights part of the hovertemplate
+        """
+        n_assets = len(names)
+
+        if n_assets <= max_assets:
+            template = "".join(f"{name}: %{{customdata[{i}]}}%<br>" for i, name in enumerate(names))
+            return weights, template
+
+        largest = np.argpartition(-np.abs(weights), max_assets - 1, axis=1)[:, :max_assets]
+        largest_weights = np.take_along_axis(weights, largest, axis=1)
+
+        # Do maior para o menor peso de cada ponto
+        order = np.argsort(-np.abs(largest_weights), axis=1)
+        largest = np.take_along_axis(largest, order, axis=1)
+        largest_weights = np.take_along_axis(largest_weights, order, axis=1)
 
-        fig = go.Figure(data = [Efficient_Frontier, Max_Sharpe, Min_Vol], layout = layout)
+        # customdata intercala nome e peso: [nome_0, peso_0, nome_1, peso_1, ...]
+        customdata = np.empty((len(weights), 2 * max_assets), dtype=object)
+        customdata[:, 0::2] = names[largest]
+        customdata[:, 1::2] = largest_weights
 
+        template = "".join(f"%{{customdata[{2 * i}]}}: %{{customdata[{2 * i + 1}]}}%<br>"
+                           for i in range(max_assets))
 
-        fig.show()
+        return customdata, template
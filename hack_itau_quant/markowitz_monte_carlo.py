@@ -1,56 +1,221 @@
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import os
+
 import numpy as np
 
 
 class MarkowitzMonteCarlo:
-    
-    def __init__(self, expected_returns, cov_matrix, n_portfolios = 10000):
-        
+    """Random long-only portfolios, drawn uniformly from the simplex (Dirichlet)
+    and evaluated in chunks. Only streaming reductions are kept: the minimum
+    volatility portfolio, the maximum Sharpe portfolio, the frontier envelope
+    (minimum volatility per bin of expected return) and a small sample of
+    points for the plot, so memory does not grow with n_portfolios.
+
+    Every chunk has its own random stream, spawned from the seed, and the
+    chunk results are merged in chunk order, so the simulation is reproducible
+    for a given seed and chunk size whatever the number of workers. By default
+    the chunk size is the memory budget divided by the number of assets, so
+    the memory of each chunk doesn't grow with the number of assets.
+    """
+
+    # Matrizes carteiras x ativos vivas ao mesmo tempo em um bloco
+    ARRAYS_PER_CHUNK = 3
+
+    def __init__(self, expected_returns, cov_matrix, n_portfolios=10000, seed=None,
+                 chunk_size=None, n_bins=100, risk_free=0., n_plot=10000, n_jobs=1,
+                 backend='process', memory_budget=2 ** 27):
+        """
+        Args:
+            - expected_returns (np.array): expected returns of the assets
+            - cov_matrix (np.array): covariance matrix of the assets
+            - n_portfolios (int): number of random portfolios
+            - seed (int or None): seed of the random portfolios
+            - chunk_size (int or None): number of portfolios evaluated at once, None to
+              size the chunks from memory_budget
+            - n_bins (int): number of expected return bins of the frontier envelope
+            - risk_free (float): risk free rate used by the Sharpe ratio
+            - n_plot (int): number of portfolios kept for plot_efficient_frontier
+            - n_jobs (int): number of workers simulating the chunks, -1 to use every core
+            - backend (str): 'process' or 'thread' pool
+            - memory_budget (int): bytes of the arrays of each chunk when chunk_size is None
+        """
+        executors = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+        if backend not in executors:
+            raise ValueError(f"backend must be one of {list(executors)}")
+        if n_portfolios <= 0:
+            raise ValueError("n_portfolios must be positive")
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if memory_budget <= 0:
+            raise ValueError("memory_budget must be positive")
+
         self._n_portfolios = n_portfolios
         self._n_assets = len(expected_returns)
-        
-        self._cov_matrix = cov_matrix
-        self._expected_returns = expected_returns     
-        
+
+        self._cov_matrix = np.asarray(cov_matrix, dtype=float)
+        self._expected_returns = np.asarray(expected_returns, dtype=float).reshape(-1)
+
+        self._seed = seed
+        if chunk_size is None:
+            chunk_size = max(memory_budget // (MarkowitzMonteCarlo.ARRAYS_PER_CHUNK * 8 * self._n_assets), 1)
+        self._chunk_size = int(chunk_size)
+        self._n_bins = n_bins
+        self._risk_free = risk_free
+        self._n_plot = n_plot
+        self._n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        self._executor = executors[backend]
+
+        self._result = None
+
     def plot_efficient_frontier(self):
-        
-        self._simulate()
-            
-        plt.scatter(np.array(self.vols).reshape(-1), np.array(self.returns).reshape(-1))
-        
+
+        import matplotlib.pyplot as plt
+
+        result = self._simulate()
+
+        plt.scatter(result.sample_vols, result.sample_returns, s=2)
+
+        found = np.isfinite(result.envelope_vols)
+        plt.plot(result.envelope_vols[found], result.envelope_returns[found], color='black')
+
     def get_min_vol(self):
-        
-        self._simulate()
-        
-        min_vol_index = np.argmin(self.vols)
-        
-        weights = np.array(self.weights[min_vol_index]).squeeze()
-        
-        return weights
-
-        
-    def _generate_random_weights(self):
-        
-        seed = np.random.random((self._n_assets, 1))
-        
-        weights = seed / np.sum(seed)
-        
-        return weights
-    
+
+        return self._simulate().min_vol_weights.copy()
+
+    def get_max_sharpe(self):
+
+        return self._simulate().max_sharpe_weights.copy()
+
+    def get_frontier(self):
+        """Minimum volatility portfolio found in each bin of expected return
+        Returns:
+            - (tuple) returns (k), volatilities (k) and weights (k x n) of the non empty bins
+        """
+        result = self._simulate()
+        found = np.isfinite(result.envelope_vols)
+
+        return (result.envelope_returns[found], result.envelope_vols[found],
+                result.envelope_weights[found])
+
+    def _get_chunks(self):
+
+        n_chunks = -(-self._n_portfolios // self._chunk_size)
+        sizes = np.full(n_chunks, self._chunk_size)
+        sizes[-1] = self._n_portfolios - self._chunk_size * (n_chunks - 1)
+
+        seeds = np.random.SeedSequence(self._seed).spawn(n_chunks)
+
+        # Carteiras guardadas para o gráfico são as n_plot primeiras
+        starts = np.cumsum(sizes) - sizes
+        n_plot = np.clip(self._n_plot - starts, 0, sizes)
+
+        return list(zip(seeds, sizes, n_plot))
+
+    def _get_bin_edges(self):
+
+        # Retornos das carteiras são combinações convexas dos retornos dos ativos
+        return np.linspace(self._expected_returns.min(), self._expected_returns.max(),
+                           self._n_bins + 1)
+
     def _simulate(self):
-        
-        self.returns = []
-        self.vols = []
-        self.weights = []
-        
-        for i in range(self._n_portfolios):
-            
-            weights = self._generate_random_weights()
-            
-            rp = np.dot(weights.T, self._expected_returns)
-            sigma_p = np.sqrt(np.dot(weights.T, np.dot(self._cov_matrix, weights)))
-            
-            self.returns.append(rp)
-            self.vols.append(sigma_p)
-            self.weights.append(weights)     
-    
\ No newline at end of file
+
+        if self._result is not None:
+            return self._result
+
+        seeds, sizes, n_plots = zip(*self._get_chunks())
+
+        simulate = functools.partial(_simulate_chunk, self._expected_returns, self._cov_matrix,
+                                     self._get_bin_edges(), self._risk_free)
+
+        if self._n_jobs == 1 or len(seeds) == 1:
+            self._result = MarkowitzMonteCarlo._merge(map(simulate, seeds, sizes, n_plots))
+            return self._result
+
+        # executor.map devolve os resultados na ordem dos blocos
+        with self._executor(max_workers=self._n_jobs) as executor:
+            self._result = MarkowitzMonteCarlo._merge(
+                executor.map(simulate, seeds, sizes, n_plots))
+
+        return self._result
+
+    @staticmethod
+    def _merge(chunks):
+
+        result = None
+        for chunk in chunks:
+            result = chunk if result is None else result.merge(chunk)
+
+        return result
+
+
+def _simulate_chunk(expected_returns, cov_matrix, bin_edges, risk_free, seed, size, n_plot):
+    # Função no nível do módulo para poder ser enviada aos processos
+    rng = np.random.default_rng(seed)
+    weights = rng.dirichlet(np.ones(len(expected_returns)), size=size)
+
+    returns = weights @ expected_returns
+    vols = np.sqrt(np.einsum('ij,ij->i', weights @ cov_matrix, weights))
+
+    return _SimulationResult(returns, vols, weights, bin_edges, risk_free, n_plot)
+
+
+class _SimulationResult:
+    """Streaming reductions of a set of simulated portfolios. Ties keep the
+    portfolio simulated first, so merging chunks in order is deterministic.
+    """
+
+    def __init__(self, returns, vols, weights, bin_edges, risk_free, n_plot):
+
+        min_vol = np.argmin(vols)
+        self.min_vol = vols[min_vol]
+        self.min_vol_weights = weights[min_vol].copy()
+
+        sharpes = (returns - risk_free) / vols
+        max_sharpe = np.argmax(sharpes)
+        self.max_sharpe = sharpes[max_sharpe]
+        self.max_sharpe_weights = weights[max_sharpe].copy()
+
+        n_bins = len(bin_edges) - 1
+        bins = np.clip(np.searchsorted(bin_edges, returns, side='right') - 1, 0, n_bins - 1)
+
+        # Primeira carteira de cada bin após ordenar por (bin, vol)
+        order = np.lexsort((vols, bins))
+        first = order[np.r_[True, bins[order][1:] != bins[order][:-1]]]
+
+        self.envelope_vols = np.full(n_bins, np.inf)
+        self.envelope_returns = np.full(n_bins, np.nan)
+        self.envelope_weights = np.full((n_bins, weights.shape[1]), np.nan)
+
+        self.envelope_vols[bins[first]] = vols[first]
+        self.envelope_returns[bins[first]] = returns[first]
+        self.envelope_weights[bins[first]] = weights[first]
+
+        self.sample_returns = returns[:n_plot].copy()
+        self.sample_vols = vols[:n_plot].copy()
+
+    def merge(self, other):
+        """Merge the reductions of portfolios simulated after these ones
+        Args:
+            - other (_SimulationResult): reductions of the following portfolios
+        Returns:
+            - (_SimulationResult) self, updated
+        """
+        if other.min_vol < self.min_vol:
+            self.min_vol = other.min_vol
+            self.min_vol_weights = other.min_vol_weights
+
+        if other.max_sharpe > self.max_sharpe:
+            self.max_sharpe = other.max_sharpe
+            self.max_sharpe_weights = other.max_sharpe_weights
+
+        better = other.envelope_vols < self.envelope_vols
+        self.envelope_vols[better] = other.envelope_vols[better]
+        self.envelope_returns[better] = other.envelope_returns[better]
+        self.envelope_weights[better] = other.envelope_weights[better]
+
+        if len(other.sample_vols) > 0:
+            self.sample_returns = np.concatenate((self.sample_returns, other.sample_returns))
+            self.sample_vols = np.concatenate((self.sample_vols, other.sample_vols))
+
+        return self
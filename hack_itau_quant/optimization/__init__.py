@@ -1,2 +1,6 @@
-from .markowitz import Markowitz
-from .hrp import HRP
\ No newline at end of file
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'Markowitz': '.markowitz',
+    'HRP': '.hrp',
+}, submodules=('factorization', 'hrp', 'markowitz', 'quadratic_programming'))
@@ -0,0 +1,131 @@
+import warnings
+
+import numpy as np
+from numpy.linalg import LinAlgError
+
+
+class SymmetricFactorization:
+    """Factorization of a symmetric matrix, computed once and reused to solve
+    linear systems with any right-hand side. Positive definite matrices use a
+    Cholesky factorization; indefinite ones, e.g. KKT matrices, a Bunch-Kaufman
+    LDL^T factorization.
+
+    A matrix expected to be positive definite that is singular or nearly so,
+    e.g. a sample covariance with fewer periods than assets, gets an explicit
+    ridge (a multiple of its mean diagonal added to the diagonal), with a
+    warning. Singular indefinite matrices raise LinAlgError.
+    """
+
+    # Recíproco do número de condição abaixo do qual a matriz é tratada como singular
+    RCOND = 1e-12
+
+    # Ridge somado à diagonal, relativo à média da diagonal
+    RIDGE = 1e-6
+
+    def __init__(self, matrix: np.array, positive_definite: bool = True):
+        """
+        Args:
+            - matrix (np.array): symmetric matrix (n x n)
+            - positive_definite (bool): positive (semi)definite matrix, factored by Cholesky
+        """
+        matrix = np.asarray(matrix, dtype=float)
+
+        self._n = matrix.shape[0]
+        self.method = None
+        self.ridge = 0.
+
+        if positive_definite:
+            self._factor_cholesky(matrix)
+            self.method = 'cholesky'
+        else:
+            self._factor_ldl(matrix)
+            self.method = 'ldl'
+
+    def solve(self, rhs: np.array) -> np.array:
+        """Solve matrix * x = rhs, with the ridge added to the matrix if any
+        Args:
+            - rhs (np.array): right-hand side (n) or (n x k)
+        Returns:
+            - (np.array) solution with the shape of rhs
+        """
+        from scipy.linalg import cho_solve, solve_banded, solve_triangular
+
+        rhs = np.asarray(rhs, dtype=float)
+
+        if self.method == 'cholesky':
+            return cho_solve(self._cholesky, rhs)
+
+        permuted_rhs = rhs[self._perm]
+
+        y = solve_triangular(self._lower, permuted_rhs, lower=True, unit_diagonal=True)
+        z = solve_banded((1, 1), self._banded_d, y)
+        w = solve_triangular(self._lower, z, lower=True, trans='T', unit_diagonal=True)
+
+        x = np.empty_like(w)
+        x[self._perm] = w
+
+        return x
+
+    def _factor_cholesky(self, matrix):
+
+        if self._is_well_conditioned(matrix):
+            return
+
+        self.ridge = SymmetricFactorization.RIDGE * max(np.mean(np.diag(matrix)), 0)
+        warnings.warn(f"Matrix is singular or ill conditioned: a ridge of {self.ridge:.3g} was "
+                      "added to its diagonal", RuntimeWarning, stacklevel=3)
+
+        if self.ridge == 0 or not self._is_well_conditioned(matrix + self.ridge * np.eye(self._n)):
+            raise LinAlgError("Matrix is not positive semidefinite")
+
+    def _is_well_conditioned(self, matrix):
+
+        # SciPy só é carregado na primeira fatoração, não ao importar os otimizadores
+        from scipy.linalg import cho_factor
+        from scipy.linalg.lapack import dpocon
+
+        try:
+            self._cholesky = cho_factor(matrix, lower=True)
+        except LinAlgError:
+            return False
+
+        # Estimativa do número de condição pelo LAPACK, O(n^2) sobre o fator de Cholesky
+        rcond, info = dpocon(self._cholesky[0], np.abs(matrix).sum(axis=0).max(), uplo='L')
+
+        return info == 0 and rcond >= SymmetricFactorization.RCOND
+
+    def _factor_ldl(self, matrix):
+
+        from scipy.linalg import ldl
+
+        lu, d, perm = ldl(matrix, lower=True)
+
+        # Autovalores dos blocos 1x1 e 2x2 de d: a matriz é singular se algum for nulo
+        pivots = SymmetricFactorization._get_block_eigenvalues(d)
+        if np.min(pivots) <= self._n * np.finfo(float).eps * np.max(pivots, initial=1e-300):
+            raise LinAlgError("Matrix is singular")
+
+        # lu[perm] é triangular inferior com diagonal unitária
+        self._perm = perm
+        self._lower = lu[perm]
+
+        # d é bloco-diagonal (blocos 1x1 e 2x2), guardado no formato de banda
+        self._banded_d = np.zeros((3, self._n))
+        self._banded_d[0, 1:] = np.diag(d, 1)
+        self._banded_d[1] = np.diag(d)
+        self._banded_d[2, :-1] = np.diag(d, -1)
+
+    @staticmethod
+    def _get_block_eigenvalues(d):
+        """Absolute eigenvalues of the block diagonal d of LDL^T"""
+        diagonal = np.diag(d).copy()
+        off_diagonal = np.diag(d, -1)
+
+        # Bloco 2x2 [[a, b], [b, c]] nas posições (i, i + 1)
+        first = np.flatnonzero(off_diagonal)
+        a, b, c = diagonal[first], off_diagonal[first], diagonal[first + 1]
+
+        mean, radius = (a + c) / 2, np.hypot((a - c) / 2, b)
+        diagonal[first], diagonal[first + 1] = mean + radius, mean - radius
+
+        return np.abs(diagonal)
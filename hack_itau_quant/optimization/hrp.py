@@ -1,76 +1,250 @@
 # Based on https://medium.com/turing-talks/otimiza%C3%A7%C3%A3o-de-investimentos-com-intelig%C3%AAncia-artificial-548cf34dad4d
 
-import seaborn as sns
 import pandas as pd
-import yfinance as yf
-import matplotlib.pyplot as plt
 import numpy as np
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
+from .. import profiling
+from ..covariance import LowRankCovariance
 
 
 class HRP:
 
-    def __init__(self, cov_matrix: pd.DataFrame):
+    def __init__(self, cov_matrix: pd.DataFrame, distance: str = 'covariance', method: str = 'ward',
+                 warm_start: bool = False, threshold: float = 0.05, recluster_every: int = 10):
+        """
+        Args:
+            - cov_matrix (pd.DataFrame or LowRankCovariance): covariance matrix of the assets
+            - distance (str): 'covariance' clusters the rows of the covariance matrix
+              with euclidean distance, 'correlation' uses the distance sqrt((1 - corr) / 2)
+            - method (str): linkage method given to scipy.cluster.hierarchy.linkage
+            - warm_start (bool): reuse the last clustering while the matrix clustered by the
+              linkage (covariance or correlation, see distance) stays close to the one it was
+              computed with
+            - threshold (float): largest change of that matrix that keeps the cached clustering:
+              absolute change of a correlation, or change of a covariance relative to the
+              largest variance
+            - recluster_every (int or None): force a full clustering after this many
+              consecutive cache hits
+        """
+        if distance not in ('covariance', 'correlation'):
+            raise ValueError("distance must be 'covariance' or 'correlation'")
+
+        self._distance = distance
+        self._method = method
+
+        self._warm_start = warm_start
+        self._threshold = threshold
+        self._recluster_every = recluster_every
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cached_seriation = None
+        self._cached_matrix = None
+        self._cached_columns = None
+        self._hits_since_recluster = 0
+
+        self._set_cov_matrix(cov_matrix)
+
+    def optimize(self, cov_matrix: pd.DataFrame = None):
+        """Calculate the HRP weights
+        Args:
+            - cov_matrix (pd.DataFrame, LowRankCovariance or None): new covariance matrix, e.g. at the next
+              rebalance, None to keep the current one
+        Returns:
+            - (np.array) weights in the order of the columns of the covariance matrix
+        """
+        if cov_matrix is not None:
+            self._set_cov_matrix(cov_matrix)
+
+        with profiling.timer('hrp.seriation'):
+            seriation = self._matrix_seriation()
+
+        with profiling.timer('hrp.bisection'):
+            weights = self._get_weights(seriation)
+
+        return weights
+
+    def _set_cov_matrix(self, cov_matrix):
 
         self._cov_matriz = cov_matrix
         self._columns = cov_matrix.columns.to_list()
 
-    def optimize(self):
+    def _matrix_seriation(self):
+        """Quasi-diagonalization: order of the leaves of the hierarchical clustering
+        Returns:
+            - (np.array) positions of the columns sorted by the seriation
+        """
+        if not self._warm_start:
+            return leaves_list(self._get_linkage())
 
-        seriation_columns = self._matrix_seriation()
+        matrix = self._get_clustered_matrix()
 
-        weights = self._get_weights(seriation_columns)
+        if self._is_cache_valid(matrix):
+            profiling.count('hrp.cache_hits')
+            self.cache_hits += 1
+            self._hits_since_recluster += 1
+            return self._cached_seriation
 
-        return weights
+        profiling.count('hrp.cache_misses')
+        self.cache_misses += 1
+        self._hits_since_recluster = 0
+        self._cached_seriation = leaves_list(self._get_linkage(matrix))
+        self._cached_matrix = matrix
+        self._cached_columns = self._columns
 
-    def _matrix_seriation(self):
+        return self._cached_seriation
+
+    def _is_cache_valid(self, matrix):
+
+        if self._cached_seriation is None or self._cached_columns != self._columns:
+            return False
+
+        if self._recluster_every is not None and self._hits_since_recluster >= self._recluster_every:
+            return False
+
+        change = np.max(np.abs(matrix - self._cached_matrix))
+
+        # Covariâncias dependem da escala dos retornos: a variação é relativa
+        if self._distance == 'covariance':
+            change /= np.max(np.diag(self._cached_matrix))
+
+        return change <= self._threshold
+
+    def _get_clustered_matrix(self):
+        # Matriz cujas linhas (covariance) ou distâncias (correlation) entram na linkage
+        if self._distance == 'covariance':
+            return self._cov_matriz.to_numpy()
+
+        return self._get_corr_matrix()
+
+    def _get_corr_matrix(self):
+
+        cov_matrix = self._cov_matriz.to_numpy()
+
+        std = np.sqrt(np.diag(cov_matrix))
+
+        return np.clip(cov_matrix / np.outer(std, std), -1, 1)
+
+    def _get_linkage(self, matrix=None):
+
+        if matrix is None:
+            matrix = self._get_clustered_matrix()
+
+        if self._distance == 'covariance':
+            with profiling.timer('hrp.linkage'):
+                return linkage(matrix, method=self._method, metric='euclidean')
+
+        with profiling.timer('hrp.distances'):
+            distances = np.sqrt((1 - matrix) / 2)
+            np.fill_diagonal(distances, 0)
+            distances = squareform(distances, checks=False)
+
+        with profiling.timer('hrp.linkage'):
+            return linkage(distances, method=self._method)
+
+    def _get_weights(self, seriation):
+        """Recursive bisection of the seriated assets. Every cluster is a contiguous
+        range of the seriation, so each level of the bisection is computed at once
+        from cumulative sums along the seriation.
+        Args:
+            - seriation (np.array): positions of the columns sorted by the seriation
+        Returns:
+            - (np.array) weights in the original order of the columns
+        """
+        n_assets = len(seriation)
+
+        if isinstance(self._cov_matriz, LowRankCovariance):
+            inverse_diagonal, cluster_variances = self._get_low_rank_cluster_variances(seriation)
+        else:
+            inverse_diagonal, cluster_variances = self._get_dense_cluster_variances(seriation)
+
+        cumulative_inverse = np.concatenate(([0], np.cumsum(inverse_diagonal)))
+
+        weights = np.ones(n_assets)
+        starts, ends = np.array([0]), np.array([n_assets])
+
+        while True:
+            is_split = ends - starts > 1
+            if not np.any(is_split):
+                break
+
+            starts, ends = starts[is_split], ends[is_split]
+            middles = starts + (ends - starts) // 2
+
+            # Subclusters intercalados: esquerda, direita, esquerda, direita...
+            starts = np.column_stack((starts, middles)).reshape(-1)
+            ends = np.column_stack((middles, ends)).reshape(-1)
+            sizes = ends - starts
+
+            offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+            rows = np.repeat(starts - offsets, sizes) + np.arange(sizes.sum())
+
+            cluster_sums = cumulative_inverse[ends] - cumulative_inverse[starts]
+            cluster_vols = cluster_variances(starts, ends, rows, offsets) / cluster_sums ** 2
+
+            vol_left_cluster, vol_right_cluster = cluster_vols[0::2], cluster_vols[1::2]
+
+            alocation_factor = 1 - vol_left_cluster / (vol_left_cluster + vol_right_cluster)
+
+            factors = np.column_stack((alocation_factor, 1 - alocation_factor)).reshape(-1)
+            weights[rows] *= np.repeat(factors, sizes)
+
+        original_order_weights = np.empty(n_assets)
+        original_order_weights[seriation] = weights
+
+        return original_order_weights
+
+    def _get_dense_cluster_variances(self, seriation):
+        """Variance of the unnormalized inverse-variance portfolio of clusters of the
+        seriation, from the row-wise cumulative sums of the weighted covariance
+        Returns:
+            - (tuple) inverse of the variances, in the seriation order, and the function
+              (starts, ends, rows, offsets) -> variance of each cluster
+        """
+        cov_matrix = self._cov_matriz.to_numpy()[np.ix_(seriation, seriation)]
 
-        dendogram = sns.clustermap(
-            self._cov_matriz, method='ward', metric='euclidean')
+        inverse_diagonal = 1 / np.diag(cov_matrix)
 
-        seriation_columns = dendogram.dendrogram_col.reordered_ind
+        # cumulative_cov[i, j] = sum(cov[i, :j + 1] * inverse_diagonal[:j + 1])
+        cumulative_cov = cov_matrix
+        cumulative_cov *= inverse_diagonal
+        np.cumsum(cumulative_cov, axis=1, out=cumulative_cov)
 
-        seriation_columns = [self._columns[index]
-                             for index in seriation_columns]
+        def cluster_variances(starts, ends, rows, offsets):
 
-        return seriation_columns
+            sizes = ends - starts
+            row_starts = np.repeat(starts, sizes)
+            row_ends = np.repeat(ends, sizes)
 
-    def _get_weights(self, seriation_columns):
-        # Inicialização de weights
+            row_sums = cumulative_cov[rows, row_ends - 1] - \
+                np.where(row_starts > 0, cumulative_cov[rows, row_starts - 1], 0)
 
-        weights = pd.Series(1, index=seriation_columns)
-        parities = [seriation_columns]
+            return np.add.reduceat(inverse_diagonal[rows] * row_sums, offsets)
 
-        while len(parities) > 0:
-            parities = [cluster[start:end]
-                        for cluster in parities
-                        for start, end in ((0, len(cluster) // 2), (len(cluster) // 2, len(cluster)))
-                        if len(cluster) > 1]
+        return inverse_diagonal, cluster_variances
 
-            for subcluster in range(0, len(parities), 2):
+    def _get_low_rank_cluster_variances(self, seriation):
+        """Same as _get_dense_cluster_variances for a LowRankCovariance. The variance
+        of a cluster is sum(w^2 * diagonal) + sum(factor_variances * (F' w)^2), so only
+        cumulative sums of N and N x k arrays are needed
+        """
+        cov_matrix = self._cov_matriz
 
-                left_cluster = parities[subcluster]
-                right_cluster = parities[subcluster + 1]
+        diagonal = cov_matrix.diagonal[seriation]
+        factors = cov_matrix.factors[seriation]
 
-                left_cov_matrix = self._cov_matriz[left_cluster].loc[left_cluster]
-                inversa_diagonal = 1 / np.diag(left_cov_matrix.values)
-                weights_left_cluster = inversa_diagonal / \
-                    np.sum(inversa_diagonal)
-                vol_left_cluster = np.dot(weights_left_cluster, np.dot(
-                    left_cov_matrix, weights_left_cluster))
+        inverse_diagonal = 1 / (diagonal + np.square(factors) @ cov_matrix.factor_variances)
 
-                right_cov_matrix = self._cov_matriz[right_cluster].loc[right_cluster]
-                inversa_diagonal = 1 / np.diag(right_cov_matrix.values)
-                weights_right_cluster = inversa_diagonal / \
-                    np.sum(inversa_diagonal)
-                vol_right_cluster = np.dot(weights_right_cluster, np.dot(
-                    right_cov_matrix, weights_right_cluster))
+        cumulative_diagonal = np.concatenate(([0], np.cumsum(inverse_diagonal ** 2 * diagonal)))
+        cumulative_loadings = np.vstack((np.zeros(factors.shape[1]),
+                                         np.cumsum(inverse_diagonal[:, None] * factors, axis=0)))
 
-                alocation_factor = 1 - vol_left_cluster / \
-                    (vol_left_cluster + vol_right_cluster)
+        def cluster_variances(starts, ends, rows, offsets):
 
-                weights[left_cluster] *= alocation_factor
-                weights[right_cluster] *= 1 - alocation_factor
+            loadings = cumulative_loadings[ends] - cumulative_loadings[starts]
 
-        weights = weights[self._columns].to_numpy()
+            return cumulative_diagonal[ends] - cumulative_diagonal[starts] + \
+                np.square(loadings) @ cov_matrix.factor_variances
 
-        return weights
\ No newline at end of file
+        return inverse_diagonal, cluster_variances
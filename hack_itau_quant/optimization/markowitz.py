@@ -1,4 +1,7 @@
 import numpy as np
+from .. import profiling
+from ..covariance import LowRankCovariance
+from .factorization import SymmetricFactorization
 
 
 class Markowitz:
@@ -6,41 +9,86 @@ class Markowitz:
     """
 
     def __init__(self, expected_returns, cov_matrix):
+        """
+        Args:
+            - expected_returns (np.array): expected returns of the assets
+            - cov_matrix (np.array or LowRankCovariance): covariance matrix of the assets
+        """
         self._n_assets = len(expected_returns)
         self._cov_matrix = cov_matrix
         self._expected_returns = expected_returns.reshape((self._n_assets, 1))
 
-        A, B, C, D, We, Wm = self._build_magic_numbers()
+        # LowRankCovariance resolve os sistemas por Woodbury, sem matriz densa
+        if isinstance(cov_matrix, LowRankCovariance):
+            self._factorization = cov_matrix
+        else:
+            with profiling.timer('markowitz.factorization'):
+                self._factorization = SymmetricFactorization(cov_matrix)
 
-        self._A = A
-        self._B = B
-        self._C = C
-        self._D = D
+        with profiling.timer('markowitz.solve'):
+            A, B, C, D, We, Wm = self._build_magic_numbers()
+
+        self._A = A.item()
+        self._B = B.item()
+        self._C = C.item()
+        self._D = D.item()
         self._We = We
         self._Wm = Wm
 
+        self._x_min, self._z = self._solve()
+
+    def update_expected_returns(self, expected_returns):
+        """Replace the expected returns keeping the covariance matrix. This is not a
+        rank-one update: W * m is solved again for the new returns, against the cached
+        factorization of the covariance, so it costs a single O(n^2) solve
+        Args:
+            - expected_returns (np.array): new expected returns
+        """
+        self._expected_returns = np.asarray(expected_returns).reshape((self._n_assets, 1))
+
+        self._Wm = self._factorization.solve(self._expected_returns)
+
+        self._A = float(np.sum(self._Wm))
+        self._B = np.dot(self._expected_returns.T, self._Wm).item()
+        self._D = self._B * self._C - self._A ** 2
+
+        self._x_min, self._z = self._solve()
+
+    def solve(self, rhs):
+        """Solve cov_matrix * x = rhs with the cached factorization of the covariance
+        Args:
+            - rhs (np.array): right-hand side (n_assets) or (n_assets x k)
+        Returns:
+            - (np.array) solution with the shape of rhs
+        """
+        return self._factorization.solve(rhs)
+
     def optimal_risk(self, target_risk):
-        """Calculate optimization solution given target risk
+        """Calculate optimization solution given target risk. The solution is affine
+        in target_risk, so an array of targets is solved with a single outer product
         Args:
-            - target_risk (float): risk tolerance
+            - target_risk (float or np.array): risk tolerance
         Returns:
-            - (np.array) optimal weights
+            - (np.array) optimal weights, (n_assets, 1) for a float target
+              or (n_targets, n_assets) for an array of targets
         """
-        x_min, z = self._solve()
+        if np.ndim(target_risk) == 0:
+            return self._x_min + (self._z * target_risk / 2)
 
-        weights = x_min + (z * target_risk / 2)
+        target_risk = np.asarray(target_risk).reshape(-1)
 
-        return weights
+        return self._x_min.T + np.outer(target_risk / 2, self._z)
 
     def optimal_return(self, target_return):
         """Calculate optimization solution given target return
         Args:
-            - target_return (float): target return
+            - target_return (float or np.array): target return
         Returns:
-            - (np.array) optimal weights
+            - (np.array) optimal weights, (n_assets, 1) for a float target
+              or (n_targets, n_assets) for an array of targets
         """
 
-        target_risk = 2 * (target_return - self._A /
+        target_risk = 2 * (np.asarray(target_return) - self._A /
                            self._C) * self._C / self._D
 
         return self.optimal_risk(target_risk)
@@ -58,10 +106,10 @@ class Markowitz:
         step_size = (end_return - start_return)/n_points
 
         returns = np.arange(start_return, end_return, step_size)
-        weights = np.array([self.optimal_return(target_return) for target_return in returns])
-        weights = weights.squeeze()
 
-        risks = np.sqrt(np.array([np.dot(w.T, np.dot(self._cov_matrix, w)) for w in weights]))
+        with profiling.timer('markowitz.efficient_curve'):
+            weights = self.optimal_return(returns)
+            risks = self._optimal_curve(returns)
 
         return (returns, risks, weights)
 
@@ -71,12 +119,21 @@ class Markowitz:
 
         return self._A / self._C
 
+    def get_magic_numbers(self):
+        """Get the coefficients of the efficient frontier's hyperbola,
+        sigma^2 = (C * r^2 - 2 * A * r + B) / D
+        Returns:
+            - Tuple(float, float, float, float) A, B, C and D, respectively
+        """
+
+        return self._A, self._B, self._C, self._D
+
     def _build_useful_matrices(self):
-        W = np.linalg.inv(self._cov_matrix)
         e = np.ones((self._n_assets, 1))
 
-        We = np.dot(W, e)
-        Wm = np.dot(W, self._expected_returns)
+        # W * e e W * m (W = inversa da covariância) em uma única resolução, sem calcular W
+        W_e_m = self._factorization.solve(np.hstack((e, self._expected_returns)))
+        We, Wm = W_e_m[:, :1], W_e_m[:, 1:]
 
         return e, We, Wm
 
@@ -98,9 +155,15 @@ class Markowitz:
         return x_min, z
 
     def _optimal_curve(self, target_return):
+        """Risk of the efficient portfolios, given by the frontier's hyperbola
+        Args:
+            - target_return (float or np.array): target return
+        Returns:
+            - (float or np.array) standard deviation of the optimal portfolios
+        """
 
-        hyperbola = self._C * target_return ** 2 - 2 * self._A * target_return + self._B
+        hyperbola = self._C * np.square(target_return) - 2 * self._A * target_return + self._B
 
         risk = np.sqrt((1 / self._D) * hyperbola)
 
-        return float(risk)
+        return risk
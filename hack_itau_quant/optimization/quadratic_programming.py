@@ -1,4 +1,5 @@
 import numpy as np
+from .factorization import SymmetricFactorization
 
 class QuadraticProgrammig:
 
@@ -21,16 +22,435 @@ class QuadraticProgrammig:
         else:
             self._b = b
 
-    def solve(self) -> np.array:
-        C, d = self.combine_matrices()
-        x = np.dot(np.linalg.inv(C), d)
+        # Só b e c mudam entre resoluções: a matriz KKT é montada uma vez
+        self._kkt = self._build_kkt()
+        self._factorization = None
+
+    def solve(self, b: np.array = None, c: np.array = None) -> np.array:
+        """Solve the KKT system. Its LDL^T factorization is computed on the first
+        call and reused when only b or c change
+        Args:
+            - b (np.array or None): new linear term, None keeps the current one
+            - c (np.array or None): new right side of the restrictions, None keeps the current one
+        Returns:
+            - (tuple) solution and Lagrange multipliers, respectively
+        """
+        if b is not None:
+            self._b = b
+        if c is not None:
+            self._c = c
+
+        if self._factorization is None:
+            self._factorization = SymmetricFactorization(self._kkt, positive_definite=False)
+
+        x = self._factorization.solve(self._build_rhs())
         w, l = x[:self._n], x[self._n:]
-        return w, l 
+        return w, l
 
     def combine_matrices(self):
-        zeros = np.zeros((self._m, self._m))
-        left_side = np.concatenate((self._B, self._A), axis=0)
-        right_side = np.concatenate((self._A.T, zeros), axis=0)
-        C = np.concatenate((left_side, right_side), axis=1)
-        d = np.concatenate((self._b, self._c), axis=0)
-        return (C, d)
+        return (self._kkt, self._build_rhs())
+
+    def _build_kkt(self):
+        C = np.zeros((self._n + self._m, self._n + self._m))
+        C[:self._n, :self._n] = self._B
+        C[self._n:, :self._n] = self._A
+        C[:self._n, self._n:] = self._A.T
+        return C
+
+    def _build_rhs(self):
+        d = np.empty((self._n + self._m, 1))
+        d[:self._n] = np.reshape(self._b, (self._n, 1))
+        d[self._n:] = np.reshape(self._c, (self._m, 1))
+        return d
+
+
+class BatchedQuadraticProgramming:
+    """Many equality constrained quadratic programs of the same shape
+
+        min x' * B[i] * x - b[i]' * x
+        s.t. A[i] x = c[i]
+
+    solved at once. The KKT systems are written into buffers allocated on the
+    first call and reused while the shapes do not change, and all of them are
+    solved by a single np.linalg.solve over the leading batch dimension.
+    """
+
+    def __init__(self):
+        self._kkt = None
+        self._rhs = None
+
+    def solve(self, B: np.array, A: np.array, c: np.array, b: np.array = None) -> np.array:
+        """Solve the batch of KKT systems. Inputs without the batch dimension
+        are shared by every problem
+        Args:
+            - B (np.array): Hessian matrices (batch x n x n) or (n x n)
+            - A (np.array): restrictions (batch x m x n) or (m x n)
+            - c (np.array): right side of the restrictions (batch x m) or (m)
+            - b (np.array or None): linear terms (batch x n) or (n), zero by default
+        Returns:
+            - (tuple) solutions (batch x n x 1) and Lagrange multipliers (batch x m x 1)
+        """
+        n = B.shape[-1]
+        m = A.shape[-2]
+
+        batch_sizes = [B.shape[0] if B.ndim == 3 else 1,
+                       A.shape[0] if A.ndim == 3 else 1,
+                       np.shape(c)[0] if np.ndim(c) == 2 else 1]
+        if b is not None:
+            batch_sizes.append(np.shape(b)[0] if np.ndim(b) == 2 else 1)
+        batch_size = max(batch_sizes)
+
+        self._allocate(batch_size, n, m)
+
+        self._kkt[:, :n, :n] = B
+        self._kkt[:, n:, :n] = A
+        self._kkt[:, :n, n:] = np.swapaxes(A, -1, -2)
+
+        self._rhs[:, :n, 0] = 0 if b is None else np.reshape(b, (-1, n))
+        self._rhs[:, n:, 0] = np.reshape(c, (-1, m))
+
+        x = np.linalg.solve(self._kkt, self._rhs)
+
+        return x[:, :n], x[:, n:]
+
+    def _allocate(self, batch_size, n, m):
+
+        shape = (batch_size, n + m, n + m)
+        if self._kkt is not None and self._kkt.shape == shape:
+            return
+
+        # O bloco inferior direito da KKT é zero e nunca é sobrescrito
+        self._kkt = np.zeros(shape)
+        self._rhs = np.zeros((batch_size, n + m, 1))
+
+
+class ConstrainedQuadraticProgramming:
+    """Quadratic program with equality and inequality constraints
+
+        min 1/2 x' * B * x - b' * x
+        s.t. A x = c
+             lower <= x <= upper
+             G x <= h
+             sum(|x - previous_weights|) <= max_turnover
+
+    solved by ADMM (operator splitting, as in OSQP) followed by a polishing step
+    that solves the KKT system of the active constraints exactly. The last
+    solution is kept and used as the starting point of the next solve, so after
+    an update of b, c, the bounds or the turnover anchor, or for a nearby problem
+    given through warm_start, only a few iterations are needed.
+    """
+
+    def __init__(self, B: np.array, b: np.array = None, A: np.array = None, c: np.array = None,
+                 lower: np.array = None, upper: np.array = None, G: np.array = None,
+                 h: np.array = None, previous_weights: np.array = None, max_turnover: float = None,
+                 rho: float = 0.1, max_iter: int = 10000, tol: float = 1e-9):
+        """
+        Args:
+            - B (np.array): Hessian matrix (n x n), positive semidefinite
+            - b (np.array or None): linear term (n)
+            - A (np.array or None): equality restrictions (m x n)
+            - c (np.array or None): right side of the equality restrictions (m)
+            - lower (np.array, float or None): lower bounds of x
+            - upper (np.array, float or None): upper bounds of x
+            - G (np.array or None): inequality restrictions (k x n), e.g. group caps
+            - h (np.array or None): right side of the inequality restrictions (k)
+            - previous_weights (np.array or None): reference of the turnover restriction
+            - max_turnover (float or None): maximum sum(|x - previous_weights|)
+            - rho (float): initial ADMM step size, adapted during the iterations
+            - max_iter (int): maximum number of ADMM iterations
+            - tol (float): tolerance of the primal and dual residuals
+        """
+        if max_turnover is not None and previous_weights is None:
+            raise ValueError("max_turnover needs previous_weights")
+
+        self._n = B.shape[0]
+        self._has_turnover = max_turnover is not None
+        self._n_variables = 2 * self._n if self._has_turnover else self._n
+
+        self._rho = rho
+        self._sigma = 1e-6
+        self._alpha = 1.6
+        self._max_iter = max_iter
+        self._tol = tol
+
+        # Escala do objetivo para que custos da ordem de variâncias diárias convirjam
+        self._cost_scale = 1 / max(np.abs(np.diag(B)).max(), 1e-12)
+
+        self._P = np.zeros((self._n_variables, self._n_variables))
+        self._P[:self._n, :self._n] = B * self._cost_scale
+        self._q = np.zeros(self._n_variables)
+
+        self._build_constraints(A, G)
+
+        self.update(b=b, c=c, lower=lower, upper=upper, h=h,
+                    previous_weights=previous_weights, max_turnover=max_turnover)
+
+        self._factorization = None
+        self._x = None
+        self._z = None
+        self._y = None
+
+        self.iterations = 0
+        self.status = None
+
+    @classmethod
+    def portfolio(cls, cov_matrix: np.array, expected_returns: np.array = None,
+                  target_return: float = None, lower=0., upper=1., groups: np.array = None,
+                  group_caps: np.array = None, previous_weights: np.array = None,
+                  max_turnover: float = None, **kwargs):
+        """Minimum variance portfolio, fully invested, with optional target return,
+        bounds, group caps and turnover limit
+        Args:
+            - cov_matrix (np.array): covariance matrix of the assets
+            - expected_returns (np.array or None): expected returns, needed by target_return
+            - target_return (float or None): required expected return of the portfolio
+            - lower (float or np.array): minimum weight of each asset, 0 for long-only
+            - upper (float or np.array): maximum weight of each asset
+            - groups (np.array or None): membership matrix (n_groups x n_assets)
+            - group_caps (np.array or None): maximum weight of each group
+            - previous_weights (np.array or None): current portfolio
+            - max_turnover (float or None): maximum sum(|weights - previous_weights|)
+        Returns:
+            - (ConstrainedQuadraticProgramming) problem to be solved
+        """
+        cov_matrix = np.asarray(cov_matrix)
+        n_assets = cov_matrix.shape[0]
+
+        A = np.ones((1, n_assets))
+        c = np.ones(1)
+        if target_return is not None:
+            A = np.vstack((A, np.reshape(expected_returns, (1, n_assets))))
+            c = np.array([1., target_return])
+
+        return cls(cov_matrix, A=A, c=c, lower=lower, upper=upper, G=groups, h=group_caps,
+                   previous_weights=previous_weights, max_turnover=max_turnover, **kwargs)
+
+    @property
+    def n_constraints(self):
+        """Number of rows of the restrictions, i.e. of the multipliers given by solve"""
+        return self._M.shape[0]
+
+    def update(self, b: np.array = None, c: np.array = None, lower=None, upper=None,
+               h: np.array = None, previous_weights: np.array = None, max_turnover: float = None):
+        """Change the vectors of the problem. The matrices are kept, so the
+        factorization and the last solution are reused by the next solve
+        Args:
+            - the same as the constructor, None keeps the current value
+        """
+        n = self._n
+
+        if b is not None:
+            self._q[:n] = -np.reshape(b, -1) * self._cost_scale
+        if c is not None:
+            self._l[self._equality] = self._u[self._equality] = np.reshape(c, -1)
+        if lower is not None:
+            self._l[self._bounds] = lower
+        if upper is not None:
+            self._u[self._bounds] = upper
+        if h is not None:
+            self._u[self._inequality] = np.reshape(h, -1)
+
+        if previous_weights is not None:
+            previous_weights = np.reshape(previous_weights, -1)
+            self._u[self._turnover_upper] = previous_weights
+            self._l[self._turnover_lower] = previous_weights
+        if max_turnover is not None:
+            self._u[self._turnover_budget] = max_turnover
+
+    def solve(self, warm_start: tuple = None) -> np.array:
+        """Solve the problem
+        Args:
+            - warm_start (tuple or None): solution and multipliers of a similar problem,
+              by default the last solution of this problem
+        Returns:
+            - (tuple) solution (n x 1) and multipliers of the restrictions (rows of
+              A, bounds, G and turnover, in this order), respectively
+        """
+        if warm_start is not None:
+            self._set_warm_start(*warm_start)
+
+        if self._x is None:
+            self._x = np.zeros(self._n_variables)
+            self._z = np.clip(np.dot(self._M, self._x), self._l, self._u)
+            self._y = np.zeros(self._M.shape[0])
+            self._admm()
+        elif self._polish():
+            # O conjunto ativo da solução anterior continua ótimo
+            self.iterations = 0
+            self.status = 'solved'
+        else:
+            self._admm()
+
+        w = self._x[:self._n].reshape(-1, 1)
+        l = (self._y / self._cost_scale).reshape(-1, 1)
+
+        return w, l
+
+    def _build_constraints(self, A, G):
+        n = self._n
+
+        blocks = []
+        if A is not None:
+            blocks.append(('equality', np.asarray(A, dtype=float)))
+        blocks.append(('bounds', np.eye(n)))
+        if G is not None:
+            blocks.append(('inequality', np.asarray(G, dtype=float)))
+        if self._has_turnover:
+            # |x - x0| <= t, sum(t) <= max_turnover
+            blocks.append(('turnover_upper', np.hstack((np.eye(n), -np.eye(n)))))
+            blocks.append(('turnover_lower', np.hstack((np.eye(n), np.eye(n)))))
+            blocks.append(('turnover_budget', np.hstack((np.zeros((1, n)), np.ones((1, n))))))
+
+        rows = []
+        start = 0
+        for name in ('equality', 'bounds', 'inequality', 'turnover_upper',
+                     'turnover_lower', 'turnover_budget'):
+            setattr(self, '_' + name, slice(start, start))
+
+        for name, block in blocks:
+            if block.shape[1] < self._n_variables:
+                block = np.hstack((block, np.zeros((block.shape[0], self._n_variables - n))))
+            rows.append(block)
+            setattr(self, '_' + name, slice(start, start + block.shape[0]))
+            start += block.shape[0]
+
+        self._M = np.vstack(rows)
+        self._l = np.full(start, -np.inf)
+        self._u = np.full(start, np.inf)
+
+    def _set_warm_start(self, x, y):
+        n = self._n
+
+        self._x = np.zeros(self._n_variables)
+        self._x[:n] = np.reshape(x, -1)
+        if self._has_turnover:
+            self._x[n:] = np.abs(self._x[:n] - self._u[self._turnover_upper])
+
+        self._z = np.clip(np.dot(self._M, self._x), self._l, self._u)
+        self._y = np.zeros(self._M.shape[0]) if y is None else \
+            np.reshape(y, -1) * self._cost_scale
+
+    def _get_step_sizes(self):
+        # Restrições de igualdade recebem passos maiores, como no OSQP
+        rho = np.full(self._M.shape[0], self._rho)
+        rho[self._l == self._u] *= 1e3
+
+        return rho
+
+    def _factor(self, rho):
+        K = self._P + self._sigma * np.eye(self._n_variables) + \
+            np.dot(self._M.T * rho, self._M)
+
+        self._factorization = SymmetricFactorization(K)
+        self._factored_rho = rho
+
+    def _admm(self):
+        x, z, y = self._x, self._z, self._y
+
+        rho = self._get_step_sizes()
+        if self._factorization is None or not np.array_equal(rho, self._factored_rho):
+            self._factor(rho)
+
+        self.status = 'max_iter'
+        for iteration in range(1, self._max_iter + 1):
+
+            x_tilde = self._factorization.solve(
+                self._sigma * x - self._q + np.dot(self._M.T, rho * z - y))
+            z_tilde = np.dot(self._M, x_tilde)
+
+            x = self._alpha * x_tilde + (1 - self._alpha) * x
+            z_relaxed = self._alpha * z_tilde + (1 - self._alpha) * z
+            z_new = np.clip(z_relaxed + y / rho, self._l, self._u)
+            y = y + rho * (z_relaxed - z_new)
+            z = z_new
+
+            if iteration % 10 != 0:
+                continue
+
+            Mx = np.dot(self._M, x)
+            Px = np.dot(self._P, x)
+            My = np.dot(self._M.T, y)
+
+            primal_residual = np.abs(Mx - z).max()
+            dual_residual = np.abs(Px + self._q + My).max()
+
+            primal_scale = max(np.abs(Mx).max(), np.abs(z).max(), 1)
+            dual_scale = max(np.abs(Px).max(), np.abs(My).max(), np.abs(self._q).max(), 1)
+
+            if primal_residual <= self._tol * primal_scale and \
+                    dual_residual <= self._tol * dual_scale:
+                self.status = 'solved'
+                break
+
+            if iteration % 50 == 0 and primal_residual <= 1e-4 * primal_scale and \
+                    dual_residual <= 1e-4 * dual_scale:
+                self._x, self._z, self._y = x, z, y
+                if self._polish():
+                    self.status = 'solved'
+                    self.iterations = iteration
+                    return
+
+            if iteration % 50 == 0:
+                ratio = np.sqrt((primal_residual / primal_scale) /
+                                max(dual_residual / dual_scale, 1e-30))
+                if ratio > 5 or ratio < 0.2:
+                    self._rho = float(np.clip(self._rho * ratio, 1e-6, 1e6))
+                    rho = self._get_step_sizes()
+                    self._factor(rho)
+
+        self.iterations = iteration
+        self._x, self._z, self._y = x, z, y
+
+        self._polish()
+
+    def _polish(self):
+        """Solve the KKT system of the restrictions active at the current iterate.
+        When the active set is right this gives the exact solution
+        Returns:
+            - (bool) whether the polished point satisfies the optimality conditions
+        """
+        is_equality = self._l == self._u
+        is_lower = ((self._z - self._l < -self._y) & np.isfinite(self._l)) | is_equality
+        is_upper = (self._u - self._z < self._y) & np.isfinite(self._u) & ~is_lower
+        active = np.flatnonzero(is_lower | is_upper)
+
+        M_active = self._M[active]
+        bounds = np.where(is_lower[active], self._l[active], self._u[active])
+
+        n_active = len(active)
+        delta = 1e-9
+
+        kkt = np.block([[self._P, M_active.T],
+                        [M_active, np.zeros((n_active, n_active))]])
+        regularization = np.concatenate((np.full(self._n_variables, delta),
+                                         np.full(n_active, -delta)))
+        rhs = np.concatenate((-self._q, bounds))
+
+        try:
+            factorization = SymmetricFactorization(kkt + np.diag(regularization),
+                                                   positive_definite=False)
+        except np.linalg.LinAlgError:
+            return False
+
+        # Refinamento iterativo remove o viés da regularização
+        solution = factorization.solve(rhs)
+        for _ in range(5):
+            solution += factorization.solve(rhs - np.dot(kkt, solution))
+
+        x = solution[:self._n_variables]
+        y = np.zeros(self._M.shape[0])
+        y[active] = solution[self._n_variables:]
+
+        Mx = np.dot(self._M, x)
+        tolerance = 1e-7 * max(np.abs(Mx).max(), 1)
+
+        is_feasible = np.all(Mx >= self._l - tolerance) and np.all(Mx <= self._u + tolerance)
+        has_right_signs = np.all(y[is_lower & ~is_equality] <= tolerance) and \
+            np.all(y[is_upper & ~is_equality] >= -tolerance)
+
+        if not (is_feasible and has_right_signs):
+            return False
+
+        self._x, self._z, self._y = x, np.clip(Mx, self._l, self._u), y
+
+        return True
@@ -0,0 +1,228 @@
+"""Timers and counters of the stages of Backtesting and of the optimizers.
+
+The instrumented code calls ``timer``, ``count`` and ``step``, which do
+nothing (a global lookup and a shared no-op context manager) unless a
+Profiler is active:
+
+    with Profiler(profile_step='2020-03-02') as profiler:
+        values = backtesting.run()
+
+    profiler.to_frame()    # seconds of each stage at each rebalance date
+    profiler.summary()     # calls, total and mean seconds of each stage
+    profiler.cprofile.sort_stats('cumulative').print_stats(20)
+
+Stage names are dotted, e.g. 'hrp.linkage', and a stage includes the time of
+the stages nested inside it. Only the main process is recorded: with a
+process pool, the strategies computed by the workers are not timed.
+"""
+import contextlib
+import cProfile
+import json
+import pstats
+import time
+
+import numpy as np
+
+# Profiler ativo, None quando a instrumentação está desligada
+_active = None
+
+
+class _NullContext:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+def timer(name: str, step=None):
+    """Context manager timing a stage
+    Args:
+        - name (str): name of the stage
+        - step (object or None): step of the stage, e.g. a rebalance date, None for the
+          current step
+    """
+    if _active is None:
+        return _NULL_CONTEXT
+
+    return _active._timer(name, step)
+
+
+def count(name: str, n: int = 1, step=None):
+    """Increment a counter
+    Args:
+        - name (str): name of the counter
+        - n (int): increment
+        - step (object or None): step of the count, None for the current step
+    """
+    if _active is not None:
+        _active._counts.append((_active._step if step is None else step, name, n))
+
+
+def step(label):
+    """Context manager setting the step of the stages run inside it
+    Args:
+        - label (object): label of the step, e.g. a rebalance date
+    """
+    if _active is None:
+        return _NULL_CONTEXT
+
+    return _active._step_context(label)
+
+
+class Profiler:
+    """Records the timers and counters while active (inside a with block)
+    """
+
+    def __init__(self, profile_step=None):
+        """
+        Args:
+            - profile_step (object or None): label of a step run under cProfile, whose
+              statistics are kept in ``cprofile``
+        """
+        self.profile_step = profile_step
+        self.cprofile = None
+
+        self._timings = []
+        self._counts = []
+        self._step = None
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+
+        self._previous, _active = _active, self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+
+        _active, self._previous = self._previous, None
+        return False
+
+    def timings(self) -> 'pd.DataFrame':
+        """Every timed stage, in the order they finished
+        Returns:
+            - (pd.DataFrame) columns step, stage and seconds
+        """
+        # pandas só é importado ao montar as tabelas: os otimizadores importam este módulo
+        import pandas as pd
+
+        return pd.DataFrame(self._timings, columns=['step', 'stage', 'seconds'])
+
+    def counters(self) -> 'pd.DataFrame':
+        """Total of each counter at each step
+        Returns:
+            - (pd.DataFrame) steps x counters
+        """
+        return Profiler._pivot(self._counts, 'counter').astype(int)
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """Per step breakdown of the time spent in each stage
+        Returns:
+            - (pd.DataFrame) seconds, steps (in order of execution) x stages. Stages run
+              outside any step are in the row of step None
+        """
+        return Profiler._pivot(self._timings, 'stage')
+
+    def summary(self) -> 'pd.DataFrame':
+        """Calls, total, mean and maximum seconds of each stage, slowest first
+        """
+        summary = self.timings().groupby('stage')['seconds'].agg(['count', 'sum', 'mean', 'max'])
+        summary.columns = ['calls', 'total', 'mean', 'max']
+
+        return summary.sort_values('total', ascending=False)
+
+    def to_json(self, path: str = None) -> str:
+        """Summary, per step breakdown and counters as JSON
+        Args:
+            - path (str or None): file where the JSON is also written
+        Returns:
+            - (str) JSON document
+        """
+        def records(df):
+            df = df.reset_index()
+            labels = df[df.columns[0]]
+            df[df.columns[0]] = labels.map(lambda label: None if label is None else str(label))
+            return df.to_dict(orient='records')
+
+        document = json.dumps({
+            'summary': records(self.summary()),
+            'steps': records(self.to_frame()),
+            'counters': records(self.counters()),
+        }, indent=2)
+
+        if path is not None:
+            with open(path, 'w') as file:
+                file.write(document)
+
+        return document
+
+    @staticmethod
+    def _pivot(records, name):
+        """Sum of the values of (step, name, value) records, steps x names in order
+        of appearance. Steps may mix None and dates, so they are not sorted
+        """
+        import pandas as pd
+
+        steps = list(dict.fromkeys(record[0] for record in records))
+        names = list(dict.fromkeys(record[1] for record in records))
+
+        step_positions = {label: i for i, label in enumerate(steps)}
+        name_positions = {label: i for i, label in enumerate(names)}
+
+        values = np.zeros((len(steps), len(names)))
+        for label, record_name, value in records:
+            values[step_positions[label], name_positions[record_name]] += value
+
+        return pd.DataFrame(values, index=pd.Index(steps, name='step', dtype=object),
+                            columns=pd.Index(names, name=name))
+
+    @contextlib.contextmanager
+    def _timer(self, name, step):
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._timings.append((self._step if step is None else step, name,
+                                  time.perf_counter() - start))
+
+    @contextlib.contextmanager
+    def _step_context(self, label):
+
+        previous, self._step = self._step, label
+
+        profile = None
+        if self.cprofile is None and self._is_profile_step(label):
+            profile = cProfile.Profile()
+            profile.enable()
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.cprofile = pstats.Stats(profile)
+
+            self._step = previous
+
+    def _is_profile_step(self, label):
+
+        if self.profile_step is None:
+            return False
+
+        import pandas as pd
+
+        # Datas podem ser dadas como texto, e.g. '2020-03-02'
+        if isinstance(label, pd.Timestamp) and not isinstance(self.profile_step, pd.Timestamp):
+            try:
+                return label == pd.Timestamp(self.profile_step)
+            except (TypeError, ValueError):
+                return False
+
+        return label == self.profile_step
@@ -0,0 +1,259 @@
+import warnings
+
+import numpy as np
+from .optimization import HRP, Markowitz
+from .optimization.quadratic_programming import ConstrainedQuadraticProgramming
+
+
+class RebalanceInputs:
+    """Estimates available at a rebalance date. They are computed once by
+    Backtesting and shared by every strategy.
+    """
+
+    def __init__(self, date, prices, returns, cov_matrix, expected_returns):
+        """
+        Args:
+            - date (pd.Timestamp): rebalance date, the first period held with the new
+              weights. The estimates only use data before it
+            - prices (pd.DataFrame): prices of the estimation window
+            - returns (pd.DataFrame): returns of the estimation window
+            - cov_matrix (pd.DataFrame): covariance matrix of the returns
+            - expected_returns (pd.Series): expected returns of the assets
+        """
+        self.date = date
+        self.prices = prices
+        self.returns = returns
+        self.cov_matrix = cov_matrix
+        self.expected_returns = expected_returns
+
+    @property
+    def n_assets(self):
+        return self.cov_matrix.shape[0]
+
+    def without_history(self):
+        """Copy without the prices and returns of the estimation window, e.g. to
+        send to workers whose strategies don't read them
+        Returns:
+            - (RebalanceInputs) estimates of the date, with prices and returns None
+        """
+        return RebalanceInputs(self.date, prices=None, returns=None, cov_matrix=self.cov_matrix,
+                               expected_returns=self.expected_returns)
+
+
+class Strategy:
+    """Base class of the allocation strategies used by Backtesting.
+    Subclasses must define ``name`` and implement ``get_weights``.
+
+    Strategies that keep state between rebalance dates must set ``sequential``
+    so Backtesting calls them in date order, in the main process, and clear
+    that state in ``reset``, called before the first date of every backtest.
+
+    Strategies that only read the estimates (cov_matrix, expected_returns) may
+    unset ``uses_history``, so the prices and returns of the estimation window
+    are not sent to the workers of a parallel backtest.
+    """
+
+    name = None
+    sequential = False
+    uses_history = True
+
+    def reset(self):
+        """Forget the state kept between rebalance dates
+        """
+        pass
+
+    def get_weights(self, inputs):
+        """Calculate the portfolio weights at a rebalance date
+        Args:
+            - inputs (RebalanceInputs): estimates available at the date
+        Returns:
+            - (np.array) weight of each asset
+        """
+        raise NotImplementedError
+
+
+class EqualWeight(Strategy):
+
+    name = 'Equal Weight'
+    uses_history = False
+
+    def get_weights(self, inputs):
+
+        return np.ones(inputs.n_assets) / inputs.n_assets
+
+
+class MonteCarloMinVolatility(Strategy):
+    """Minimum volatility portfolio among random portfolios, given by the
+    Markowitz optimizer of turingquant
+    """
+
+    name = 'Markowitz'
+
+    def get_weights(self, inputs):
+
+        # Biblioteca do Turing USP implementada por nós!
+        from turingquant.optimizers import Markowitz as MonteCarloMarkowitz
+
+        markowitz = MonteCarloMarkowitz(inputs.prices)
+        weights = markowitz.best_portfolio('volatility')
+
+        return weights
+
+
+class MinVariance(Strategy):
+    """Global minimum variance portfolio, given by the closed form solution
+    of the Markowitz problem (short positions allowed)
+    """
+
+    name = 'Minimum Variance'
+    uses_history = False
+
+    def get_weights(self, inputs):
+
+        markowitz = Markowitz(expected_returns=inputs.expected_returns.to_numpy(),
+                              cov_matrix=inputs.cov_matrix.to_numpy())
+
+        return markowitz.optimal_risk(0).reshape(-1)
+
+
+class LongOnlyMinVariance(Strategy):
+    """Minimum variance portfolio without short positions, with optional
+    weight cap and turnover limit relative to the previous rebalance. Each
+    solve is warm started from the solution of the previous date.
+
+    When the solver doesn't converge the previous weights are kept (equal
+    weights at the first date, feasible whenever the problem is) with a
+    RuntimeWarning, and the next date is warm started from the last converged
+    solution.
+    """
+
+    name = 'Long-only Minimum Variance'
+    sequential = True
+    uses_history = False
+
+    def __init__(self, upper=1., max_turnover=None):
+        """
+        Args:
+            - upper (float): maximum weight of each asset
+            - max_turnover (float or None): maximum sum(|weights - previous weights|)
+        """
+        self._upper = upper
+        self._max_turnover = max_turnover
+
+        self.reset()
+
+    def reset(self):
+
+        self._last_solution = None
+
+    def get_weights(self, inputs):
+
+        previous_weights = None
+        if self._max_turnover is not None and self._last_solution is not None:
+            previous_weights = self._last_solution[0]
+
+        qp = ConstrainedQuadraticProgramming.portfolio(
+            inputs.cov_matrix.to_numpy(), upper=self._upper, previous_weights=previous_weights,
+            max_turnover=self._max_turnover if previous_weights is not None else None)
+
+        # Os multiplicadores só servem de ponto inicial se as restrições forem as mesmas
+        warm_start = None
+        if self._last_solution is not None:
+            weights, multipliers = self._last_solution
+            if multipliers.shape[0] != qp.n_constraints:
+                multipliers = None
+            warm_start = (weights, multipliers)
+
+        solution = qp.solve(warm_start=warm_start)
+
+        # Um iterado não convergido pode violar as restrições: mantém a carteira anterior
+        if qp.status != 'solved':
+            warnings.warn(f"{self.name} at {inputs.date} did not converge ({qp.status}): the "
+                          "previous weights are kept", RuntimeWarning, stacklevel=2)
+
+            if self._last_solution is not None:
+                return self._last_solution[0].reshape(-1)
+
+            return np.ones(inputs.n_assets) / inputs.n_assets
+
+        self._last_solution = solution
+
+        return solution[0].reshape(-1)
+
+
+class HierarchicalRiskParity(Strategy):
+
+    name = 'HRP'
+    uses_history = False
+
+    def __init__(self, name=None, **hrp_parameters):
+        """
+        Args:
+            - name (str or None): column name of the strategy, defaults to 'HRP'
+            - hrp_parameters: parameters given to HRP. With warm_start=True the same
+              HRP is reused between rebalance dates to cache its clustering
+        """
+        if name is not None:
+            self.name = name
+
+        self._hrp_parameters = hrp_parameters
+        self.sequential = hrp_parameters.get('warm_start', False)
+
+        self.reset()
+
+    def reset(self):
+
+        self._hrp = None
+
+    def get_weights(self, inputs):
+
+        if not self.sequential:
+            return HRP(inputs.cov_matrix, **self._hrp_parameters).optimize()
+
+        if self._hrp is None:
+            self._hrp = HRP(inputs.cov_matrix, **self._hrp_parameters)
+            return self._hrp.optimize()
+
+        return self._hrp.optimize(inputs.cov_matrix)
+
+    @property
+    def hrp(self):
+        """HRP reused between rebalance dates when warm_start is set"""
+        return self._hrp
+
+
+STRATEGIES = {
+    'equal_weight': EqualWeight,
+    'markowitz': MonteCarloMinVolatility,
+    'min_variance': MinVariance,
+    'long_only_min_variance': LongOnlyMinVariance,
+    'hrp': HierarchicalRiskParity,
+}
+
+
+def register_strategy(key, strategy_class):
+    """Register a strategy so Backtesting can refer to it by key
+    Args:
+        - key (str): name used to refer to the strategy
+        - strategy_class (type): subclass of Strategy
+    """
+    if not issubclass(strategy_class, Strategy):
+        raise TypeError("strategy_class must be a subclass of Strategy")
+
+    STRATEGIES[key] = strategy_class
+
+
+def get_strategy(strategy):
+    """Get a strategy instance from a registered key or an instance
+    Args:
+        - strategy (str or Strategy): key of a registered strategy or a strategy instance
+    Returns:
+        - (Strategy) strategy instance
+    """
+    if isinstance(strategy, Strategy):
+        return strategy
+
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'. Available: {list(STRATEGIES)}")
+
+    return STRATEGIES[strategy]()
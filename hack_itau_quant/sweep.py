@@ -0,0 +1,160 @@
+import itertools
+
+import pandas as pd
+from .analytics import PerformanceAnalytics
+from .backtesting import Backtesting, _compute_weights
+
+
+class BacktestingSweep:
+    """Run Backtesting over a grid of parameters sharing the returns, the
+    covariance estimates and the strategy weights between combinations.
+
+    The weights at a rebalance date only depend on the date and on the
+    estimation window, so they are computed once per unique (date, window,
+    halflife) and reused by every combination that rebalances on that date.
+    Sequential strategies depend on their previous rebalance as well, so they
+    are reset and computed again for each combination, in date order.
+    """
+
+    PARAMETERS = ['rebalance_frequency', 'initial_investment', 'investment_on_rebalance',
+                  'window', 'halflife']
+
+    DEFAULTS = {'initial_investment': 1, 'investment_on_rebalance': 0,
+                'window': None, 'halflife': None}
+
+    def __init__(self, prices, strategies=None, periods_per_year=252):
+        """
+        Args:
+            - prices (pd.DataFrame): close prices of the assets
+            - strategies (list or None): Strategy instances or registered keys
+            - periods_per_year (int): number of periods used to annualize the statistics
+        """
+        self._backtesting = Backtesting(prices, rebalance_frequency=1, initial_investment=1,
+                                        investment_on_rebalance=0, strategies=strategies)
+        self._periods_per_year = periods_per_year
+
+        strategies = self._backtesting._strategies
+        self._pooled = [strategy for strategy in strategies if not strategy.sequential]
+        self._sequential = [strategy for strategy in strategies if strategy.sequential]
+
+        # Pesos das estratégias sem estado, por (data, janela, meia-vida)
+        self._weights = dict()
+
+    def run(self, grid, n_jobs=1, backend='process'):
+        """Backtest every combination of the grid
+        Args:
+            - grid (dict or list): dict mapping parameters to lists of values, or a list of
+              such dicts. 'rebalance_frequency' is required, the other parameters of
+              Backtesting default to DEFAULTS
+            - n_jobs (int): number of workers used to compute the weights, -1 to use every core
+            - backend (str): 'process' or 'thread' pool
+        Returns:
+            - (pd.DataFrame) one row per combination and strategy with its statistics
+        """
+        combinations = BacktestingSweep._get_combinations(grid)
+
+        self._compute_missing_weights(combinations, n_jobs, backend)
+
+        rows = []
+        for combination in combinations:
+
+            backtesting = self._backtesting._replace(**combination)
+            rebalance_dates = backtesting._get_rebalance_dates()
+
+            values = backtesting._chain_values(
+                rebalance_dates, self._get_weights(backtesting, combination, rebalance_dates))
+            returns = backtesting.get_returns(values)
+
+            statistics = self._get_statistics(values, returns, backtesting.turnover)
+            statistics['total_invested'] = combination['initial_investment'] + \
+                combination['investment_on_rebalance'] * (len(rebalance_dates) - 1)
+
+            for strategy, row in statistics.iterrows():
+                rows.append({**combination, 'strategy': strategy, **row.to_dict()})
+
+        return pd.DataFrame(rows)
+
+    def _get_weights(self, backtesting, combination, rebalance_dates):
+        """Weights of every strategy at the rebalance dates of a combination: the
+        cached weights of the pooled strategies and, computed now, the weights of
+        the sequential ones
+        Returns:
+            - (generator) weights (strategies x assets) of each rebalance date
+        """
+        estimation = (combination['window'], combination['halflife'])
+        pooled_weights = (self._weights[(t, *estimation)] for t in rebalance_dates)
+
+        if not self._sequential:
+            return pooled_weights
+
+        for strategy in self._sequential:
+            strategy.reset()
+
+        sequential_weights = (_compute_weights(self._sequential, date_inputs)
+                              for date_inputs in backtesting._get_rebalance_inputs(rebalance_dates))
+
+        return (backtesting._merge_weights(self._pooled, date_pooled_weights,
+                                           self._sequential, date_sequential_weights)
+                for date_pooled_weights, date_sequential_weights
+                in zip(pooled_weights, sequential_weights))
+
+    def _compute_missing_weights(self, combinations, n_jobs, backend):
+        """Compute the weights of the pooled strategies at every (date, window,
+        halflife) not cached yet, sharing a single pool between the estimation windows
+        """
+        dates = dict()
+        for combination in combinations:
+            backtesting = self._backtesting._replace(**combination)
+            estimation = (combination['window'], combination['halflife'])
+
+            dates.setdefault(estimation, set()).update(
+                t for t in backtesting._get_rebalance_dates()
+                if (t, *estimation) not in self._weights)
+
+        keys = []
+        inputs = []
+        for (window, halflife), estimation_dates in dates.items():
+            estimation_dates = sorted(estimation_dates)
+
+            keys.extend((t, window, halflife) for t in estimation_dates)
+
+            backtesting = self._backtesting._replace(window=window, halflife=halflife)
+            inputs.append(backtesting._get_rebalance_inputs(estimation_dates))
+
+        pooled = self._backtesting._replace(strategies=self._pooled)
+        weights = pooled._get_weights(itertools.chain(*inputs), n_jobs, backend)
+
+        self._weights.update(zip(keys, weights))
+
+    def _get_statistics(self, values, returns, turnover):
+
+        analytics = PerformanceAnalytics(periods_per_year=self._periods_per_year)
+        statistics = analytics.update(returns, turnover).summary()
+
+        statistics.insert(0, 'final_value', values.iloc[-1])
+
+        return statistics[['final_value', 'total_return', 'annual_return', 'annual_volatility',
+                           'sharpe', 'max_drawdown', 'annual_turnover']]
+
+    @staticmethod
+    def _get_combinations(grid):
+
+        if isinstance(grid, dict):
+            grid = [grid]
+
+        combinations = []
+        for subgrid in grid:
+
+            unknown = set(subgrid) - set(BacktestingSweep.PARAMETERS)
+            if unknown:
+                raise ValueError(f"Unknown parameters {sorted(unknown)}")
+
+            if 'rebalance_frequency' not in subgrid:
+                raise ValueError("The grid must define rebalance_frequency")
+
+            names = list(subgrid)
+            for values in itertools.product(*(subgrid[name] for name in names)):
+                combination = {**BacktestingSweep.DEFAULTS, **dict(zip(names, values))}
+                combinations.append({name: combination[name] for name in BacktestingSweep.PARAMETERS})
+
+        return combinations
@@ -0,0 +1,71 @@
+"""PerformanceAnalytics updated chunk by chunk must give the statistics of a
+single update with every period, which match pandas.
+"""
+import numpy as np
+import pandas as pd
+
+from hack_itau_quant.analytics import PerformanceAnalytics
+
+
+def get_returns(n_periods=300, seed=0):
+
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('2020-01-01', periods=n_periods)
+
+    returns = pd.DataFrame(rng.normal(.0005, .01, size=(n_periods, 3)), index=index,
+                           columns=['a', 'b', 'c'])
+    turnover = pd.DataFrame(rng.uniform(0, .5, size=(n_periods // 20, 3)), index=index[::20][:n_periods // 20],
+                            columns=returns.columns)
+
+    return returns, turnover
+
+
+def get_analytics():
+
+    return PerformanceAnalytics(periods_per_year=252, risk_free=.02, rolling_window=40,
+                                transaction_cost=1e-3)
+
+
+# Blocos menores e maiores que a janela móvel
+CHUNKS = [1, 5, 39, 60, 2, 120, 73]
+
+
+def test_incremental_matches_one_shot():
+
+    returns, turnover = get_returns()
+
+    one_shot = get_analytics().update(returns, turnover)
+
+    incremental = get_analytics()
+    end = 0
+    for size in CHUNKS:
+        chunk = returns.iloc[end:end + size]
+        incremental.update(chunk, turnover)
+        end += size
+
+    assert incremental.n_obs == one_shot.n_obs == len(returns)
+
+    pd.testing.assert_frame_equal(incremental.summary(), one_shot.summary(), rtol=1e-10)
+
+    for net in [False, True]:
+        pd.testing.assert_frame_equal(incremental.drawdown(net), one_shot.drawdown(net), rtol=1e-10)
+        pd.testing.assert_frame_equal(incremental.rolling_volatility(net),
+                                      one_shot.rolling_volatility(net), rtol=1e-8)
+        pd.testing.assert_frame_equal(incremental.rolling_sharpe(net), one_shot.rolling_sharpe(net),
+                                      rtol=1e-8)
+
+
+def test_one_shot_matches_pandas():
+
+    returns, _ = get_returns()
+    analytics = get_analytics().update(returns)
+    summary = analytics.summary()
+
+    growth = (1 + returns).cumprod()
+
+    np.testing.assert_allclose(summary['total_return'], growth.iloc[-1] - 1, rtol=1e-10)
+    np.testing.assert_allclose(summary['annual_volatility'], returns.std() * np.sqrt(252), rtol=1e-10)
+    np.testing.assert_allclose(summary['max_drawdown'], (growth / growth.cummax() - 1).min(), rtol=1e-10)
+
+    rolling_volatility = returns.rolling(40).std() * np.sqrt(252)
+    pd.testing.assert_frame_equal(analytics.rolling_volatility()[39:], rolling_volatility[39:], rtol=1e-8)
@@ -0,0 +1,129 @@
+"""StreamingCovariance against pandas estimates of the whole history at each
+update, in the three modes, and LowRankCovariance against its dense matrix.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from hack_itau_quant.covariance import LowRankCovariance, StreamingCovariance
+
+
+def get_returns(n_periods=400, n_assets=6, seed=0):
+
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(scale=.01, size=(n_periods, n_assets)) + rng.normal(scale=.01, size=(n_periods, 1))
+
+    return pd.DataFrame(returns + .001)
+
+
+# Blocos de tamanhos variados, incluindo blocos maiores que a janela
+BLOCKS = [1, 7, 30, 2, 150, 60, 1, 149]
+
+
+def iterate_blocks(estimator, returns):
+
+    end = 0
+    for size in BLOCKS:
+        end += size
+        estimator.update(returns.iloc[end - size:end])
+        yield end
+
+
+@pytest.mark.parametrize('ddof', [0, 1])
+def test_expanding_matches_pandas(ddof):
+
+    returns = get_returns()
+    estimator = StreamingCovariance(returns.shape[1], ddof=ddof)
+
+    for end in iterate_blocks(estimator, returns):
+        if end <= ddof:
+            continue
+
+        np.testing.assert_allclose(estimator.mean(), returns[:end].mean(), atol=1e-15)
+        np.testing.assert_allclose(estimator.covariance(), returns[:end].cov(ddof=ddof), rtol=1e-10,
+                                   atol=1e-17)
+
+
+def test_rolling_matches_pandas():
+
+    returns = get_returns()
+    window = 100
+    estimator = StreamingCovariance(returns.shape[1], window=window)
+
+    for end in iterate_blocks(estimator, returns):
+        if end < 2:
+            continue
+
+        expected = returns[max(end - window, 0):end]
+
+        assert estimator.n_obs == len(expected)
+        np.testing.assert_allclose(estimator.mean(), expected.mean(), atol=1e-15)
+        np.testing.assert_allclose(estimator.covariance(), expected.cov(), rtol=1e-10, atol=1e-17)
+
+
+def test_exponentially_weighted_matches_pandas():
+
+    returns = get_returns()
+    halflife = 30
+    estimator = StreamingCovariance(returns.shape[1], halflife=halflife)
+
+    ewm = returns.ewm(halflife=halflife, adjust=False)
+    means, covariances = ewm.mean(), ewm.cov(bias=True)
+
+    for end in iterate_blocks(estimator, returns):
+
+        np.testing.assert_allclose(estimator.mean(), means.iloc[end - 1], atol=1e-15)
+        np.testing.assert_allclose(estimator.covariance(), covariances.loc[end - 1], rtol=1e-10,
+                                   atol=1e-17)
+
+
+def test_exponentially_weighted_rejects_ddof():
+
+    with pytest.raises(ValueError):
+        StreamingCovariance(3, halflife=30, ddof=0)
+
+
+def get_low_rank_covariance(n_assets=50, n_factors=4, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    return LowRankCovariance(rng.uniform(.5, 1., n_assets), rng.normal(size=(n_assets, n_factors)),
+                             rng.uniform(.1, 2., n_factors))
+
+
+@pytest.mark.parametrize('shape', [(50,), (50, 3)])
+def test_low_rank_dot_and_solve_match_dense(shape):
+
+    cov_matrix = get_low_rank_covariance()
+    dense = cov_matrix.to_numpy()
+    rhs = np.random.default_rng(1).normal(size=shape)
+
+    np.testing.assert_allclose(cov_matrix.dot(rhs), dense @ rhs, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(cov_matrix @ rhs, dense @ rhs, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(cov_matrix.solve(rhs), np.linalg.solve(dense, rhs), rtol=1e-9)
+    np.testing.assert_allclose(cov_matrix.variances(), np.diag(dense), rtol=1e-12)
+
+
+def test_low_rank_solve_without_woodbury_matches_dense():
+
+    cov_matrix = get_low_rank_covariance(n_assets=6)
+    rhs = np.random.default_rng(2).normal(size=6)
+
+    # Fator de variância nula é descartado; diagonal nula usa a fatoração densa
+    cov_matrix.factor_variances[0] = 0
+    np.testing.assert_allclose(cov_matrix.solve(rhs), np.linalg.solve(cov_matrix.to_numpy(), rhs),
+                               rtol=1e-9)
+
+    cov_matrix = get_low_rank_covariance(n_assets=6)
+    cov_matrix.diagonal[2] = 0
+    np.testing.assert_allclose(cov_matrix.solve(rhs), np.linalg.solve(cov_matrix.to_numpy(), rhs),
+                               rtol=1e-9)
+
+
+def test_low_rank_rescale_matches_dense():
+
+    cov_matrix = get_low_rank_covariance()
+    std = np.random.default_rng(3).uniform(.01, .05, 50)
+
+    np.testing.assert_allclose(cov_matrix.rescale(std).to_numpy(),
+                               cov_matrix.to_numpy() * np.outer(std, std), rtol=1e-12)
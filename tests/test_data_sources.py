@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+# pyarrow é opcional e sua importação falha com versões incompatíveis do NumPy
+pytest.importorskip('pyarrow', exc_type=ImportError)
+
+from hack_itau_quant.data_sources import CachedDataSource, FakeTerminalBackend, PriceStore
+
+
+def test_dates_without_data_are_fetched_again():
+
+    backend = FakeTerminalBackend(today='2021-03-10')
+    store = PriceStore(today='2021-03-10')
+    source = CachedDataSource(backend, store)
+
+    first = source.bdh('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-31')
+    assert first.index.max() == pd.Timestamp('2021-03-09')
+
+    # Os dados de 10/03 em diante são publicados depois da primeira consulta
+    backend.today = store.today = pd.Timestamp('2021-04-01')
+    second = source.bdh('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-31')
+
+    assert second.index.max() == pd.Timestamp('2021-03-31')
+    assert backend.requests[-1][2:] == (pd.Timestamp('2021-03-10'), pd.Timestamp('2021-03-31'))
+    pd.testing.assert_frame_equal(second.loc[:'2021-03-09'], first)
+
+    # Tudo já foi buscado: nenhuma nova consulta ao terminal
+    n_requests = len(backend.requests)
+    source.bdh('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-31')
+    assert len(backend.requests) == n_requests
+
+
+def test_published_dates_without_data_are_not_fetched_again():
+
+    backend = FakeTerminalBackend(today='2021-03-31')
+    store = PriceStore(today='2021-03-31', publication_lag=5)
+    source = CachedDataSource(backend, store)
+
+    # 14/03 é um domingo, já publicado; 27 e 28/03 ainda podem receber dados
+    for end in ['2021-03-14', '2021-03-28']:
+        source.bdh('IBOV Index', 'PX_LAST', '2021-03-01', end)
+
+    assert store.missing('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-28') == \
+        [(pd.Timestamp('2021-03-27'), pd.Timestamp('2021-03-28'))]
+
+    n_requests = len(backend.requests)
+    source.bdh('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-14')
+    assert len(backend.requests) == n_requests
+
+    # Passado o atraso de publicação, o fim de semana é marcado como buscado
+    backend.today = store.today = pd.Timestamp('2021-04-12')
+    source.bdh('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-28')
+    assert store.missing('IBOV Index', 'PX_LAST', '2021-03-01', '2021-03-28') == []
@@ -0,0 +1,22 @@
+import numpy as np
+
+from benchmarks.synthetic import factor_model_returns
+from hack_itau_quant.denoising import Denoising, RollingDenoising
+
+
+def test_rolling_matches_fresh_denoising():
+
+    returns = factor_model_returns(100, 800, seed=0)
+    window, step = 300, 50
+
+    rolling = RollingDenoising(alpha=.5).rolling(returns, window, step)
+
+    for i, (date, cov_matrix) in enumerate(rolling):
+
+        window_returns = returns.iloc[i * step:i * step + window]
+        assert window_returns.index[-1] == date
+
+        expected = Denoising(window_returns, n_facts=5, alpha=.5).denoised_covariance()
+
+        np.testing.assert_allclose(cov_matrix.to_numpy(), expected.to_numpy(),
+                                   rtol=0, atol=1e-8 * np.abs(expected.to_numpy()).max())
@@ -0,0 +1,81 @@
+"""EfficientFrontier.max_loss against a grid search along the frontier.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from hack_itau_quant.efficient_frontier import EfficientFrontier
+
+Z_ALPHA = -1.645
+
+
+def get_frontier(seed=0):
+
+    returns = np.random.default_rng(seed).normal(.0005, .01, size=(500, 8))
+
+    return EfficientFrontier(pd.Series(returns.mean(axis=0)), pd.DataFrame(np.cov(returns, rowvar=False)))
+
+
+def get_gap(frontier, loss, period):
+
+    A, B, C, D = frontier._solver.get_magic_numbers()
+    c = -Z_ALPHA * period ** -0.25
+
+    return lambda r: r * period - c * np.sqrt((C * np.square(r) - 2 * A * r + B) / D) - loss
+
+
+def get_grid(frontier):
+
+    start_return = frontier._solver.get_start_return()
+
+    return np.linspace(start_return, start_return + .05, 500001)
+
+
+def test_gap_peak_matches_grid():
+
+    frontier = get_frontier()
+    period = np.array([1., 2., 5.])
+    grid = get_grid(frontier)
+
+    peaks = frontier._max_gap_returns(period, -Z_ALPHA * period ** -0.25)
+
+    for i, length in enumerate(period):
+        assert peaks[i] == pytest.approx(grid[np.argmax(get_gap(frontier, 0, length)(grid))], abs=1e-6)
+
+
+def test_bisection_finds_roots_below_the_peak():
+
+    frontier = get_frontier()
+    period = np.array([1., 5.])
+    c = -Z_ALPHA * period ** -0.25
+
+    # Perdas em que o gap é negativo em max_return = 1 mas positivo perto do pico
+    peaks = frontier._max_gap_returns(period, c)
+    loss = np.array([get_gap(frontier, 0, length)(peak) for length, peak in zip(period, peaks)]) - 1e-4
+
+    gap = get_gap(frontier, loss, period)
+    assert np.all(gap(np.ones(2)) < 0)
+
+    returns = EfficientFrontier._bisect(gap, np.full(2, frontier._solver.get_start_return()),
+                                        peaks, n_bisections=200)
+
+    np.testing.assert_allclose(returns, frontier._max_loss_returns(loss, period, Z_ALPHA), rtol=1e-9)
+    assert np.all(gap(returns) >= -1e-12)
+
+
+@pytest.mark.parametrize('period', [1, 5, 20, 60])
+def test_max_loss_matches_grid(period):
+
+    frontier = get_frontier()
+    grid = get_grid(frontier)
+    losses = np.array([-.2, -.06, -.02, -.005])
+
+    returns = frontier._max_loss_returns(losses, np.full(4, float(period)), Z_ALPHA)
+
+    for loss, found in zip(losses, returns):
+        passing = grid[get_gap(frontier, loss, period)(grid) >= 0]
+
+        if len(passing) == 0:
+            assert np.isnan(found)
+        else:
+            assert found == pytest.approx(passing[0], abs=1e-6)
@@ -0,0 +1,31 @@
+from benchmarks.synthetic import factor_model_returns, prices_from_returns
+from hack_itau_quant.backtesting import Backtesting
+from hack_itau_quant.profiling import Profiler
+from hack_itau_quant.strategies import EqualWeight
+
+
+def test_rebalance_outputs_share_dates():
+
+    class RecordDates(EqualWeight):
+
+        name = 'Record Dates'
+
+        def reset(self):
+            self.dates = []
+
+        def get_weights(self, inputs):
+            self.dates.append(inputs.date)
+            assert inputs.returns.index.max() < inputs.date
+            return super().get_weights(inputs)
+
+    strategy = RecordDates()
+    prices = prices_from_returns(factor_model_returns(12, 600))
+    backtesting = Backtesting(prices, rebalance_frequency=50, initial_investment=1,
+                              investment_on_rebalance=0, strategies=[strategy])
+
+    with Profiler() as profiler:
+        values = backtesting.run()
+
+    assert list(backtesting.turnover.index) == strategy.dates
+    assert list(profiler.to_frame().index) == strategy.dates
+    assert backtesting.turnover.index[0] == values.index[0]
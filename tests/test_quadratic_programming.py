@@ -0,0 +1,161 @@
+"""Quadratic programming solvers against reference solutions:
+BatchedQuadraticProgramming against QuadraticProgrammig solving one problem
+at a time, and ConstrainedQuadraticProgramming against a general purpose
+solver (SLSQP) on the constraints used by the strategies.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.optimize import minimize
+
+from hack_itau_quant.optimization.quadratic_programming import (BatchedQuadraticProgramming,
+                                                                ConstrainedQuadraticProgramming,
+                                                                QuadraticProgrammig)
+from hack_itau_quant.strategies import LongOnlyMinVariance, RebalanceInputs
+
+
+def get_cov_matrix(n_assets, n_periods, seed=0):
+
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(scale=.01, size=(n_periods, n_assets)) + rng.normal(scale=.01, size=(n_periods, 1))
+
+    return np.cov(returns, rowvar=False)
+
+
+def test_batched_matches_looping():
+
+    rng = np.random.default_rng(4)
+    n_problems, n, m = 5, 8, 2
+
+    B = np.stack([get_cov_matrix(n, 100, seed=seed) for seed in range(n_problems)])
+    A = rng.normal(size=(n_problems, m, n))
+    c = rng.normal(size=(n_problems, m))
+    b = rng.normal(size=(n_problems, n))
+
+    solver = BatchedQuadraticProgramming()
+
+    # Entradas sem a dimensão do lote são compartilhadas por todos os problemas
+    for shared in [(), ('A', 'c'), ('B', 'b')]:
+        inputs = {'B': B, 'A': A, 'c': c, 'b': b}
+        for name in shared:
+            inputs[name] = inputs[name][0]
+
+        weights, multipliers = solver.solve(**inputs)
+
+        for i in range(n_problems):
+            problem = {name: value if name in shared else value[i] for name, value in inputs.items()}
+            expected_weights, expected_multipliers = QuadraticProgrammig(
+                problem['B'], problem['A'], problem['c'].reshape(-1, 1), problem['b'].reshape(-1, 1)).solve()
+
+            np.testing.assert_allclose(weights[i], expected_weights, rtol=1e-8, atol=1e-10)
+            np.testing.assert_allclose(multipliers[i], expected_multipliers, rtol=1e-8, atol=1e-10)
+
+
+def solve_reference(cov_matrix, upper=1., groups=None, group_caps=None, previous_weights=None,
+                    max_turnover=None):
+    """Minimum variance portfolio by SLSQP, with the turnover split in |x - x0| <= t
+    """
+    n = cov_matrix.shape[0]
+    n_variables = 2 * n if max_turnover is not None else n
+
+    constraints = [{'type': 'eq', 'fun': lambda v: v[:n].sum() - 1}]
+    if groups is not None:
+        constraints.append({'type': 'ineq', 'fun': lambda v: group_caps - groups @ v[:n]})
+    if max_turnover is not None:
+        constraints += [{'type': 'ineq', 'fun': lambda v: v[n:] - (v[:n] - previous_weights)},
+                        {'type': 'ineq', 'fun': lambda v: v[n:] + (v[:n] - previous_weights)},
+                        {'type': 'ineq', 'fun': lambda v: max_turnover - v[n:].sum()}]
+
+    bounds = [(0, upper)] * n + [(0, None)] * (n_variables - n)
+    x0 = np.concatenate((np.full(n, 1. / n), np.zeros(n_variables - n)))
+    if max_turnover is not None:
+        x0[n:] = np.abs(x0[:n] - previous_weights)
+
+    result = minimize(lambda v: v[:n] @ cov_matrix @ v[:n], x0,
+                      jac=lambda v: np.concatenate((2 * cov_matrix @ v[:n], np.zeros(n_variables - n))),
+                      bounds=bounds, constraints=constraints, method='SLSQP',
+                      options={'ftol': 1e-15, 'maxiter': 1000})
+    assert result.success, result.message
+
+    return result.x[:n]
+
+
+def assert_same_optimum(cov_matrix, weights, reference, upper=1., groups=None, group_caps=None,
+                        previous_weights=None, max_turnover=None, atol=1e-7):
+
+    assert weights.sum() == pytest.approx(1, abs=atol)
+    assert weights.min() >= -atol
+    assert weights.max() <= upper + atol
+    if groups is not None:
+        assert np.all(groups @ weights <= group_caps + atol)
+    if max_turnover is not None:
+        assert np.abs(weights - previous_weights).sum() <= max_turnover + atol
+
+    # Com T < N a solução pode não ser única: compara a variância
+    variance, reference_variance = weights @ cov_matrix @ weights, reference @ cov_matrix @ reference
+    assert variance <= reference_variance * (1 + 1e-6) + 1e-14
+
+
+@pytest.mark.parametrize('n_periods', [500, 20])
+def test_bounds_match_reference(n_periods):
+
+    cov_matrix = get_cov_matrix(30, n_periods)
+
+    qp = ConstrainedQuadraticProgramming.portfolio(cov_matrix, upper=.1)
+    weights = qp.solve()[0].reshape(-1)
+
+    assert qp.status == 'solved'
+    assert_same_optimum(cov_matrix, weights, solve_reference(cov_matrix, upper=.1), upper=.1)
+
+
+@pytest.mark.parametrize('n_periods', [500, 20])
+def test_group_caps_match_reference(n_periods):
+
+    cov_matrix = get_cov_matrix(30, n_periods, seed=1)
+    groups = np.kron(np.eye(3), np.ones(10))
+    group_caps = np.array([.5, .2, .4])
+
+    qp = ConstrainedQuadraticProgramming.portfolio(cov_matrix, upper=.2, groups=groups,
+                                                   group_caps=group_caps)
+    weights = qp.solve()[0].reshape(-1)
+
+    reference = solve_reference(cov_matrix, upper=.2, groups=groups, group_caps=group_caps)
+
+    assert qp.status == 'solved'
+    assert_same_optimum(cov_matrix, weights, reference, upper=.2, groups=groups, group_caps=group_caps)
+
+
+@pytest.mark.parametrize('n_periods', [500, 20])
+def test_turnover_matches_reference(n_periods):
+
+    cov_matrix = get_cov_matrix(30, n_periods, seed=2)
+    previous_weights = np.random.default_rng(3).dirichlet(np.ones(30))
+
+    qp = ConstrainedQuadraticProgramming.portfolio(cov_matrix, upper=.3, previous_weights=previous_weights,
+                                                   max_turnover=.4)
+    weights = qp.solve()[0].reshape(-1)
+
+    reference = solve_reference(cov_matrix, upper=.3, previous_weights=previous_weights, max_turnover=.4)
+
+    assert qp.status == 'solved'
+    assert_same_optimum(cov_matrix, weights, reference, upper=.3, previous_weights=previous_weights,
+                        max_turnover=.4)
+
+
+def test_long_only_min_variance_discards_unconverged_solutions(monkeypatch):
+
+    cov_matrix = pd.DataFrame(get_cov_matrix(20, 200))
+    inputs = RebalanceInputs(date=0, prices=None, returns=None, cov_matrix=cov_matrix,
+                             expected_returns=None)
+
+    portfolio = ConstrainedQuadraticProgramming.portfolio.__func__
+    monkeypatch.setattr(ConstrainedQuadraticProgramming, 'portfolio',
+                        classmethod(lambda cls, *args, **kwargs: portfolio(cls, *args, max_iter=1, **kwargs)))
+
+    strategy = LongOnlyMinVariance(upper=.3)
+
+    with pytest.warns(RuntimeWarning, match='did not converge'):
+        weights = strategy.get_weights(inputs)
+
+    np.testing.assert_array_equal(weights, np.full(20, 1 / 20))
+    assert strategy._last_solution is None
@@ -0,0 +1,110 @@
+"""Results of Backtesting and BacktestingSweep must not depend on the call
+history of their strategies: every run starts from a clean state.
+"""
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import factor_model_returns, prices_from_returns
+from hack_itau_quant.backtesting import Backtesting
+from hack_itau_quant.denoising import RollingDenoising
+from hack_itau_quant.strategies import EqualWeight, HierarchicalRiskParity, LongOnlyMinVariance
+from hack_itau_quant.sweep import BacktestingSweep
+
+
+def get_prices(n_assets=12, n_periods=600, seed=0):
+
+    return prices_from_returns(factor_model_returns(n_assets, n_periods, seed=seed))
+
+
+def get_strategies():
+
+    return ['equal_weight', LongOnlyMinVariance(upper=.3, max_turnover=.2)]
+
+
+def test_backtesting_runs_are_reproducible():
+
+    backtesting = Backtesting(get_prices(), rebalance_frequency=50, initial_investment=1,
+                              investment_on_rebalance=0, window=200, strategies=get_strategies())
+
+    first = backtesting.run()
+    second = backtesting.run()
+
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_sweep_matches_backtesting_with_sequential_strategies():
+
+    prices = get_prices()
+    grid = {'rebalance_frequency': [30, 50], 'window': [200]}
+
+    sweep = BacktestingSweep(prices, strategies=get_strategies()).run(grid)
+
+    for rebalance_frequency in grid['rebalance_frequency']:
+        backtesting = Backtesting(prices, rebalance_frequency=rebalance_frequency,
+                                  initial_investment=1, investment_on_rebalance=0, window=200,
+                                  strategies=get_strategies())
+        final_values = backtesting.run().iloc[-1]
+
+        rows = sweep[sweep['rebalance_frequency'] == rebalance_frequency]
+        np.testing.assert_allclose(rows.set_index('strategy')['final_value'][final_values.index],
+                                   final_values, rtol=1e-10)
+
+
+def test_warm_started_hrp_in_sweep_matches_backtesting():
+
+    prices = get_prices()
+    grid = {'rebalance_frequency': [20, 30], 'window': [100, 200]}
+
+    def get_hrp():
+        return HierarchicalRiskParity(warm_start=True, threshold=.5)
+
+    sweep = BacktestingSweep(prices, strategies=[get_hrp()]).run(grid)
+
+    for _, row in sweep.iterrows():
+        backtesting = Backtesting(prices, rebalance_frequency=row['rebalance_frequency'],
+                                  initial_investment=1, investment_on_rebalance=0,
+                                  window=row['window'], strategies=[get_hrp()])
+        final_value = backtesting.run().iloc[-1, 0]
+
+        np.testing.assert_allclose(row['final_value'], final_value, rtol=1e-10)
+
+
+def test_backtesting_runs_with_rolling_denoising_are_reproducible():
+
+    backtesting = Backtesting(get_prices(n_assets=40), rebalance_frequency=50, initial_investment=1,
+                              investment_on_rebalance=0, halflife=60,
+                              strategies=['min_variance', 'hrp'], denoising=RollingDenoising())
+
+    first = backtesting.run()
+    second = backtesting.run()
+
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_parallel_backtesting_matches_serial():
+
+    class HistoryCheck(EqualWeight):
+
+        name = 'History Check'
+        uses_history = False
+
+        received_history = False
+
+        def get_weights(self, inputs):
+            self.received_history |= inputs.prices is not None or inputs.returns is not None
+            return super().get_weights(inputs)
+
+    history_check = HistoryCheck()
+    strategies = [history_check, 'min_variance', 'hrp', LongOnlyMinVariance(upper=.3, max_turnover=.2)]
+
+    # 23 datas de rebalanceamento, mais que as 2 * n_jobs em voo
+    backtesting = Backtesting(get_prices(), rebalance_frequency=25, initial_investment=1,
+                              investment_on_rebalance=0, window=200, strategies=strategies)
+
+    serial = backtesting.run()
+
+    history_check.received_history = False
+    parallel = backtesting.run(n_jobs=2, backend='thread')
+
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert not history_check.received_history